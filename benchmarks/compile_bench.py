@@ -0,0 +1,84 @@
+"""Template compile time against slot count.
+
+Compares the single-pass compiler with the old per-slot ``re.sub`` loop. Only the templates are
+compiled to pattern strings on either side: building a ``TemplateProcessor`` also compiles the regex
+and works out its literals, which the old loop never did.
+
+    python benchmarks/compile_bench.py [--repeat 5] [--number 20] [--slots 10,50,100,500,1000]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from reify.compiler import tokenize, compile_input, input_slot
+
+
+BLOCK = """<p class="calibre8">
+    <a href="#_ftn{{:}}" id="_ftnref{{:}}">
+        <span lang="EN">[{{n%d}}]</span>
+    </a>
+    <span class="calibre{{:d}}">{{}}</span>
+</p>
+"""
+
+
+def make_template(slots: int) -> str:
+    blocks = []
+    for i in range(slots // 4 + 1):
+        blocks.append(BLOCK % i)
+    return "".join(blocks)
+
+
+def legacy_compile(template: str) -> str:
+    def find_slots(text):
+        for i, c in enumerate(text):
+            if i == 0:
+                prev_char = c
+                continue
+            if c == "{" and prev_char == "{":
+                token = ""
+                i = i + 1
+                c = text[i]
+                while c != "}" or text[i + 1] != "}":
+                    token += c
+                    i = i + 1
+                    c = text[i]
+                yield token
+            prev_char = c
+
+    pattern = template
+    tokens = find_slots(pattern)
+    pattern = re.sub(r"[\\\[(=/!|?\"\'.]", lambda m: f"\\{m.group(0)}", pattern)
+    pattern = re.sub(r"\n+", lambda m: r"\s*", pattern)
+    pattern = re.sub(r"\s{2,}", lambda m: r"\s*", pattern)
+    for t in tokens:
+        pattern = re.sub("{{(%s)}}" % t, lambda m: input_slot(m.group(1)), pattern, count=1)
+    return pattern
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=20, help="compiles per timing")
+    parser.add_argument("--slots", default="10,50,100,500,1000")
+    args = parser.parse_args()
+
+    print(f"{'slots':>8} {'chars':>9} {'compiler (ms)':>14} {'legacy (ms)':>12} {'speedup':>8}")
+    for n in (int(s) for s in args.slots.split(",")):
+        template = make_template(n)
+        slots = template.count("{{")
+        assert compile_input(tokenize(template), False) == legacy_compile(template)
+
+        new = min(timeit.repeat(lambda: compile_input(tokenize(template), False),
+                                number=args.number, repeat=args.repeat)) / args.number
+        old = min(timeit.repeat(lambda: legacy_compile(template),
+                                number=args.number, repeat=args.repeat)) / args.number
+        print(f"{slots:>8} {len(template):>9} {new * 1000:>14.2f} {old * 1000:>12.2f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Synthetic calibre-style HTML documents for benchmarking.
+
+Footnotes are filled in from a template (``input.template.html`` by default) and scattered between
+ordinary paragraphs. Like real converter output, the whitespace between tags is all over the place:
+blocks are sometimes squashed onto one line, sometimes indented with tabs or a random number of
+spaces. Documents are reproducible for a given seed.
+
+    python benchmarks/corpus.py [--size 1M] [--density 0.1] [--near-miss 0] [--seed 0] > corpus.html
+"""
+import argparse
+import os
+import random
+import re
+import sys
+
+
+HERE = os.path.dirname(__file__)
+TEMPLATE = os.path.join(HERE, "..", "input.template.html")
+
+WORDS = ("the of and to in that was his he it with is for as had you not be her on at by which have "
+         "or from this him but all she they were my are me one their so an said them we who would "
+         "been will no when there if more out up into do any your what has man could other than "
+         "our some very time upon about may its only now like little then can should made did us").split()
+
+
+def parse_size(size: str) -> int:
+    """Turn a size such as ``512K`` or ``4M`` into a number of characters"""
+    units = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    m = re.fullmatch(r"(\d+)([KMG]?)B?", size.strip().upper())
+    if m is None:
+        raise ValueError(f"Invalid size {size!r}")
+    return int(m.group(1)) * units[m.group(2)]
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def fill(template: str, i: int, rng: random.Random) -> str:
+    """Fill every slot of a template with text it matches"""
+    def value(m):
+        token = m.group(1)
+        if token == ":d":
+            return str(rng.randrange(1, 10))
+        if token == ":":
+            return f"ftn{i}"
+        if token.startswith(":"):
+            return ""
+        if token == "num":
+            return str(i)
+        return sentence(rng, rng.randrange(1, 8))[:-1]
+
+    return re.sub(r"{{(.*?)}}", value, template)
+
+
+def mess_up(block: str, rng: random.Random) -> str:
+    """Reformat the whitespace between the tags of a block the way converters tend to"""
+    style = rng.random()
+    if style < 0.2:
+        return re.sub(r"\n\s*", "", block)
+
+    def indent(m):
+        if style < 0.5:
+            return "\n" + "\t" * rng.randrange(0, 4)
+        return "\n" + " " * rng.randrange(0, 17)
+
+    return re.sub(r"\n\s*", indent, block)
+
+
+def paragraph(rng: random.Random) -> str:
+    sentences = [sentence(rng, rng.randrange(4, 20)) for _ in range(rng.randrange(1, 6))]
+    if rng.random() < 0.3:
+        i = rng.randrange(len(sentences))
+        sentences[i] = f'<span class="calibre{rng.randrange(1, 12)}">{sentences[i]}</span>'
+    return f'<p class="calibre{rng.randrange(1, 12)}">{" ".join(sentences)}</p>\n'
+
+
+def make_corpus(template: str, size: int, density: float, seed: int = 0, near_miss: float = 0.0) -> str:
+    """A document of about `size` characters where a fraction `density` of the blocks are footnotes
+    built from `template`. A fraction `near_miss` of the footnotes is broken at the very end, so
+    matching them fails only after all the slots have been tried."""
+    rng = random.Random(seed)
+    template = template.strip("\n")
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml">\n<body>\n']
+    length = len(parts[0])
+    footnotes = 0
+    while length < size:
+        if rng.random() < density:
+            block = mess_up(fill(template, footnotes, rng), rng)
+            if rng.random() < near_miss:
+                block = block[:block.rindex("<")] + "</div>"
+            block += "\n"
+            footnotes += 1
+        else:
+            block = paragraph(rng)
+        parts.append(block)
+        length += len(block)
+
+    parts.append("</body>\n</html>\n")
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--template", default=TEMPLATE)
+    parser.add_argument("--size", default="1M")
+    parser.add_argument("--density", type=float, default=0.1)
+    parser.add_argument("--near-miss", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.template, "r") as h:
+        template = h.read()
+    sys.stdout.write(make_corpus(template, parse_size(args.size), args.density, args.seed, args.near_miss))
+
+
+if __name__ == "__main__":
+    main()
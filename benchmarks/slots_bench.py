@@ -0,0 +1,79 @@
+"""Matching time for each slot mode with the bundled input.template.html.
+
+Documents are calibre-style footnotes on a single line, as exported by many converters. In the
+near-miss documents every footnote is broken at its very end, so each attempt has to fail only
+after the slots have consumed as much as they are allowed to.
+
+    python benchmarks/slots_bench.py [--blocks 4,6,8] [--repeat 3]
+
+Greedy and lazy slots blow up on the near-miss documents, so keep --blocks small.
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from reify.TemplateProcessor import TemplateProcessor
+from reify.compiler import SLOT_MODES
+
+
+HERE = os.path.dirname(__file__)
+TEMPLATE = os.path.join(HERE, "..", "input.template.html")
+
+TYPED = {
+    "{{:}}": "{{::..64}}",
+    "{{num}}": "{{num:int}}",
+}
+
+
+def fill(template: str, i: int) -> str:
+    values = {"": f"ftn{i}", ":": f"ref{i}", ":d": "3", "num": str(i),
+              "2": f"Footnote {i}", "3": "See", "4": "Some Book", "5": f"p. {i}."}
+    return re.sub(r"{{(.*?)}}", lambda m: values.get(m.group(1), "x"), template)
+
+
+def make_document(template: str, blocks: int, near_miss: bool) -> str:
+    parts = []
+    for i in range(blocks):
+        block = re.sub(r"\n\s*", "", fill(template, i))
+        if near_miss:
+            block = block[:-len("</p>")] + "</div>"
+        parts.append(block)
+    return "".join(parts) + "\n"
+
+
+def typed(template: str) -> str:
+    for old, new in TYPED.items():
+        template = template.replace(old, new)
+    return template
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blocks", default="4,6,8")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(TEMPLATE, "r") as h:
+        template = h.read()
+
+    variants = [(mode, TemplateProcessor(template, None, False, mode)) for mode in SLOT_MODES]
+    variants.append(("typed+delimited", TemplateProcessor(typed(template), None, False, "delimited")))
+
+    print(f"{'blocks':>7} {'document':>9} {'mode':>16} {'matches':>8} {'time (ms)':>10}")
+    for n in (int(b) for b in args.blocks.split(",")):
+        for near_miss in (False, True):
+            document = make_document(template, n, near_miss)
+            for name, p in variants:
+                count = sum(1 for _ in p.regex.finditer(document))
+                t = min(timeit.repeat(lambda: sum(1 for _ in p.regex.finditer(document)),
+                                      number=1, repeat=args.repeat))
+                kind = "near-miss" if near_miss else "matching"
+                print(f"{n:>7} {kind:>9} {name:>16} {count:>8} {t * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Compile time, matching throughput and peak memory on synthetic corpora, written out as JSON.
+
+Every combination of corpus size and footnote density is generated with ``corpus.py`` and timed
+with ``find`` and ``find_and_replace``. Peak memory is measured with tracemalloc in a separate run,
+so it doesn't slow down the timings. Pass the results of an earlier run with --compare to report
+anything that got slower by more than --tolerance, in which case the exit status is 1.
+
+    python benchmarks/suite.py [--sizes 256K,1M,4M] [--densities 0.01,0.1,0.5] [--near-miss 0]
+                               [--slot-mode greedy] [--engine re] [--repeat 3] [--seed 0]
+                               [--output results.json] [--compare baseline.json] [--tolerance 0.2]
+
+Greedy slots blow up on near misses that are squashed onto a single line, so runs taking longer
+than --timeout seconds per document are recorded as timed out instead of holding up the suite.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from reify.TemplateProcessor import TemplateProcessor
+from reify.compiler import SLOT_MODES, collapse_whitespace, input_slot, output_slot
+from reify.engine import ENGINES, PathologicalTemplateError
+
+from corpus import TEMPLATE, make_corpus, parse_size
+
+
+HERE = os.path.dirname(__file__)
+OUTPUT_TEMPLATE = os.path.join(HERE, "..", "output.template.html")
+
+# Results where lower is better, which --compare checks for regressions
+TIMINGS = ("compile_s", "find_s", "subs_s")
+
+
+def best_of(repeat: int, function) -> float:
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def cold(build):
+    # The compiler memoizes slots and whitespace, so without this every compile after the first is a cache hit
+    for cached in (collapse_whitespace, input_slot, output_slot):
+        cached.cache_clear()
+    return build()
+
+
+def peak_memory(function) -> int:
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_corpus(p: TemplateProcessor, file: str, repeat: int) -> dict:
+    size = os.path.getsize(file)
+    find = lambda: sum(1 for _ in p.find(file))
+    subs = lambda: p.find_and_replace(file, False)
+    result = {"bytes": size}
+    try:
+        result["matches"] = find()
+        result["find_s"] = best_of(repeat, find)
+        result["subs_s"] = best_of(repeat, subs)
+    except PathologicalTemplateError:
+        result["error"] = "timeout"
+        return result
+
+    result["find_mb_s"] = size / result["find_s"] / (1 << 20)
+    result["subs_mb_s"] = size / result["subs_s"] / (1 << 20)
+    result["find_peak_bytes"] = peak_memory(find)
+    result["subs_peak_bytes"] = peak_memory(subs)
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    old = {(r["size"], r["density"]): r for r in baseline["corpora"]}
+    pairs = [("compile", results["compile"], baseline["compile"])]
+    pairs.extend((f"{r['size']} @ {r['density']}", r, old[(r["size"], r["density"])])
+                 for r in results["corpora"] if (r["size"], r["density"]) in old)
+    for name, new, before in pairs:
+        for key in TIMINGS:
+            if key in new and key in before and new[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {before[key] * 1000:.2f}ms -> {new[key] * 1000:.2f}ms "
+                                   f"({new[key] / before[key] - 1:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="256K,1M,4M")
+    parser.add_argument("--densities", default="0.01,0.1,0.5")
+    parser.add_argument("--near-miss", type=float, default=0.0)
+    parser.add_argument("--slot-mode", choices=SLOT_MODES, default="greedy")
+    parser.add_argument("--engine", choices=list(ENGINES), default="re")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", "-o", default="results.json")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with open(TEMPLATE, "r") as h:
+        input_template = h.read()
+    with open(OUTPUT_TEMPLATE, "r") as h:
+        output_template = h.read()
+
+    build = lambda: TemplateProcessor(input_template, output_template, False, args.slot_mode, args.engine)
+    p = build()
+    p.timeout = args.timeout
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "args": vars(args),
+        },
+        "compile": {
+            "compile_s": best_of(max(args.repeat, 5), lambda: cold(build)),
+            "pattern_chars": len(p.pattern),
+        },
+        "corpora": [],
+    }
+    print(f"compile: {results['compile']['compile_s'] * 1000:.2f}ms")
+    print(f"{'size':>6} {'density':>8} {'matches':>8} {'find MB/s':>10} {'subs MB/s':>10} "
+          f"{'find peak':>10} {'subs peak':>10}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes.split(","):
+            for density in (float(d) for d in args.densities.split(",")):
+                file = os.path.join(directory, "corpus.html")
+                with open(file, "w") as h:
+                    h.write(make_corpus(input_template, parse_size(size), density, args.seed, args.near_miss))
+
+                result = {"size": size, "density": density}
+                result.update(run_corpus(p, file, args.repeat))
+                results["corpora"].append(result)
+                if "error" in result:
+                    print(f"{size:>6} {density:>8} {'timed out':>8}")
+                else:
+                    print(f"{size:>6} {density:>8} {result['matches']:>8} {result['find_mb_s']:>10.1f} "
+                          f"{result['subs_mb_s']:>10.1f} {result['find_peak_bytes'] / (1 << 20):>9.1f}M "
+                          f"{result['subs_peak_bytes'] / (1 << 20):>9.1f}M")
+
+    with open(args.output, "w") as h:
+        json.dump(results, h, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as h:
+            regressions = compare(results, json.load(h), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
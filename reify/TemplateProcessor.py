@@ -1,108 +1,505 @@
-import re
+import codecs
+import itertools
+import locale
+import mmap
+import os
+import shutil
+import tempfile
 from typing import *
-from typing import Match
+from typing import Match, Pattern
+
+from .compiler import Slot, tokenize, compile_input, compile_output, required_literals, leading_literal, slot_label
+from .diff import unified_diff, DEFAULT_CONTEXT
+from .bytes_engine import BytesMatch, DecodedPattern, bytes_safe, check_encoding, map_file, plain_ascii, find_mmap, \
+    replace_mmap
+from .engine import Engine, Budget, get_engine
+from .shard import find_parallel, replace_parallel, count_parallel
+from .stats import Stats, TimedIO, record
+from .stream import StreamMatch, iter_matches, iter_replace, search_windows, write_replaced, DEFAULT_CHUNK_SIZE, \
+    DEFAULT_MAX_SPAN
 
 
 class TemplateProcessor:
     SLOT = r"{{([A-Za-z0-9,.: ]*)}}"
 
-    def __init__(self, input_template: str, output_template: Optional[str], conserve_whitespace: bool):
-        self.pattern = input_template
-        self.target = output_template
+    # How many of the longest required literals are checked before running the regex over a document
+    PREFILTER_LITERALS = 4
+
+    def __init__(self, input_template: str, output_template: Optional[str], conserve_whitespace: bool,
+                 slot_mode: str = "greedy", engine: Union[str, Engine] = "re", timeout: Optional[float] = None,
+                 stats: Optional[Stats] = None):
+        self.engine = get_engine(engine)
+        self.timeout = timeout
+        self.stats = stats
+        with record(stats, "slot parsing"):
+            input_nodes = list(tokenize(input_template))
+            self.input_tokens = [n.token for n in input_nodes if isinstance(n, Slot)]
+            self.pattern = compile_input(input_nodes, conserve_whitespace, slot_mode=slot_mode)
+            self.literals = required_literals(input_nodes, conserve_whitespace)
+            self.prefix = leading_literal(input_nodes, conserve_whitespace)
+            self.target = output_template
 
-        self.input_tokens = self._find_slots(self.pattern)
+            if output_template is not None:
+                output_nodes = list(tokenize(output_template))
+                self.output_tokens = [n.token for n in output_nodes if isinstance(n, Slot)]
+                self.target = compile_output(output_nodes)
 
-        self.pattern = re.sub(r"[\\\[(=/!|?\"\'.]", lambda m: f"\\{m.group(0)}", self.pattern)
-        if not conserve_whitespace:
-            self.pattern = re.sub(r"\n+", r"\s*", self.pattern)
-            self.pattern = re.sub(r"\s{2,}", r"\s*", self.pattern)
+        self._prepare()
 
-        for t in self.input_tokens:
-            self.pattern = re.sub("{{(%s)}}" % t, self._parse_input_slots(), self.pattern, count=1)
+    @classmethod
+    def from_files(cls, input_file: str, output_file: Optional[str], conserve_whitespace: bool, cache=None,
+                   slot_mode: str = "greedy", engine: Union[str, Engine] = "re", stats: Optional[Stats] = None):
+        with record(stats, "template read"):
+            with open(input_file, "r") as ih:
+                input_template = ih.read()
 
-        if output_template is not None:
-            self.output_tokens = self._find_slots(self.target)
+            output_template = None
+            if output_file is not None:
+                with open(output_file, "r") as oh:
+                    output_template = oh.read()
 
-            for t in self.output_tokens:
-                self.target = re.sub("{{(%s)}}" % t, self._prepare_target_slots(), self.target)
+        if cache is not None:
+            return cache.get(input_template, output_template, conserve_whitespace, slot_mode, engine, stats)
+        return cls(input_template, output_template, conserve_whitespace, slot_mode, engine, stats=stats)
 
     @classmethod
-    def from_files(cls, input_file: str, output_file: str, conserve_whitespace: bool):
-        with open(input_file, "r") as ih, open(output_file, "r") as oh:
-            return cls(ih.read(), oh.read(), conserve_whitespace)
-
-    @staticmethod
-    def _find_slots(text: str) -> Iterator[str]:
-        for i, c in enumerate(text):
-            if i == 0:
-                prev_char = c
-                continue
-
-            if c == "{" and prev_char == "{":
-                token = ""
-                i = i + 1
-                c = text[i]
-                while c != "}" or text[i + 1] != "}":
-                    token += c
-                    i = i + 1
-                    c = text[i]
-
-                yield token
-
-            prev_char = c
-
-    @staticmethod
-    def _parse_input_slots() -> Callable[[Match], str]:
-        def inner(m: Match) -> str:
-            token = m.group(1)
-            if token == ":":
-                return r"(?:.*)"
-            elif re.match(r":.+", token):
-                subm = re.match(r":(.+)", token)
-                return f"\\{subm.group(1)}*"
-            elif re.match(r"[A-Za-z0-9\-_]+", token):
-                if re.match(r"^\d|-", token):
-                    return f"(?P<_{token}>.*)"
-                return f"(?P<{token}>.*)"
-            else:
-                return r"(.*)"
-
-        return inner
-
-    @staticmethod
-    def _prepare_target_slots() -> Callable[[Match], str]:
-        def inner(m: Match) -> str:
-            token = m.group(1)
-            if re.match(r"^(?:\d+ )+\d$", token):
-                pat = ""
-                for i in token.split(" "):
-                    pat += f"\\{i}"
-                return pat
-            elif re.match(r"\d+\.\.\d+", token):
-                limits = token.split("..")
-                pat = ""
-                for i in range(int(limits[0]), int(limits[1]) + 1):
-                    pat += f"\\{i}"
-                return pat
-            elif re.match(r"^\d+$", token):
-                return f"\\{token}"
-            elif re.match(r"(?:[\w\d\-_]+ )+[\w\d\-_]+", token):
-                pat = ""
-                for s in token.split(" "):
-                    pat += f"\\g<{s}>"
-                return pat
-            elif re.match(r"[\w\d\-_]+", token):
-                return f"\\g<{token}>"
-
-        return inner
+    def from_compiled(cls, pattern: str, target: Optional[str], input_tokens: List[str],
+                      output_tokens: Optional[List[str]] = None, literals: Optional[List[str]] = None,
+                      engine: Union[str, Engine] = "re", prefix: str = ""):
+        """Rebuild a processor from previously compiled patterns without recompiling the templates"""
+        self = cls.__new__(cls)
+        self.engine = get_engine(engine)
+        self.timeout = None
+        self.stats = None
+        self.pattern = pattern
+        self.target = target
+        self.input_tokens = input_tokens
+        if output_tokens is not None:
+            self.output_tokens = output_tokens
+        self.literals = literals or []
+        self.prefix = prefix
+        self._prepare()
+        return self
+
+    def _prepare(self):
+        with record(self.stats, "regex compile"):
+            self.regex = self.engine.compile(self.pattern)
+        self._bytes_regex: Dict[str, Pattern] = dict()
+        self._bytes_safe = bytes_safe(self.pattern)
+        self._prefilters = [sorted(literals, key=len, reverse=True)[:self.PREFILTER_LITERALS]
+                            for literals in self._literal_sets()]
+
+    def __getstate__(self):
+        # Compiled patterns of other engines can't always be pickled, so workers compile their own
+        state = self.__dict__.copy()
+        del state["regex"], state["_bytes_regex"], state["_prefilters"]
+        state["stats"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._prepare()
+
+    def matcher(self, regex: Optional[Pattern] = None) -> Union[Pattern, Budget]:
+        """The compiled pattern to match one document with. If the processor has a `timeout`, it is
+        wrapped so that matching raises `PathologicalTemplateError` once the timeout runs out."""
+        regex = regex or self.regex
+        if self.timeout is None:
+            return regex
+        return self.engine.budget(regex, self.timeout)
+
+    def _literal_sets(self) -> List[List[str]]:
+        # A document can only match if it contains every literal of at least one of these sets
+        return [self.literals]
+
+    def could_match(self, text: str) -> bool:
+        """Cheaply rule out documents that can't contain a match, because they are missing some of
+        the literal text every match has to contain"""
+        return any(all(literal in text for literal in literals) for literals in self._prefilters)
+
+    def could_match_bytes(self, data: bytes, encoding: str = "utf-8") -> bool:
+        for literals in self._prefilters:
+            try:
+                if all(data.find(literal.encode(encoding)) != -1 for literal in literals):
+                    return True
+            except UnicodeEncodeError:
+                return True
+        return False
+
+    def file_could_match(self, file: str) -> bool:
+        """`could_match` for a file on disk, searching its raw bytes without reading it into memory"""
+        encoding = locale.getpreferredencoding(False)
+        # Text mode translates newlines, so literals spanning lines can't be looked for in the raw bytes
+        prefilters = [[literal for literal in literals if "\n" not in literal and "\r" not in literal]
+                      for literals in self._prefilters]
+        document = map_file(file)
+        for literals in prefilters:
+            try:
+                encoded = [literal.encode(encoding) for literal in literals]
+            except UnicodeEncodeError:
+                return True
+            if all(document.find(literal) != -1 for literal in encoded):
+                return True
+        return False
+
+    def bytes_regex(self, encoding: str = "utf-8") -> Pattern:
+        """The input pattern compiled to match raw bytes of a document in the given encoding, which
+        has to be ASCII-compatible"""
+        if encoding not in self._bytes_regex:
+            check_encoding(encoding)
+            self._bytes_regex[encoding] = self.engine.compile(self.pattern.encode(encoding))
+        return self._bytes_regex[encoding]
+
+    def matches_bytes_as_text(self, document: bytes) -> bool:
+        """Whether `bytes_regex` finds the same matches in the raw bytes of a document as `regex`
+        finds in its text. It doesn't if the pattern has collapsed whitespace, typed slots or length
+        bounds in it and the document isn't plain ASCII, since in bytes those only match ASCII and
+        count bytes rather than characters."""
+        return self._bytes_safe or plain_ascii(document)
+
+    def bytes_matcher(self, document: bytes, encoding: str = "utf-8") -> Union[Pattern, Budget, DecodedPattern]:
+        """`matcher` for the raw bytes of a document: `bytes_regex`, or where that would match
+        differently (see `matches_bytes_as_text`), `regex` on the decoded document, with offsets
+        and groups still in bytes"""
+        if self.matches_bytes_as_text(document):
+            return self.matcher(self.bytes_regex(encoding))
+        return DecodedPattern(self.matcher(), encoding)
+
+    def expander(self) -> Callable[[Match], str]:
+        """Expands a match of `regex` into its replacement"""
+        return self.target if callable(self.target) else lambda m: m.expand(self.target)
+
+    def bytes_expander(self, encoding: str = "utf-8") -> Callable[[Match], bytes]:
+        """Expands a match of `bytes_regex` into its replacement"""
+        target = self.target.encode(encoding)
+        return lambda m: m.expand(target)
+
+    def slots(self, m: Match) -> Dict[str, Optional[str]]:
+        """The values of the labelled slots of a match, by the labels they were written with"""
+        return {slot_label(name): value for name, value in m.groupdict().items()}
+
+    def _scanning(self, file: str):
+        if self.stats is not None:
+            self.stats.files += 1
+            self.stats.bytes_scanned += os.path.getsize(file)
+
+    def _timed(self, matches: Iterator, count: bool = True) -> Iterator:
+        return matches if self.stats is None else self.stats.timed("matching", matches, count)
+
+    def _counted(self, expand: Callable[[Match], AnyStr]) -> Callable[[Match], AnyStr]:
+        return expand if self.stats is None else self.stats.counted(expand)
+
+    def _io(self, file: IO, phase: str) -> IO:
+        return file if self.stats is None else TimedIO(file, self.stats, phase)
 
     def find(self, file: str) -> Iterator[Match]:
+        self._scanning(file)
+        with record(self.stats, "document read"), open(file, "r") as input_text:
+            text = input_text.read()
+        with record(self.stats, "matching"):
+            if not self.could_match(text):
+                return iter(())
+        return self._timed(self.matcher().finditer(text))
+
+    def find_all(self, file: str) -> "MatchSet":
+        """Every match in a file, as a `MatchSet` of offsets rather than as match objects"""
+        self._scanning(file)
+        with record(self.stats, "document read"), open(file, "r") as input_text:
+            text = input_text.read()
+        return self.match_set(text)
+
+    def find_all_mmap(self, file: str, encoding: str = "utf-8") -> "MatchSet":
+        """`find_all` on the raw bytes of a memory-mapped file. Offsets are in bytes."""
+        self._scanning(file)
+        return self.match_set(map_file(file), encoding)
+
+    def match_set(self, document: AnyStr, encoding: Optional[str] = None) -> "MatchSet":
+        """Every match in a string, or in bytes in the given encoding, as a `MatchSet`"""
+        from .matchset import MatchSet
+
+        regex = self.regex
+        with record(self.stats, "matching"):
+            if encoding is None:
+                possible = self.could_match(document)
+                matcher = self.matcher()
+            else:
+                possible = self.could_match_bytes(document, encoding)
+                matcher = self.bytes_matcher(document, encoding) if possible else None
+        matches = self._timed(matcher.finditer(document)) if possible else ()
+        return MatchSet.from_matches(matches, document, regex.groups, regex.groupindex, encoding)
+
+    def finditer(self, document: Union[str, bytes, IO], encoding: str = "utf-8", max_span: int = DEFAULT_MAX_SPAN,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Match]:
+        """Every match in a document already in memory or being read from a stream. Bytes are
+        matched without decoding them, as `BytesMatch`es with offsets in bytes, so their encoding
+        has to be ASCII-compatible. Streams, text or binary, are read a window at a time like with
+        `find_streaming`."""
+        if isinstance(document, str):
+            with record(self.stats, "matching"):
+                if not self.could_match(document):
+                    return iter(())
+            return self._timed(self.matcher().finditer(document))
+
+        if _is_stream(document):
+            stream = self._io(_text_stream(document, encoding), "document read")
+            return self._timed(iter_matches(self.matcher(), stream, chunk_size, max_span, self.could_match))
+
+        with record(self.stats, "matching"):
+            if not self.could_match_bytes(document, encoding):
+                return iter(())
+            matches = self.bytes_matcher(document, encoding).finditer(document)
+        return self._timed(BytesMatch(m, encoding) for m in matches)
+
+    def count(self, document: Union[str, bytes, IO], encoding: str = "utf-8", max_span: int = DEFAULT_MAX_SPAN,
+              chunk_size: int = DEFAULT_CHUNK_SIZE, limit: Optional[int] = None) -> int:
+        """The number of matches `finditer` would find, up to `limit`. The matches of the regex are
+        counted as it finds them, without being wrapped or kept."""
+        if isinstance(document, str):
+            with record(self.stats, "matching"):
+                if not self.could_match(document):
+                    return 0
+            matches = self.matcher().finditer(document)
+        elif _is_stream(document):
+            stream = self._io(_text_stream(document, encoding), "document read")
+            matches = (m for m, _ in search_windows(self.matcher(), stream, chunk_size, max_span, self.could_match))
+        else:
+            with record(self.stats, "matching"):
+                if not self.could_match_bytes(document, encoding):
+                    return 0
+                matches = self.bytes_matcher(document, encoding).finditer(document)
+
+        with record(self.stats, "matching"):
+            count = sum(1 for _ in itertools.islice(matches, limit))
+        if self.stats is not None:
+            self.stats.matches += count
+        return count
+
+    def subn(self, document: Union[str, bytes, IO], encoding: str = "utf-8", max_span: int = DEFAULT_MAX_SPAN,
+             chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[AnyStr, int]:
+        """The document with every match replaced, and the number of replacements. Bytes give bytes
+        in the same encoding, and streams are substituted a window at a time into a string."""
+        if self.target is None:
+            raise ValueError("The template has no output template to substitute with")
+
+        if _is_stream(document):
+            pieces = self.iter_sub(document, encoding, max_span, chunk_size)
+            substituted = []
+            while True:
+                try:
+                    substituted.append(next(pieces))
+                except StopIteration as e:
+                    return "".join(substituted), e.value
+
+        with record(self.stats, "matching"):
+            if isinstance(document, str):
+                if not self.could_match(document):
+                    return document, 0
+                document, count = self.matcher().subn(self.target, document)
+            else:
+                if not self.could_match_bytes(document, encoding):
+                    return bytes(document), 0
+                document, count = self.bytes_matcher(document, encoding).subn(self.bytes_expander(encoding), document)
+
+        if self.stats is not None:
+            self.stats.matches += count
+        return document, count
+
+    def sub(self, document: Union[str, bytes, IO], encoding: str = "utf-8", max_span: int = DEFAULT_MAX_SPAN,
+            chunk_size: int = DEFAULT_CHUNK_SIZE) -> AnyStr:
+        """`subn` without the number of replacements"""
+        return self.subn(document, encoding, max_span, chunk_size)[0]
+
+    def iter_sub(self, document: Union[str, bytes, IO], encoding: str = "utf-8", max_span: int = DEFAULT_MAX_SPAN,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> Generator[AnyStr, None, int]:
+        """The substituted document piece by piece, so it can be written out as it's produced
+        instead of being put together in memory. Streams are read a window at a time and are
+        never held in memory as a whole. Returns the number of replacements."""
+        if self.target is None:
+            raise ValueError("The template has no output template to substitute with")
+
+        if _is_stream(document):
+            stream = self._io(_text_stream(document, encoding), "document read")
+            pieces = iter_replace(self.matcher(), self._counted(self.expander()), stream, chunk_size, max_span,
+                                  self.could_match)
+            return (yield from pieces)
+
+        if isinstance(document, str):
+            expand = self.expander()
+        else:
+            expand = self.bytes_expander(encoding)
+        count = 0
+        pos = 0
+        for m in self.finditer(document, encoding):
+            yield document[pos:m.start()]
+            yield expand(m.match if isinstance(m, BytesMatch) else m)
+            count += 1
+            pos = m.end()
+        yield document[pos:]
+        return count
+
+    def find_streaming(self, file: str, max_span: int = DEFAULT_MAX_SPAN,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[StreamMatch]:
+        self._scanning(file)
+        with record(self.stats, "matching"):
+            if not self.file_could_match(file):
+                return
         with open(file, "r") as input_text:
-            return re.finditer(self.pattern, input_text.read())
-
-    def find_and_replace(self, input_file: str, in_place: bool) -> str:
-        with open(input_file, "w+" if in_place else "r") as h:
-            new_text = re.sub(self.pattern, self.target, h.read())
-            if in_place:
-                h.write(new_text)
-            return new_text
+            yield from self._timed(iter_matches(self.matcher(), self._io(input_text, "document read"),
+                                                chunk_size, max_span, self.could_match))
+
+    def count_file(self, file: str, max_span: Optional[int] = None, limit: Optional[int] = None) -> int:
+        """`count` for a file, read whole, or a window at a time if `max_span` is given"""
+        self._scanning(file)
+        if max_span is None:
+            with record(self.stats, "document read"), open(file, "r") as input_text:
+                text = input_text.read()
+            return self.count(text, limit=limit)
+
+        with record(self.stats, "matching"):
+            if not self.file_could_match(file):
+                return 0
+        with open(file, "r") as input_text:
+            return self.count(input_text, max_span=max_span, limit=limit)
+
+    def count_mmap(self, file: str, encoding: str = "utf-8", limit: Optional[int] = None) -> int:
+        self._scanning(file)
+        return self.count(map_file(file), encoding, limit=limit)
+
+    def count_parallel(self, file: str, jobs: Optional[int] = None, encoding: str = "utf-8",
+                       split_on: Optional[str] = None, limit: Optional[int] = None) -> int:
+        self._scanning(file)
+        with record(self.stats, "matching"):
+            count = count_parallel(self, file, jobs, encoding, split_on, limit)
+        if self.stats is not None:
+            self.stats.matches += count
+        return count
+
+    def find_mmap(self, file: str, encoding: str = "utf-8") -> Iterator[BytesMatch]:
+        self._scanning(file)
+        document = map_file(file)
+        with record(self.stats, "matching"):
+            if not self.could_match_bytes(document, encoding):
+                return iter(())
+            regex = self.bytes_matcher(document, encoding)
+        return self._timed(find_mmap(regex, document, encoding))
+
+    def replace_mmap(self, file: str, encoding: str = "utf-8") -> Iterator[bytes]:
+        self._scanning(file)
+        document = map_file(file)
+        with record(self.stats, "matching"):
+            possible = self.could_match_bytes(document, encoding)
+            regex = self.bytes_matcher(document, encoding) if possible else self.bytes_regex(encoding)
+        return self._timed(replace_mmap(regex, self._counted(self.bytes_expander(encoding)), document,
+                                        lambda data: possible), count=False)
+
+    def find_parallel(self, file: str, jobs: Optional[int] = None, encoding: str = "utf-8",
+                      split_on: Optional[str] = None) -> Iterator[BytesMatch]:
+        """`find_mmap`, with shards of the file matched by `jobs` worker processes (see `reify.shard`)"""
+        self._scanning(file)
+        return self._timed(find_parallel(self, file, jobs, encoding, split_on))
+
+    def replace_parallel(self, file: str, jobs: Optional[int] = None, encoding: str = "utf-8",
+                         split_on: Optional[str] = None) -> Iterator[bytes]:
+        """`replace_mmap`, with shards of the file matched by `jobs` worker processes"""
+        self._scanning(file)
+        return self._timed(replace_parallel(self, file, jobs, encoding, split_on, self.stats), count=False)
+
+    def find_and_replace(self, input_file: str, in_place: bool) -> Optional[str]:
+        """Return the document with every match replaced. With `in_place` the file is rewritten
+        instead (see `replace_in_place`) and nothing is returned."""
+        if in_place:
+            self.replace_in_place(input_file)
+            return None
+
+        self._scanning(input_file)
+        with record(self.stats, "document read"), open(input_file, "r") as h:
+            text = h.read()
+        with record(self.stats, "matching"):
+            if not self.could_match(text):
+                return text
+            text, count = self.matcher().subn(self.target, text)
+
+        if self.stats is not None:
+            self.stats.matches += count
+        return text
+
+    def diff(self, file: str, context: int = DEFAULT_CONTEXT) -> Iterator[str]:
+        """A unified diff of the substitution in a file, built from the matches and their
+        replacements without putting together the whole substituted document"""
+        self._scanning(file)
+        with record(self.stats, "document read"), open(file, "r") as h:
+            text = h.read()
+        with record(self.stats, "matching"):
+            if not self.could_match(text):
+                return iter(())
+
+        expand = self.expander()
+        replacements = ((m.start(), m.end(), expand(m)) for m in self._timed(self.matcher().finditer(text)))
+        return unified_diff(file, text, replacements, context)
+
+    def replace_in_place(self, file: str, max_span: int = DEFAULT_MAX_SPAN,
+                         chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+        """Stream the substituted document into a temporary file next to `file` and atomically
+        rename it over the original, so the original is left untouched if anything goes wrong.
+        Returns the number of replacements. Files without any matches are left untouched."""
+        self._scanning(file)
+        with record(self.stats, "matching"):
+            if not self.file_could_match(file):
+                return 0
+
+        directory = os.path.dirname(os.path.abspath(file))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".reify-", suffix=".tmp")
+        try:
+            # Newlines are read and written as they are, so text outside the matches keeps its bytes
+            with open(file, "r", newline="") as source, os.fdopen(fd, "w", newline="") as destination:
+                with record(self.stats, "matching"):
+                    count = write_replaced(self.matcher(), self.target, self._io(source, "document read"),
+                                           self._io(destination, "output write"), chunk_size, max_span,
+                                           self.could_match)
+                with record(self.stats, "output write"):
+                    destination.flush()
+                    os.fsync(destination.fileno())
+
+            if count == 0:
+                os.remove(tmp)
+                return 0
+
+            with record(self.stats, "output write"):
+                shutil.copymode(file, tmp)
+                os.replace(tmp, file)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        with record(self.stats, "output write"):
+            _fsync_directory(directory)
+        if self.stats is not None:
+            self.stats.matches += count
+        return count
+
+
+def _fsync_directory(directory: str):
+    # Make the rename itself durable. Not every platform lets you open a directory
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _is_stream(document) -> bool:
+    # Memory maps can be read like files, but are matched like bytes
+    return hasattr(document, "read") and not isinstance(document, mmap.mmap)
+
+
+def _text_stream(stream: IO, encoding: str) -> IO:
+    # Binary streams are decoded as they're read
+    if isinstance(stream.read(0), bytes):
+        return codecs.getreader(encoding)(stream)
+    return stream
@@ -0,0 +1,2 @@
+from .TemplateProcessor import TemplateProcessor
+from .api import compile, finditer, sub, subn, iter_sub
@@ -0,0 +1,44 @@
+import copy
+from typing import *
+from typing import Match
+
+from .TemplateProcessor import TemplateProcessor
+from .cache import default_cache
+from .engine import Engine
+
+
+def compile(input_template: str, output_template: Optional[str] = None, conserve_whitespace: bool = False,
+            slot_mode: str = "greedy", engine: Union[str, Engine] = "re",
+            timeout: Optional[float] = None) -> TemplateProcessor:
+    """Compile templates given as text into a processor whose `finditer`, `sub`, `subn` and
+    `iter_sub` work on strings, bytes and streams. Compiled templates are cached, so compiling
+    the same templates again is cheap."""
+    p = default_cache.get(input_template, output_template, conserve_whitespace, slot_mode, engine)
+    if p.timeout != timeout:
+        # Cached processors are shared, so the timeout goes on a copy
+        p = copy.copy(p)
+        p.timeout = timeout
+    return p
+
+
+def finditer(template: str, document: Union[str, bytes, IO], encoding: str = "utf-8", **options) -> Iterator[Match]:
+    """Every match of a template in a document. `options` are those of `compile`."""
+    return compile(template, None, **options).finditer(document, encoding)
+
+
+def sub(input_template: str, output_template: str, document: Union[str, bytes, IO], encoding: str = "utf-8",
+        **options) -> AnyStr:
+    """The document with every match of the input template replaced with the output template"""
+    return compile(input_template, output_template, **options).sub(document, encoding)
+
+
+def subn(input_template: str, output_template: str, document: Union[str, bytes, IO], encoding: str = "utf-8",
+         **options) -> Tuple[AnyStr, int]:
+    """`sub`, and the number of replacements"""
+    return compile(input_template, output_template, **options).subn(document, encoding)
+
+
+def iter_sub(input_template: str, output_template: str, document: Union[str, bytes, IO], encoding: str = "utf-8",
+             **options) -> Iterator[AnyStr]:
+    """The substituted document piece by piece"""
+    return compile(input_template, output_template, **options).iter_sub(document, encoding)
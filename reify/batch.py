@@ -0,0 +1,75 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+
+from .TemplateProcessor import TemplateProcessor
+from .stream import DEFAULT_MAX_SPAN
+
+
+class FileResult(NamedTuple):
+    path: str
+    count: int
+    error: Optional[str] = None
+
+
+def expand_paths(paths: Iterable[str]) -> List[str]:
+    """Turn a mix of files, directories and glob patterns into a flat list of files.
+    Directories are searched recursively and globs may use `**`. A file named more than once,
+    even by different paths, is only listed the first time, so it is never worked on twice at once."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        elif any(c in path for c in "*?[") and not os.path.isfile(path):
+            files.extend(p for p in sorted(glob.glob(path, recursive=True)) if os.path.isfile(p))
+        else:
+            files.append(path)
+
+    seen = set()
+    unique = []
+    for file in files:
+        real = os.path.realpath(file)
+        if real not in seen:
+            seen.add(real)
+            unique.append(file)
+    return unique
+
+
+_processor: Optional[TemplateProcessor] = None
+
+
+def _init_worker(processor: TemplateProcessor):
+    global _processor
+    _processor = processor
+
+
+def _run(task: Tuple[str, str, int]) -> FileResult:
+    mode, path, max_span = task
+    try:
+        if mode == "subs":
+            return FileResult(path, _processor.replace_in_place(path, max_span))
+        return FileResult(path, _processor.count_file(path, max_span))
+    except Exception as e:
+        return FileResult(path, 0, f"{type(e).__name__}: {e}")
+
+
+def run_batch(processor: TemplateProcessor, files: Sequence[str], mode: str = "find",
+              jobs: Optional[int] = None, max_span: int = DEFAULT_MAX_SPAN) -> Iterator[FileResult]:
+    """Count matches in (`mode="find"`) or substitute in place (`mode="subs"`) every file, yielding
+    one result per file in order. The compiled processor is sent to each worker process once."""
+    if mode not in ("find", "subs"):
+        raise ValueError(f"Unknown batch mode {mode!r}")
+
+    tasks = [(mode, path, max_span) for path in files]
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(tasks) <= 1:
+        _init_worker(processor)
+        yield from map(_run, tasks)
+        return
+
+    chunksize = max(1, min(64, len(tasks) // (jobs * 4)))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(processor,)) as pool:
+        yield from pool.map(_run, tasks, chunksize=chunksize)
@@ -0,0 +1,243 @@
+import mmap
+import os
+import re
+from typing import *
+from typing import Match, Pattern
+
+
+class BytesMatch:
+    """A match against the raw bytes of a document. Offsets are in bytes and slot values are only
+    decoded when they are asked for."""
+    __slots__ = ("match", "encoding", "errors")
+
+    def __init__(self, match: Match, encoding: str = "utf-8", errors: str = "replace"):
+        self.match = match
+        self.encoding = encoding
+        self.errors = errors
+
+    def decode(self, data: Optional[bytes]) -> Optional[str]:
+        return None if data is None else data.decode(self.encoding, self.errors)
+
+    def start(self, group: Union[int, str] = 0) -> int:
+        return self.match.start(group)
+
+    def end(self, group: Union[int, str] = 0) -> int:
+        return self.match.end(group)
+
+    def span(self, group: Union[int, str] = 0) -> Tuple[int, int]:
+        return self.match.span(group)
+
+    def group(self, *groups: Union[int, str]) -> Union[str, Tuple[str, ...]]:
+        if len(groups) > 1:
+            return tuple(self.decode(g) for g in self.match.group(*groups))
+        return self.decode(self.match.group(*groups))
+
+    def groups(self, default=None) -> Tuple[str, ...]:
+        return tuple(default if g is None else self.decode(g) for g in self.match.groups())
+
+    def groupdict(self, default=None) -> Dict[str, str]:
+        return {k: default if v is None else self.decode(v) for k, v in self.match.groupdict().items()}
+
+    def expand(self, template: Union[str, bytes]) -> Union[str, bytes]:
+        if isinstance(template, bytes):
+            return self.match.expand(template)
+        return self.decode(self.match.expand(template.encode(self.encoding)))
+
+    def __getitem__(self, group: Union[int, str]) -> str:
+        return self.group(group)
+
+    @property
+    def lastindex(self) -> Optional[int]:
+        return self.match.lastindex
+
+    @property
+    def lastgroup(self) -> Optional[str]:
+        return self.match.lastgroup
+
+    @property
+    def re(self) -> Pattern:
+        return self.match.re
+
+    def __repr__(self):
+        return f"<BytesMatch object; span={self.span()!r}, match={self.group(0)!r}>"
+
+
+class SpanMatch:
+    """A match rebuilt from the offsets of its groups, such as in the main process from the offsets a
+    worker process found it at"""
+    __slots__ = ("string", "spans", "lastindex", "re")
+
+    def __init__(self, string: bytes, spans: Sequence[Tuple[int, int]], lastindex: Optional[int], regex: Pattern):
+        self.string = string
+        self.spans = spans
+        self.lastindex = lastindex
+        self.re = regex
+
+    def _index(self, group: Union[int, str]) -> int:
+        return group if isinstance(group, int) else self.re.groupindex[group]
+
+    def start(self, group: Union[int, str] = 0) -> int:
+        return self.spans[self._index(group)][0]
+
+    def end(self, group: Union[int, str] = 0) -> int:
+        return self.spans[self._index(group)][1]
+
+    def span(self, group: Union[int, str] = 0) -> Tuple[int, int]:
+        return self.spans[self._index(group)]
+
+    def group(self, *groups: Union[int, str]) -> Union[bytes, Tuple[bytes, ...]]:
+        if len(groups) > 1:
+            return tuple(self.group(g) for g in groups)
+        start, end = self.span(groups[0] if groups else 0)
+        return None if start == -1 else self.string[start:end]
+
+    def groups(self, default=None) -> Tuple[bytes, ...]:
+        return tuple(default if start == -1 else self.string[start:end] for start, end in self.spans[1:])
+
+    def groupdict(self, default=None) -> Dict[str, bytes]:
+        groups = self.groups(default)
+        return {name: groups[i - 1] for name, i in self.re.groupindex.items()}
+
+    def __getitem__(self, group: Union[int, str]) -> bytes:
+        return self.group(group)
+
+    @property
+    def lastgroup(self) -> Optional[str]:
+        names = {i: name for name, i in self.re.groupindex.items()}
+        return names.get(self.lastindex)
+
+
+class DecodedMatch(SpanMatch):
+    """A match of a text pattern in a decoded document, with offsets in the raw bytes of the document
+    and groups that are raw bytes, like a match of the pattern against the bytes themselves"""
+    __slots__ = ("text_match", "encoding")
+
+    def __init__(self, string: bytes, spans: Sequence[Tuple[int, int]], text_match: Match, encoding: str):
+        super().__init__(string, spans, text_match.lastindex, text_match.re)
+        self.text_match = text_match
+        self.encoding = encoding
+
+    def expand(self, template: bytes) -> bytes:
+        text = self.text_match.expand(template.decode(self.encoding, "surrogateescape"))
+        return text.encode(self.encoding, "surrogateescape")
+
+
+class DecodedPattern:
+    """A text pattern that matches raw bytes by decoding them first, for patterns that would match
+    the bytes themselves differently (see `bytes_safe`). Bytes that don't decode are carried
+    through as they are."""
+
+    def __init__(self, regex: Pattern, encoding: str):
+        self.regex = regex
+        self.encoding = encoding
+
+    @property
+    def groups(self) -> int:
+        return self.regex.groups
+
+    @property
+    def groupindex(self) -> Mapping[str, int]:
+        return self.regex.groupindex
+
+    def finditer(self, document: bytes) -> Iterator[DecodedMatch]:
+        text = str(document, self.encoding, "surrogateescape")
+
+        def size(start: int, end: int) -> int:
+            return len(text[start:end].encode(self.encoding, "surrogateescape"))
+
+        # Offsets are turned into bytes a match at a time, from the start of the match
+        pos = offset = 0
+        for m in self.regex.finditer(text):
+            offset += size(pos, m.start())
+            pos = m.start()
+            spans = tuple((-1, -1) if start == -1 else (offset + size(pos, start), offset + size(pos, end))
+                          for start, end in (m.span(g) for g in range(self.regex.groups + 1)))
+            yield DecodedMatch(document, spans, m, self.encoding)
+
+    def subn(self, repl: Callable[[Match], bytes], document: bytes) -> Tuple[bytes, int]:
+        pieces = []
+        pos = 0
+        for m in self.finditer(document):
+            pieces.append(document[pos:m.start()])
+            pieces.append(repl(m))
+            pos = m.end()
+        pieces.append(document[pos:])
+        return b"".join(pieces), len(pieces) // 2
+
+
+# Pattern syntax that matches raw bytes differently from the text they decode to: Unicode classes and
+# word boundaries, counted repeats (which count bytes instead of characters) and non-ASCII characters
+# that are repeated or in a class. Other escapes are skipped over whole.
+_BYTES_UNSAFE = re.compile(r"\\(?:([sSwWdDbB])|.)|(\{\d*,?\d*\})|([^\x00-\x7f][*+?{])|(\[(?:\\.|[^\]\\])*?[^\x00-\x7f])",
+                           re.DOTALL)
+
+# Bytes that `\s` matches in text but not in bytes
+_SEPARATORS = [bytes([c]) for c in range(0x1c, 0x20)]
+
+
+def bytes_safe(pattern: str) -> bool:
+    """Whether a pattern matches the raw bytes of a document in an ASCII-compatible encoding the same
+    as it matches the decoded text, whatever the document"""
+    return not any(m.lastindex for m in _BYTES_UNSAFE.finditer(pattern))
+
+
+def plain_ascii(document: bytes, block: int = 1 << 20) -> bool:
+    """Whether a document has nothing in it that any pattern matches differently as raw bytes than
+    as text: no byte outside ASCII, and none of the separators `\s` matches only in text"""
+    if any(document.find(separator) != -1 for separator in _SEPARATORS):
+        return False
+    # Memory maps can't be checked in one go without copying them
+    return all(document[i:i + block].isascii() for i in range(0, len(document), block))
+
+
+# Every ASCII character, regex syntax included
+_ASCII = "".join(map(chr, range(128)))
+
+
+def check_encoding(encoding: str):
+    """Raise `ValueError` unless ASCII text is the same bytes in an encoding as in ASCII. Patterns
+    and literals are matched against raw bytes by encoding them, which only works if it is."""
+    if _ASCII.encode(encoding) != _ASCII.encode("ascii"):
+        raise ValueError(f"{encoding} isn't ASCII-compatible, so documents in it can't be matched as raw bytes. "
+                         f"Decode them and match them as text instead")
+
+
+def map_file(file: str) -> Union[mmap.mmap, bytes]:
+    """Map a file read-only. The mapping stays alive for as long as something (such as a match)
+    still refers to it."""
+    with open(file, "rb") as h:
+        if os.fstat(h.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def find_mmap(regex: Pattern, file: Union[str, mmap.mmap, bytes], encoding: str = "utf-8",
+              prefilter: Optional[Callable[[bytes], bool]] = None) -> Iterator[BytesMatch]:
+    """`file` is a path, or a file mapped already"""
+    document = map_file(file) if isinstance(file, str) else file
+    if prefilter is not None and not prefilter(document):
+        return
+
+    for m in regex.finditer(document):
+        yield BytesMatch(m, encoding)
+
+
+def replace_mmap(regex: Pattern, target: Union[bytes, Callable[[Match], bytes]], file: Union[str, mmap.mmap, bytes],
+                 prefilter: Optional[Callable[[bytes], bool]] = None) -> Iterator[bytes]:
+    """Yield the substituted document piece by piece without decoding or copying it as a whole.
+    `file` is a path, or a file mapped already."""
+    expand = target if callable(target) else lambda m: m.expand(target)
+    document = map_file(file) if isinstance(file, str) else file
+    pos = 0
+    if prefilter is None or prefilter(document):
+        for m in regex.finditer(document):
+            yield from _slices(document, pos, m.start())
+            yield expand(m)
+            pos = m.end()
+
+    yield from _slices(document, pos, len(document))
+
+
+def _slices(document: Union[mmap.mmap, bytes], start: int, end: int, size: int = 1 << 20) -> Iterator[bytes]:
+    for i in range(start, end, size):
+        yield document[i:min(i + size, end)]
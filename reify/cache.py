@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+from typing import *
+
+from .TemplateProcessor import TemplateProcessor
+from .engine import Engine, get_engine
+from .stats import Stats
+
+
+# Bump whenever the compiler's output changes so stale on-disk entries are ignored
+CACHE_VERSION = 6
+
+
+class TemplateCache:
+    """Keeps compiled templates around so the same template is never compiled twice.
+
+    Entries live in an in-memory LRU of at most `maxsize` processors. If `directory` is given,
+    compiled patterns are also stored there as JSON so that later runs can skip compilation.
+    """
+
+    def __init__(self, maxsize: int = 128, directory: Optional[str] = None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, TemplateProcessor]" = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def key(input_template: str, output_template: Optional[str], conserve_whitespace: bool,
+            slot_mode: str = "greedy", engine: Union[str, Engine] = "re") -> str:
+        h = hashlib.sha256(str(CACHE_VERSION).encode("ascii"))
+        h.update(b"W" if conserve_whitespace else b"w")
+        h.update(slot_mode.encode("ascii"))
+        h.update(get_engine(engine).name.encode("ascii"))
+        # Each template is prefixed with its length (or - for no output template), so that no two
+        # pairs of templates can run together into the same bytes
+        for template in (input_template, output_template):
+            if template is None:
+                h.update(b"-")
+                continue
+            encoded = template.encode("utf-8")
+            h.update(b"%d:" % len(encoded))
+            h.update(encoded)
+        return h.hexdigest()
+
+    def get(self, input_template: str, output_template: Optional[str],
+            conserve_whitespace: bool, slot_mode: str = "greedy",
+            engine: Union[str, Engine] = "re", stats: Optional[Stats] = None) -> TemplateProcessor:
+        """The compiled processor for these templates. `stats` records compiling them, if they
+        have to be compiled."""
+        key = self.key(input_template, output_template, conserve_whitespace, slot_mode, engine)
+        with self._lock:
+            processor = self._entries.get(key)
+            if processor is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if stats is not None:
+                    stats.cached = True
+                return processor
+
+        processor = self._load(key)
+        if processor is None:
+            self.misses += 1
+            processor = TemplateProcessor(input_template, output_template, conserve_whitespace, slot_mode, engine,
+                                          stats=stats)
+            self._store(key, processor)
+        else:
+            self.hits += 1
+            if stats is not None:
+                stats.cached = True
+
+        with self._lock:
+            self._entries[key] = processor
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return processor
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self, key: str) -> Optional[TemplateProcessor]:
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), "r") as h:
+                entry = json.load(h)
+            return TemplateProcessor.from_compiled(entry["pattern"], entry["target"],
+                                                   entry["input_tokens"], entry.get("output_tokens"),
+                                                   entry.get("literals"), entry.get("engine", "re"),
+                                                   entry.get("prefix", ""))
+        except (IOError, ValueError, KeyError):
+            return None
+
+    def _store(self, key: str, processor: TemplateProcessor):
+        if self.directory is None:
+            return
+        entry = {
+            "pattern": processor.pattern,
+            "target": processor.target,
+            "input_tokens": list(processor.input_tokens),
+            "output_tokens": getattr(processor, "output_tokens", None),
+            "literals": processor.literals,
+            "engine": processor.engine.name,
+            "prefix": processor.prefix
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as h:
+                json.dump(entry, h)
+            os.replace(tmp, self._path(key))
+        except IOError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+default_cache = TemplateCache(directory=os.environ.get("REIFY_CACHE_DIR"))
@@ -1,9 +1,31 @@
+import codecs
+import copy
+import cProfile
+import functools
+import itertools
+import json
+import os
+
 import click
 from reify.TemplateProcessor import *
+from reify.batch import expand_paths, run_batch
+from reify.bytes_engine import check_encoding
+from reify.cache import default_cache
+from reify.compiler import SLOT_MODES
+from reify.diff import DEFAULT_CONTEXT
+from reify.engine import ENGINES, PathologicalTemplateError
+from reify.rules import RuleSet, rule_paths
+from reify.render import chunked, render_match
+from reify.server import ReifyServer
+from reify.stats import Stats, record
+from reify.stream import DEFAULT_MAX_SPAN
+from reify.watch import Watcher
 
 
 @click.group("reify")
-def reify():
+@click.option("--cache-dir", type=click.Path(file_okay=False), envvar="REIFY_CACHE_DIR",
+              help="Directory to keep compiled templates in so later runs can skip compiling them")
+def reify(cache_dir):
     """The Reify Template Compiler v. 0.1.0-beta
 
     Reify is a simple templating language that compiles to regular expression syntax to make finding
@@ -24,24 +46,181 @@ def reify():
     read about them on GitHub:
     https://github.com/periodicaidan/reify#command-line-interface
     """
-    pass
+    if cache_dir is not None:
+        default_cache.directory = cache_dir
+
+
+def _report_errors(command):
+    # Turn errors the user can do something about into a message instead of a traceback
+    @functools.wraps(command)
+    def wrapper(*args, **kwargs):
+        try:
+            return command(*args, **kwargs)
+        except (PathologicalTemplateError, ImportError) as e:
+            raise click.ClickException(str(e))
+
+    return wrapper
+
+
+def _instrumented(command):
+    # Adds --stats and --profile to a command, which gets the Stats to record into (or None)
+    @functools.wraps(command)
+    def wrapper(*args, stats_format=None, profile=None, **kwargs):
+        stats = Stats() if stats_format is not None else None
+        profiler = cProfile.Profile() if profile is not None else None
+        try:
+            if profiler is not None:
+                return profiler.runcall(command, *args, stats=stats, **kwargs)
+            return command(*args, stats=stats, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.dump_stats(profile)
+            if stats is not None:
+                click.echo(stats.summary() if stats_format == "human" else stats.to_json(), err=True)
+
+    wrapper = click.option("--profile", type=click.Path(dir_okay=False),
+                           help="Write a cProfile dump of the run to this file, to be read with pstats")(wrapper)
+    wrapper = click.option("--stats", "stats_format", type=click.Choice(["human", "json"]), is_flag=False,
+                           flag_value="human",
+                           help="Print how long each phase took, how much was scanned, the number of matches "
+                                "and peak memory use to stderr, as a summary or as JSON")(wrapper)
+    return wrapper
 
 
 @reify.command("subs")
-@click.option("-it", "--input-template", required=True, prompt="Input template", type=click.Path(),
+@click.option("-it", "--input-template", type=click.Path(),
               help="Path to the template pattern you want to replace")
-@click.option("-ot", "--output-template", required=True, prompt="Output template", type=click.Path(),
+@click.option("-ot", "--output-template", type=click.Path(),
               help="Path to the template pattern to replace the old pattern with")
-@click.option("-f", "--file", required=True, prompt="File you want to search in", type=click.Path(),
-              help="Path to the file to perform find-and-replace on")
+@click.option("--input-text", metavar="TEMPLATE",
+              help="The template pattern you want to replace, given inline instead of with --input-template")
+@click.option("--output-text", metavar="TEMPLATE",
+              help="The template pattern to replace it with, given inline instead of with --output-template")
+@click.option("-r", "--rules", type=click.Path(exists=True, dir_okay=False),
+              help="Path to a file listing several input and output templates to apply in one pass, "
+                   "instead of -it and -ot")
+@click.option("-f", "--file", "files", multiple=True, type=click.Path(),
+              help="Path to the file to perform find-and-replace on, or - to substitute stdin into stdout as it "
+                   "is read. Directories and glob patterns substitute in every file they contain "
+                   "(requires --in-place). Can be repeated")
+@click.option("-F", "--files-from", type=click.File("r"),
+              help="File listing paths to perform find-and-replace on, one per line (- for stdin)")
+@click.option("-j", "--jobs", type=click.IntRange(min=1),
+              help="Number of worker processes when working on several files or with --parallel  "
+                   "[default: number of CPUs]")
 @click.option("-I", "--in-place", is_flag=True,
               help="If set, the substitution will be performed directly on the file")
+@click.option("-d", "--diff", "show_diff", is_flag=True,
+              help="If set, print a unified diff of the substitution instead of the substituted document. "
+                   "Works on several files too")
+@click.option("-U", "--unified", "context", type=click.IntRange(min=0), default=DEFAULT_CONTEXT, show_default=True,
+              help="Lines of unchanged text to show around each change with --diff")
 @click.option("-W", "--conserve-whitespace", is_flag=True,
               help="If set, newlines and other series of whitespace in the input template will be taken literally")
-def subs(input_template, output_template, file, in_place, conserve_whitespace):
+@click.option("-S", "--slot-mode", type=click.Choice(SLOT_MODES), default="greedy", show_default=True,
+              help="How much text untyped slots match: as much of the line as possible (greedy), as little as "
+                   "possible (lazy), or anything up to the literal character that follows them (delimited)")
+@click.option("--mmap", "use_mmap", is_flag=True,
+              help="If set, the file is memory-mapped and matched as raw bytes instead of being decoded first. "
+                   "Templates with collapsed whitespace, typed slots or length bounds match bytes differently "
+                   "from text, so files that aren't plain ASCII are still decoded for them")
+@click.option("--encoding", default="utf-8", show_default=True,
+              help="Encoding of the file, used with --mmap and when reading from stdin")
+@click.option("--max-span", type=click.IntRange(min=1), default=DEFAULT_MAX_SPAN, show_default=True,
+              help="Longest stretch of text a single match may cover when substituting in place or from stdin")
+@click.option("--parallel", is_flag=True,
+              help="If set, a single large file is memory-mapped and matched in pieces by --jobs worker processes. "
+                   "The file is split where the template's leading literal text occurs, or at --split-on")
+@click.option("--split-on",
+              help="Text that no match contains, such as a record separator, to split the file at with --parallel")
+@click.option("--engine", type=click.Choice(ENGINES), default="re", show_default=True,
+              help="Regular expression engine to match with. regex and re2 (google-re2) have to be installed "
+                   "separately, and re2 matches in linear time so no template can hang it")
+@click.option("--timeout", type=click.FloatRange(min=0, min_open=True),
+              help="Seconds of matching allowed per document before giving up on the template as pathological")
+@_instrumented
+@_report_errors
+def subs(input_template, output_template, input_text, output_text, rules, files, files_from, jobs, in_place,
+         show_diff, context, conserve_whitespace, slot_mode, use_mmap, encoding, max_span, parallel, split_on, engine,
+         timeout, stats):
     """Find a pattern in a document and replace it with different formatting"""
-    p = TemplateProcessor.from_files(input_template, output_template, conserve_whitespace)
-    click.echo(p.find_and_replace(file, in_place))
+    from_stdin = _check_stdin(files, files_from)
+    if rules is not None:
+        if any(t is not None for t in (input_template, output_template, input_text, output_text)):
+            raise click.UsageError("--rules cannot be combined with --input-template or --output-template")
+        p = RuleSet.from_file(rules, conserve_whitespace, slot_mode, engine, stats)
+    else:
+        if input_template is None and input_text is None:
+            input_template = _prompt_template("Input template", from_stdin)
+        if output_template is None and output_text is None:
+            output_template = _prompt_template("Output template", from_stdin)
+        p = _load(input_template, input_text, output_template, output_text, conserve_whitespace, slot_mode,
+                  engine, stats)
+    p.timeout = timeout
+
+    if from_stdin:
+        if in_place or show_diff or use_mmap or parallel:
+            raise click.UsageError("--in-place, --diff, --mmap and --parallel cannot be used when reading from stdin")
+        p.stats = stats
+        out = click.get_binary_stream("stdout")
+        # One encoder for the whole output, so that encodings with a BOM only write it once
+        encoder = codecs.getincrementalencoder(encoding)()
+        for piece in p.iter_sub(click.get_binary_stream("stdin"), encoding, max_span):
+            with record(stats, "output write"):
+                out.write(encoder.encode(piece))
+        with record(stats, "output write"):
+            out.write(encoder.encode("", final=True))
+            out.flush()
+        return
+
+    files, batch = _resolve_files(files, files_from, "File you want to search in")
+    if show_diff:
+        if in_place or use_mmap or parallel:
+            raise click.UsageError("--diff cannot be combined with --in-place, --mmap or --parallel")
+        p.stats = stats
+        failed = []
+        _write_pieces(_diffs(p, files, context, failed), False, stats)
+        if failed:
+            raise click.exceptions.Exit(1)
+        return
+
+    if batch:
+        if not in_place:
+            raise click.UsageError("Substituting in several files requires --in-place")
+        if use_mmap or parallel:
+            raise click.UsageError("--mmap and --parallel cannot be combined with several files")
+        _echo_batch(run_batch(p, files, "subs", jobs, max_span), "Replaced", stats)
+        return
+
+    file = files[0]
+    p.stats = stats
+    if split_on is not None and not parallel:
+        raise click.UsageError("--split-on requires --parallel")
+    if use_mmap or parallel:
+        if in_place:
+            raise click.UsageError("--mmap and --parallel cannot be combined with --in-place")
+        _check_bytes_encoding(encoding)
+        if parallel:
+            pieces = _parallel(p.replace_parallel, file, jobs, encoding, split_on)
+        else:
+            pieces = p.replace_mmap(file, encoding)
+        out = click.get_binary_stream("stdout")
+        for piece in pieces:
+            with record(stats, "output write"):
+                out.write(piece)
+        with record(stats, "output write"):
+            out.write(b"\n")
+            out.flush()
+        return
+
+    if in_place:
+        count = p.replace_in_place(file, max_span)
+        click.echo("Replaced %d occurrences in %s" % (count, file))
+        return
+
+    text = p.find_and_replace(file, in_place)
+    with record(stats, "output write"):
+        click.echo(text)
 
 
 @reify.command("generate")
@@ -51,10 +230,15 @@ def subs(input_template, output_template, file, in_place, conserve_whitespace):
               help="Path to the template you you're replacing it with")
 @click.option("-W", "--conserve-whitespace", is_flag=True,
               help="If set, newlines and other series of whitespace in the input template will be taken literally")
-def generate(input_template, output_template, conserve_whitespace):
+@click.option("-S", "--slot-mode", type=click.Choice(SLOT_MODES), default="greedy", show_default=True,
+              help="How much text untyped slots match: as much of the line as possible (greedy), as little as "
+                   "possible (lazy), or anything up to the literal character that follows them (delimited)")
+@_instrumented
+def generate(input_template, output_template, conserve_whitespace, slot_mode, stats):
     """Generate regular expression patterns to use in your own find-and-replace tool"""
-    p = TemplateProcessor.from_files(input_template, output_template, conserve_whitespace)
-    with open("%s.regex" % input_template, "w") as input_regex, \
+    p = TemplateProcessor.from_files(input_template, output_template, conserve_whitespace,
+                                     default_cache, slot_mode, stats=stats)
+    with record(stats, "output write"), open("%s.regex" % input_template, "w") as input_regex, \
             open("%s.regex" % output_template, "w") as output_regex:
         input_regex.write(p.pattern)
         output_regex.write(p.target)
@@ -63,37 +247,434 @@ def generate(input_template, output_template, conserve_whitespace):
 
 
 @reify.command("find")
-@click.option("-t", "--template", required=True, prompt="Input template", type=click.Path(),
+@click.option("-t", "--template", type=click.Path(),
               help="Path to the template you want to search against")
-@click.option("-f", "--file", required=True, prompt="File to search in", type=click.Path(),
-              help="Path to the file you want to search in")
+@click.option("--template-text", metavar="TEMPLATE",
+              help="The template you want to search against, given inline instead of with --template")
+@click.option("-f", "--file", "files", multiple=True, type=click.Path(),
+              help="Path to the file you want to search in, or - to search stdin as it is read. Directories and "
+                   "glob patterns count the matches in every file they contain. Can be repeated")
+@click.option("-F", "--files-from", type=click.File("r"),
+              help="File listing paths to search in, one per line (- for stdin)")
+@click.option("-j", "--jobs", type=click.IntRange(min=1),
+              help="Number of worker processes when searching several files or with --parallel  "
+                   "[default: number of CPUs]")
 @click.option("-W", "--conserve-whitespace", is_flag=True,
               help="If set, newlines and other series of whitespace in the input template will be taken literally")
-def find(template, file, conserve_whitespace):
+@click.option("-S", "--slot-mode", type=click.Choice(SLOT_MODES), default="greedy", show_default=True,
+              help="How much text untyped slots match: as much of the line as possible (greedy), as little as "
+                   "possible (lazy), or anything up to the literal character that follows them (delimited)")
+@click.option("--max-span", type=click.IntRange(min=1),
+              help="If set, the file is read in windows and matches are printed as they are found. "
+                   "No match may span more than this many characters  [default with stdin: %d]" % DEFAULT_MAX_SPAN)
+@click.option("--mmap", "use_mmap", is_flag=True,
+              help="If set, the file is memory-mapped and matched as raw bytes instead of being decoded first. "
+                   "Templates with collapsed whitespace, typed slots or length bounds match bytes differently "
+                   "from text, so files that aren't plain ASCII are still decoded for them")
+@click.option("--encoding", default="utf-8", show_default=True,
+              help="Encoding of the file, used with --mmap and when reading from stdin")
+@click.option("--parallel", is_flag=True,
+              help="If set, a single large file is memory-mapped and matched in pieces by --jobs worker processes. "
+                   "The file is split where the template's leading literal text occurs, or at --split-on")
+@click.option("--split-on",
+              help="Text that no match contains, such as a record separator, to split the file at with --parallel")
+@click.option("--engine", type=click.Choice(ENGINES), default="re", show_default=True,
+              help="Regular expression engine to match with. regex and re2 (google-re2) have to be installed "
+                   "separately, and re2 matches in linear time so no template can hang it")
+@click.option("--timeout", type=click.FloatRange(min=0, min_open=True),
+              help="Seconds of matching allowed per document before giving up on the template as pathological")
+@click.option("-c", "--count", is_flag=True,
+              help="If set, only the number of matches is printed")
+@click.option("-n", "--limit", type=click.IntRange(min=1),
+              help="Stop searching after this many matches")
+@click.option("--format", "output_format", type=click.Choice(["text", "jsonl"]), default="text", show_default=True,
+              help="Print matches highlighted for reading (text), or one JSON object per line with the file, "
+                   "the offsets of the match and the values of its slots (jsonl)")
+@click.option("--pager/--no-pager", default=None,
+              help="Whether to show matches through a pager  [default: when printing to a terminal]")
+@click.option("-w", "--truncate", type=click.IntRange(min=1),
+              help="Shorten slot values longer than this many characters when highlighting them")
+@_instrumented
+@_report_errors
+def find(template, template_text, files, files_from, jobs, conserve_whitespace, slot_mode, max_span, use_mmap,
+         encoding, parallel, split_on, engine, timeout, count, limit, output_format, pager, truncate, stats):
     """Find a pattern in a file"""
-    p = TemplateProcessor.from_files(template, None, conserve_whitespace)
-    matches = tuple(p.find(file))
-    num_matches = len(matches)
-
-    click.echo("Found %d occurrences matching template %s in %s" % (num_matches, template, file))
-    click.echo("(Slot data is highlighted in green)")
-    for i, m in enumerate(matches):
-        click.echo()
-        click.secho("Match %d" % (i + 1), fg="red")
-        first_group = m.start(1)
-        click.echo(m.group(0)[0:first_group - m.start(0)], nl=False)
-        click.secho(m.group(0)[first_group - m.start(0):m.end(1) - m.start(0)],
-                    bold=True, bg="green", nl=False)
-        for j in range(2, len(m.groups()) + 1):
-            end_of_prev_group = m.end(j - 1) - m.start(0)
-            start_of_next_group = m.start(j) - m.start(0)
-            end_of_next_group = m.end(j) - m.start(0)
-
-            click.echo(m.group(0)[end_of_prev_group:start_of_next_group], nl=False)
-            click.secho(m.group(0)[start_of_next_group:end_of_next_group],
-                       bold=True, bg="green", nl=False)
-
-        click.echo(m.group(0)[m.end(len(m.groups())) - m.start(0):m.end(0) - m.start(0)])
+    if count and output_format != "text":
+        raise click.UsageError("--count cannot be combined with --format")
+
+    if template is not None and template_text is not None:
+        raise click.UsageError("--template and --template-text cannot be combined")
+
+    from_stdin = _check_stdin(files, files_from)
+    if template is None and template_text is None:
+        template = _prompt_template("Input template", from_stdin)
+    if from_stdin:
+        files, batch = ["-"], False
+    else:
+        files, batch = _resolve_files(files, files_from, "File to search in")
+    p = _load(template, template_text, None, None, conserve_whitespace, slot_mode, engine, stats)
+    p.timeout = timeout
+    # Inline templates are named by their text in the headers
+    template = template or repr(template_text)
+    if batch:
+        if use_mmap or parallel:
+            raise click.UsageError("--mmap and --parallel cannot be combined with several files")
+        if output_format == "jsonl":
+            # Matches have to come back to this process to be printed, so the files are searched here
+            p.stats = stats
+            matches = _batch_matches(p, files, max_span or DEFAULT_MAX_SPAN)
+            _echo_jsonl(p, itertools.islice(matches, limit), stats)
+            return
+        if limit is not None:
+            raise click.UsageError("--limit cannot be combined with several files unless --format is jsonl")
+        _echo_batch(run_batch(p, files, "find", jobs, max_span or DEFAULT_MAX_SPAN), "Found", stats, count)
+        return
+
+    file = files[0]
+    p.stats = stats
+    if from_stdin and (use_mmap or parallel):
+        raise click.UsageError("--mmap and --parallel cannot be used when reading from stdin")
+    if (use_mmap or parallel) and max_span is not None:
+        raise click.UsageError("--mmap and --parallel cannot be combined with --max-span")
+    if split_on is not None and not parallel:
+        raise click.UsageError("--split-on requires --parallel")
+    if use_mmap or parallel:
+        _check_bytes_encoding(encoding)
+
+    if count:
+        # Counted as the regex finds them, without making match objects of our own
+        if from_stdin:
+            num_matches = p.count(click.get_binary_stream("stdin"), encoding, max_span or DEFAULT_MAX_SPAN,
+                                  limit=limit)
+        elif parallel:
+            num_matches = _parallel(functools.partial(p.count_parallel, limit=limit), file, jobs, encoding,
+                                    split_on)
+        elif use_mmap:
+            num_matches = p.count_mmap(file, encoding, limit)
+        else:
+            num_matches = p.count_file(file, max_span, limit)
+        with record(stats, "output write"):
+            click.echo(num_matches)
+        return
+
+    if from_stdin:
+        max_span = max_span or DEFAULT_MAX_SPAN
+        matches = p.finditer(click.get_binary_stream("stdin"), encoding, max_span)
+    elif parallel:
+        matches = _parallel(p.find_parallel, file, jobs, encoding, split_on)
+    elif use_mmap:
+        matches = p.find_mmap(file, encoding)
+    elif max_span is not None:
+        matches = p.find_streaming(file, max_span)
+    else:
+        matches = p.find(file)
+    matches = itertools.islice(matches, limit)
+
+    if output_format == "jsonl":
+        _echo_jsonl(p, ((file, m) for m in matches), stats)
+        return
+
+    if pager is None:
+        pager = click.get_text_stream("stdout").isatty()
+
+    if max_span is None:
+        matches = tuple(matches)
+        header = "Found %d occurrences matching template %s in %s\n" % (len(matches), template, file)
+        pieces = itertools.chain([header, "(Slot data is highlighted in green)\n"],
+                                 (render_match(i, m, truncate) for i, m in enumerate(matches)))
+    else:
+        pieces = _render_streaming(matches, truncate, template, file)
+
+    _write_pieces(pieces, pager, stats)
+
+
+def _check_stdin(files, files_from):
+    # Whether the document is read from stdin, which can't be mixed with other files
+    if "-" not in files:
+        return False
+    if len(files) > 1 or files_from is not None:
+        raise click.UsageError("Reading from stdin (-) cannot be combined with other files")
+    return True
+
+
+def _prompt_template(prompt, from_stdin):
+    if from_stdin:
+        raise click.UsageError("Templates have to be given as options when the document is read from stdin")
+    return click.prompt(prompt, type=click.Path())
+
+
+def _load(input_template, input_text, output_template, output_text, conserve_whitespace, slot_mode, engine, stats):
+    # Templates come from files, or are given inline. Cached processors are shared, so the timeout
+    # and stats of this run go on a copy.
+    if input_template is not None and input_text is not None:
+        raise click.UsageError("--input-template and --input-text cannot be combined")
+    if output_template is not None and output_text is not None:
+        raise click.UsageError("--output-template and --output-text cannot be combined")
+    if input_text is None and output_text is None:
+        return copy.copy(TemplateProcessor.from_files(input_template, output_template, conserve_whitespace,
+                                                      default_cache, slot_mode, engine, stats))
+
+    with record(stats, "template read"):
+        if input_text is None:
+            with open(input_template, "r") as h:
+                input_text = h.read()
+        if output_text is None and output_template is not None:
+            with open(output_template, "r") as h:
+                output_text = h.read()
+    return copy.copy(default_cache.get(input_text, output_text, conserve_whitespace, slot_mode, engine, stats))
+
+
+def _check_bytes_encoding(encoding):
+    # Memory-mapped files are matched as raw bytes, which only works in some encodings
+    try:
+        check_encoding(encoding)
+    except (ValueError, LookupError) as e:
+        raise click.BadParameter(str(e), param_hint="--encoding")
+
+
+def _diffs(p, files, context, failed):
+    # Diffs of every file in turn, carrying on past files that can't be read or matched, which are
+    # added to `failed`
+    for file in files:
+        try:
+            yield from p.diff(file, context)
+        except (OSError, UnicodeDecodeError, PathologicalTemplateError) as e:
+            failed.append(file)
+            click.secho("%s: %s: %s" % (file, type(e).__name__, e), fg="red", err=True)
+
+
+def _parallel(method, file, jobs, encoding, split_on):
+    # Templates that can't be split up safely are reported before any output is written
+    try:
+        return method(file, jobs, encoding, split_on)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+
+def _render_streaming(matches, truncate, template, file):
+    yield "(Slot data is highlighted in green)\n"
+    num_matches = 0
+    for num_matches, m in enumerate(matches, 1):
+        yield render_match(num_matches - 1, m, truncate)
+
+    yield "\nFound %d occurrences matching template %s in %s\n" % (num_matches, template, file)
+
+
+def _write_pieces(pieces, pager, stats=None):
+    chunks = chunked(pieces)
+    if stats is not None:
+        # Rendering counts as writing output, while finding the matches on the way still counts as matching
+        chunks = stats.timed("output write", chunks, count=False)
+
+    if pager:
+        # Like git, only page when the output doesn't fit on the screen
+        os.environ.setdefault("LESS", "FRX")
+        click.echo_via_pager(chunks)
+        return
+
+    for chunk in chunks:
+        with record(stats, "output write"):
+            click.echo(chunk, nl=False)
+
+
+def _resolve_files(files, files_from, prompt):
+    paths = list(files)
+    if files_from is not None:
+        paths.extend(line.strip() for line in files_from if line.strip())
+    if not paths:
+        paths.append(click.prompt(prompt, type=click.Path()))
+
+    expanded = expand_paths(paths)
+    return expanded, expanded != paths or len(expanded) != 1
+
+
+def _echo_batch(results, verb, stats=None, total_only=False):
+    total = 0
+    num_files = 0
+    failures = 0
+    if stats is not None:
+        # The workers do the reading and writing too, so all of it counts as matching
+        results = stats.timed("matching", results, count=False)
+    for result in results:
+        num_files += 1
+        if result.error is not None:
+            failures += 1
+            click.secho("%s: %s" % (result.path, result.error), fg="red", err=True)
+        else:
+            total += result.count
+            if not total_only:
+                click.echo("%s: %d" % (result.path, result.count))
+            if stats is not None:
+                stats.files += 1
+                stats.matches += result.count
+                stats.bytes_scanned += os.path.getsize(result.path)
+
+    if total_only:
+        click.echo(total)
+    else:
+        click.echo("%s %d occurrences in %d files (%d failed)" % (verb, total, num_files, failures))
+    if failures:
+        raise click.exceptions.Exit(1)
+
+
+def _batch_matches(p, files, max_span):
+    for file in files:
+        try:
+            for m in p.find_streaming(file, max_span):
+                yield file, m
+        except (OSError, PathologicalTemplateError) as e:
+            click.secho("%s: %s: %s" % (file, type(e).__name__, e), fg="red", err=True)
+
+
+def _echo_jsonl(p, matches, stats=None):
+    # Offsets are in characters, or in bytes for memory-mapped files
+    out = click.get_text_stream("stdout")
+    for file, m in matches:
+        line = json.dumps({
+            "file": file,
+            "start": m.start(),
+            "end": m.end(),
+            "slots": p.slots(m),
+            "groups": list(m.groups()),
+        })
+        with record(stats, "output write"):
+            out.write(line + "\n")
+    out.flush()
+
+
+@reify.command("watch")
+@click.option("-it", "--input-template", type=click.Path(exists=True, dir_okay=False),
+              help="Path to the template pattern you want to replace")
+@click.option("-ot", "--output-template", type=click.Path(exists=True, dir_okay=False),
+              help="Path to the template pattern to replace the old pattern with")
+@click.option("-r", "--rules", type=click.Path(exists=True, dir_okay=False),
+              help="Path to a file listing several input and output templates to apply in one pass, "
+                   "instead of -it and -ot")
+@click.option("-f", "--file", "files", multiple=True, required=True, type=click.Path(),
+              help="File, directory or glob pattern to watch. Can be repeated")
+@click.option("-o", "--output-dir", type=click.Path(file_okay=False),
+              help="Directory to write substituted copies of the files to, mirroring their paths")
+@click.option("-I", "--in-place", is_flag=True,
+              help="If set, files are substituted in place whenever they are written, instead of with --output-dir")
+@click.option("-W", "--conserve-whitespace", is_flag=True,
+              help="If set, newlines and other series of whitespace in the input template will be taken literally")
+@click.option("-S", "--slot-mode", type=click.Choice(SLOT_MODES), default="greedy", show_default=True,
+              help="How much text untyped slots match: as much of the line as possible (greedy), as little as "
+                   "possible (lazy), or anything up to the literal character that follows them (delimited)")
+@click.option("--engine", type=click.Choice(ENGINES), default="re", show_default=True,
+              help="Regular expression engine to match with. regex and re2 (google-re2) have to be installed "
+                   "separately, and re2 matches in linear time so no template can hang it")
+@click.option("--timeout", type=click.FloatRange(min=0, min_open=True),
+              help="Seconds of matching allowed per document before giving up on the template as pathological")
+@click.option("--poll", "interval", type=click.FloatRange(min=0, min_open=True),
+              help="Check for changes every this many seconds instead of being notified of them by inotify")
+def watch(input_template, output_template, rules, files, output_dir, in_place, conserve_whitespace, slot_mode,
+          engine, timeout, interval):
+    """Keep substituting in files as they and the templates change"""
+    if (output_dir is None) == (not in_place):
+        raise click.UsageError("Exactly one of --output-dir and --in-place is required")
+
+    if rules is not None:
+        if input_template is not None or output_template is not None:
+            raise click.UsageError("--rules cannot be combined with --input-template or --output-template")
+        templates = [rules] + [path for pair in rule_paths(rules) for path in pair]
+
+        def load():
+            return RuleSet.from_file(rules, conserve_whitespace, slot_mode, engine)
+    else:
+        if input_template is None or output_template is None:
+            raise click.UsageError("--input-template and --output-template are required without --rules")
+        templates = [input_template, output_template]
+
+        def load():
+            return TemplateProcessor.from_files(input_template, output_template, conserve_whitespace,
+                                                default_cache, slot_mode, engine)
+
+    def load_with_timeout():
+        # A copy, since cached processors are shared
+        p = copy.copy(load())
+        p.timeout = timeout
+        return p
+
+    watcher = Watcher(load_with_timeout, templates, files, output_dir, interval or 1.0, interval is not None)
+    click.echo("Watching %s for changes (Ctrl+C to stop)" % ", ".join(files + tuple(templates)))
+    try:
+        for event in watcher.run():
+            if event.kind == "failed":
+                click.secho("%s: %s" % (event.path, event.error), fg="red", err=True)
+            elif event.kind == "compiled":
+                click.echo("Compiled %s" % event.path)
+            elif event.kind == "unchanged":
+                click.echo("%s compiles to the same patterns as before" % event.path)
+            else:
+                click.echo("%s: %d" % (event.path, event.count))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+@reify.command("serve")
+@click.option("-t", "--template", "templates", multiple=True, nargs=3,
+              type=(str, click.Path(exists=True, dir_okay=False), click.Path(exists=True, dir_okay=False)),
+              metavar="NAME INPUT OUTPUT", help="Name to serve an input and output template under. Can be repeated")
+@click.option("-ft", "--find-template", "find_templates", multiple=True, nargs=2,
+              type=(str, click.Path(exists=True, dir_okay=False)),
+              metavar="NAME TEMPLATE", help="Name to serve a template for finding only under. Can be repeated")
+@click.option("-r", "--rules", multiple=True, nargs=2, type=(str, click.Path(exists=True, dir_okay=False)),
+              metavar="NAME RULES", help="Name to serve a rule set under. Can be repeated")
+@click.option("--socket", "socket_path", type=click.Path(dir_okay=False),
+              help="Path of a Unix socket to listen on instead of --host and --port")
+@click.option("--host", default="127.0.0.1", show_default=True,
+              help="Address to listen on")
+@click.option("--port", type=click.IntRange(min=0, max=65535), default=8750, show_default=True,
+              help="Port to listen on")
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True,
+              help="Number of worker processes to match in. With 1, requests are matched in the server's threads, "
+                   "unless --timeout is given with the re engine")
+@click.option("-W", "--conserve-whitespace", is_flag=True,
+              help="If set, newlines and other series of whitespace in the input templates will be taken literally")
+@click.option("-S", "--slot-mode", type=click.Choice(SLOT_MODES), default="greedy", show_default=True,
+              help="How much text untyped slots match: as much of the line as possible (greedy), as little as "
+                   "possible (lazy), or anything up to the literal character that follows them (delimited)")
+@click.option("--engine", type=click.Choice(ENGINES), default="re", show_default=True,
+              help="Regular expression engine to match with. regex and re2 (google-re2) have to be installed "
+                   "separately, and re2 matches in linear time so no template can hang it")
+@click.option("--timeout", type=click.FloatRange(min=0, min_open=True),
+              help="Seconds of matching allowed per document before giving up on the template as pathological. "
+                   "The re engine can only be interrupted on a process's main thread, so with it requests are "
+                   "matched in worker processes even with -j 1")
+@_report_errors
+def serve(templates, find_templates, rules, socket_path, host, port, jobs, conserve_whitespace, slot_mode, engine,
+          timeout):
+    """Keep templates compiled and find and substitute in documents sent over HTTP"""
+    processors = dict()
+    for name, input_template, output_template in templates:
+        processors[name] = TemplateProcessor.from_files(input_template, output_template, conserve_whitespace,
+                                                        default_cache, slot_mode, engine)
+    for name, template in find_templates:
+        processors[name] = TemplateProcessor.from_files(template, None, conserve_whitespace,
+                                                        default_cache, slot_mode, engine)
+    for name, rules_file in rules:
+        processors[name] = RuleSet.from_file(rules_file, conserve_whitespace, slot_mode, engine)
+
+    if not processors:
+        raise click.UsageError("At least one --template, --find-template or --rules is required")
+    if len(processors) < len(templates) + len(find_templates) + len(rules):
+        raise click.UsageError("Every template and rule set needs a name of its own")
+    # Copies, since cached processors are shared
+    processors = {name: copy.copy(p) for name, p in processors.items()}
+    for p in processors.values():
+        p.timeout = timeout
+
+    server = ReifyServer(processors, jobs)
+    address = socket_path or (host, port)
+    click.echo("Serving %s on %s (Ctrl+C to stop)" % (
+        ", ".join(sorted(processors)), socket_path or "http://%s:%d" % (host, port)))
+    try:
+        server.serve(address)
+    except KeyboardInterrupt:
+        pass
 
 
 @reify.command("license")
@@ -0,0 +1,220 @@
+import re
+from functools import lru_cache
+from typing import *
+
+
+class Literal(NamedTuple):
+    text: str
+
+
+class Whitespace(NamedTuple):
+    text: str
+
+
+class Slot(NamedTuple):
+    token: str
+
+
+Node = Union[Literal, Whitespace, Slot]
+
+# Characters in literal template text that need a backslash in front of them to be taken literally
+ESCAPES = {ord(c): f"\\{c}" for c in "\\[(=/!|?\"'."}
+
+# Unescaped characters that make the text around them optional or zero-width in the compiled pattern:
+# quantifiers together with the character they apply to, braces and anchors
+UNSAFE_LITERAL = re.compile(r".?[*+{]|[}^$)]", re.DOTALL)
+
+# greedy: slots take as much of the line as they can, like `.*`
+# lazy: slots take as little as they can, like `.*?`
+# delimited: slots can't contain the first character of the literal text after them, like `[^<\n]*`,
+#   and fall back to lazy when they aren't followed by literal text
+SLOT_MODES = ("greedy", "lazy", "delimited")
+
+# Typed slots, {{label:type}} or {{:type}}: what may come before the value, the characters it's made of
+# and how many of them there are unless bounds are given with {{label:type:min..max}}
+SLOT_TYPES = {
+    "any": ("", ".", "*"),
+    "int": ("[+-]?", r"\d", "+"),
+    "word": ("", r"\w", "+"),
+    "attr": ("", r"[^\"'<>]", "*"),
+    "text": ("", r"[^<]", "*"),
+}
+
+TYPED_SLOT = re.compile(r"([A-Za-z0-9\-_]*):([a-z]*)(?::(\d*)\.\.(\d*))?")
+
+TOKEN = re.compile(r"{{(.*?)}}|(\s+)|((?:[^{\s]|{(?!{))+)|({{)", re.DOTALL)
+
+SLOT_TOKEN = re.compile(r"{{(.*?)}}", re.DOTALL)
+
+WHITESPACE = re.compile(r"(\s+)")
+
+# Building nodes without going through their generated __new__ saves a call per node
+_node = tuple.__new__
+
+
+def tokenize(text: str) -> List[Node]:
+    """Split a template into literal text, whitespace runs and slots. The splitting is done by
+    `re.split`, so that only the nodes themselves are made in Python."""
+    nodes = []
+    append = nodes.append
+    for i, piece in enumerate(SLOT_TOKEN.split(text)):
+        if i % 2:
+            append(_node(Slot, (piece,)))
+            continue
+        if "{{" in piece:
+            unterminated = next(m for m in TOKEN.finditer(text) if m.lastindex == 4)
+            raise ValueError(f"Unterminated slot at position {unterminated.start()}")
+        for j, part in enumerate(WHITESPACE.split(piece)):
+            if part:
+                append(_node(Whitespace if j % 2 else Literal, (part,)))
+    return nodes
+
+
+def compile_input(nodes: Sequence[Node], conserve_whitespace: bool, group_prefix: str = "",
+                  slot_mode: str = "greedy") -> str:
+    """`group_prefix` is put in front of every named group, so that several compiled templates can
+    be combined into one pattern without their labels clashing. `slot_mode` is one of SLOT_MODES."""
+    if slot_mode not in SLOT_MODES:
+        raise ValueError(f"Unknown slot mode {slot_mode!r}, expected one of {', '.join(SLOT_MODES)}")
+
+    parts = []
+    for i, node in enumerate(nodes):
+        if isinstance(node, Literal):
+            parts.append(node.text.translate(ESCAPES))
+        elif isinstance(node, Whitespace):
+            parts.append(node.text if conserve_whitespace else collapse_whitespace(node.text))
+        else:
+            delimiter = None
+            if slot_mode == "delimited" and i + 1 < len(nodes) and isinstance(nodes[i + 1], Literal):
+                delimiter = nodes[i + 1].text[0]
+            parts.append(input_slot(node.token, group_prefix, slot_mode, delimiter))
+
+    return "".join(parts)
+
+
+def compile_output(nodes: Iterable[Node], group_offset: int = 0, group_prefix: str = "") -> str:
+    """`group_offset` is added to every numbered reference and `group_prefix` put in front of every
+    label, to refer to the groups of an input template compiled into a larger pattern"""
+    parts = []
+    for node in nodes:
+        if isinstance(node, Slot):
+            parts.append(output_slot(node.token, group_offset, group_prefix))
+        else:
+            parts.append(node.text)
+
+    return "".join(parts)
+
+
+def required_literals(nodes: Iterable[Node], conserve_whitespace: bool) -> List[str]:
+    """The fragments of literal text that every match of the compiled input template must contain"""
+    runs = []
+    run = []
+    for node in nodes:
+        if isinstance(node, Literal):
+            run.append(node.text)
+        elif isinstance(node, Whitespace) and (conserve_whitespace or collapse_whitespace(node.text) == node.text):
+            run.append(node.text)
+        else:
+            runs.append("".join(run))
+            run = []
+    runs.append("".join(run))
+
+    pieces = (piece for run in runs for piece in UNSAFE_LITERAL.split(run) if piece)
+    return list(dict.fromkeys(pieces))
+
+
+def leading_literal(nodes: Sequence[Node], conserve_whitespace: bool) -> str:
+    """The literal text every match of the compiled input template starts with, if any"""
+    run = []
+    for node in nodes:
+        if isinstance(node, Literal):
+            run.append(node.text)
+        elif isinstance(node, Whitespace) and (conserve_whitespace or collapse_whitespace(node.text) == node.text):
+            run.append(node.text)
+        else:
+            break
+
+    run = "".join(run)
+    unsafe = UNSAFE_LITERAL.search(run)
+    return run if unsafe is None else run[:unsafe.start()]
+
+
+@lru_cache(maxsize=None)
+def collapse_whitespace(text: str) -> str:
+    text = re.sub(r"\n+", lambda m: r"\s*", text)
+    return re.sub(r"\s{2,}", lambda m: r"\s*", text)
+
+
+@lru_cache(maxsize=None)
+def input_slot(token: str, group_prefix: str = "", slot_mode: str = "greedy", delimiter: Optional[str] = None) -> str:
+    typed = TYPED_SLOT.fullmatch(token)
+    if typed is not None and (typed.group(1) or typed.group(2) in SLOT_TYPES or typed.group(3) is not None):
+        label, kind, low, high = typed.groups()
+        if kind and kind not in SLOT_TYPES:
+            raise ValueError(f"Unknown slot type {kind!r} in {{{{{token}}}}}, expected one of {', '.join(SLOT_TYPES)}")
+        body = slot_body(kind or "any", slot_mode, delimiter, low, high)
+        return f"(?:{body})" if not label else _slot_group(label, body, group_prefix)
+
+    if token == ":":
+        return f"(?:{slot_body('any', slot_mode, delimiter)})"
+    elif re.match(r":.+", token):
+        return f"\\{token[1:]}*"
+    elif re.match(r"[A-Za-z0-9\-_]+", token):
+        return _slot_group(token, slot_body("any", slot_mode, delimiter), group_prefix)
+    else:
+        return f"({slot_body('any', slot_mode, delimiter)})"
+
+
+def _slot_group(label: str, body: str, group_prefix: str) -> str:
+    if re.match(r"^\d|-", label):
+        return f"(?P<{group_prefix}_{label}>{body})"
+    return f"(?P<{group_prefix}{label}>{body})"
+
+
+def slot_label(group: str, group_prefix: str = "") -> str:
+    """The label a slot was written with, given the name of the group `_slot_group` made for it"""
+    if group_prefix and group.startswith(group_prefix):
+        group = group[len(group_prefix):]
+    if re.match(r"_(\d|-)", group):
+        return group[1:]
+    return group
+
+
+def slot_body(kind: str, slot_mode: str = "greedy", delimiter: Optional[str] = None,
+              low: Optional[str] = None, high: Optional[str] = None) -> str:
+    prefix, atom, quantifier = SLOT_TYPES[kind]
+    lazy = False
+    if kind == "any" and slot_mode == "delimited" and delimiter is not None and not delimiter.isspace():
+        atom = f"[^{re.escape(delimiter)}\\n]"
+    elif kind == "any" and slot_mode != "greedy":
+        lazy = True
+
+    if low is not None:
+        quantifier = f"{{{low or 0},{high}}}"
+    return prefix + atom + quantifier + ("?" if lazy else "")
+
+
+@lru_cache(maxsize=None)
+def output_slot(token: str, group_offset: int = 0, group_prefix: str = "") -> str:
+    def number(n: str) -> str:
+        return f"\\g<{group_offset + int(n)}>" if group_offset else f"\\{n}"
+
+    def reference(s: str) -> str:
+        if group_offset and s.isdigit():
+            return f"\\g<{group_offset + int(s)}>"
+        return f"\\g<{s}>" if s.isdigit() else f"\\g<{group_prefix}{s}>"
+
+    if re.match(r"^(?:\d+ )+\d$", token):
+        return "".join(number(i) for i in token.split(" "))
+    elif re.match(r"\d+\.\.\d+", token):
+        limits = token.split("..")
+        return "".join(number(str(i)) for i in range(int(limits[0]), int(limits[1]) + 1))
+    elif re.match(r"^\d+$", token):
+        return number(token)
+    elif re.match(r"(?:[\w\d\-_]+ )+[\w\d\-_]+", token):
+        return "".join(reference(s) for s in token.split(" "))
+    elif re.match(r"[\w\d\-_]+", token):
+        return reference(token)
+
+    # Anything else, like an empty slot {{}}, expands to nothing
+    return ""
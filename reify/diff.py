@@ -0,0 +1,177 @@
+from typing import *
+
+# Lines of unchanged text shown around each change, like `diff -u`
+DEFAULT_CONTEXT = 3
+
+
+class LineIndex:
+    """Line numbers of offsets in a document. Newlines are counted from the last offset asked
+    about, so asking about offsets in increasing order only counts the newlines of the document
+    once, and the lines around an offset are found by searching outwards from it."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self._pos = 0
+        self._line = 0
+
+    def line(self, pos: int) -> int:
+        """The number of the line an offset is on, counting from 0"""
+        if pos < self._pos:
+            self._pos = self._line = 0
+        self._line += self.text.count("\n", self._pos, pos)
+        self._pos = pos
+        return self._line
+
+    def start(self, pos: int, before: int = 0) -> int:
+        """The offset of the start of the line `before` lines above the one `pos` is on"""
+        start = self.text.rfind("\n", 0, pos) + 1
+        for _ in range(before):
+            if start == 0:
+                break
+            start = self.text.rfind("\n", 0, start - 1) + 1
+        return start
+
+    def end(self, pos: int, after: int = 0) -> int:
+        """The offset just past the end (including the newline) of the line `after` lines below the one `pos` is on"""
+        end = pos
+        for _ in range(after + 1):
+            if end >= len(self.text):
+                return len(self.text)
+            newline = self.text.find("\n", end)
+            end = len(self.text) if newline == -1 else newline + 1
+        return end
+
+
+class _Change(NamedTuple):
+    # Whole lines of the original document, and what they become
+    start: int
+    end: int
+    replacement: str
+
+
+def _changes(text: str, replacements: Iterable[Tuple[int, int, str]], lines: LineIndex) -> Iterator[_Change]:
+    """Group replacements into blocks of whole lines, merging replacements that share a line"""
+    # The start and end of the lines, the new text so far and where in the old text it got to
+    block = None
+    for start, end, replacement in replacements:
+        if text[start:end] == replacement:
+            continue
+
+        line_start = lines.start(start)
+        # A match ending with a newline doesn't change the line after it
+        line_end = lines.end(end - 1 if end > start and text[end - 1] == "\n" else end)
+        if block is not None:
+            _close_line(text, block, lines)
+            # Replacements that touch, such as one taking away a newline and an insertion right
+            # after it, make up one change even where they're on different lines
+            if line_start < block[1] or start == block[3]:
+                block[2].extend((text[block[3]:start], replacement))
+                block[1] = max(line_end, block[1])
+                block[3] = end
+                continue
+            yield _finish(text, block, lines)
+        block = [line_start, line_end, [text[line_start:start], replacement], end]
+
+    if block is not None:
+        yield _finish(text, block, lines)
+
+
+def _close_line(text: str, block: list, lines: LineIndex):
+    # If a replacement takes away the newline at the end of the block, the line after it joins the
+    # last line of the replacement, so it's part of the change too
+    start, end, pieces, pos = block
+    if pos == end and end < len(text):
+        new = "".join(pieces)
+        if new and not new.endswith("\n"):
+            block[1] = lines.end(end)
+
+
+def _finish(text: str, block: list, lines: LineIndex) -> _Change:
+    _close_line(text, block, lines)
+    start, end, pieces, pos = block
+    pieces.append(text[pos:end])
+    return _Change(start, end, "".join(pieces))
+
+
+def _split(text: str) -> List[str]:
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+        return [line + "\n" for line in lines]
+    # The last line has no newline
+    return [line + "\n" for line in lines[:-1]] + [lines[-1]]
+
+
+def _prefixed(prefix: str, lines: List[str]) -> Iterator[str]:
+    for line in lines:
+        yield prefix + line
+        if not line.endswith("\n"):
+            yield "\n\\ No newline at end of file\n"
+
+
+def diff_hunks(text: str, replacements: Iterable[Tuple[int, int, str]],
+               context: int = DEFAULT_CONTEXT) -> Iterator[str]:
+    """Yield the hunks of a unified diff between `text` and `text` with each `(start, end, replacement)`
+    applied, piece by piece. Replacements have to be in order and not overlap. Only the lines
+    around the replacements are looked at, so the time taken depends on how much changed rather
+    than on the size of the document."""
+    lines = LineIndex(text)
+    hunk: List[_Change] = []
+    # How many more lines the new document has than the old one before the current hunk
+    offset = 0
+
+    for change in _changes(text, replacements, lines):
+        if hunk and lines.start(change.start, context) > lines.end(hunk[-1].end, context - 1):
+            yield from _hunk(text, hunk, lines, context, offset)
+            offset += sum(len(_split(c.replacement)) - len(_split(text[c.start:c.end])) for c in hunk)
+            hunk = []
+        hunk.append(change)
+
+    if hunk:
+        yield from _hunk(text, hunk, lines, context, offset)
+
+
+def _hunk(text: str, changes: List[_Change], lines: LineIndex, context: int, offset: int) -> Iterator[str]:
+    start = lines.start(changes[0].start, context)
+    end = lines.end(changes[-1].end, context - 1) if context else changes[-1].end
+    first = lines.line(start)
+
+    body = []
+    old_count = new_count = 0
+    pos = start
+    for change in changes:
+        unchanged = _split(text[pos:change.start])
+        old = _split(text[change.start:change.end])
+        new = _split(change.replacement)
+        body.extend(_prefixed(" ", unchanged))
+        body.extend(_prefixed("-", old))
+        body.extend(_prefixed("+", new))
+        old_count += len(unchanged) + len(old)
+        new_count += len(unchanged) + len(new)
+        pos = change.end
+
+    unchanged = _split(text[pos:end])
+    body.extend(_prefixed(" ", unchanged))
+    old_count += len(unchanged)
+    new_count += len(unchanged)
+
+    yield f"@@ -{_range(first, old_count)} +{_range(first + offset, new_count)} @@\n"
+    yield from body
+
+
+def _range(first: int, count: int) -> str:
+    # Lines are numbered from 1, and an empty range is given as the line before it
+    if count == 1:
+        return str(first + 1)
+    return f"{first + 1 if count else first},{count}"
+
+
+def unified_diff(path: str, text: str, replacements: Iterable[Tuple[int, int, str]],
+                 context: int = DEFAULT_CONTEXT) -> Iterator[str]:
+    """`diff_hunks` under a header naming `path` as both the old and the new file, or nothing at
+    all if nothing changes"""
+    hunks = diff_hunks(text, replacements, context)
+    for first in hunks:
+        yield f"--- {path}\n+++ {path}\n"
+        yield first
+        yield from hunks
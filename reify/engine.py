@@ -0,0 +1,204 @@
+import importlib
+import signal
+import threading
+import time
+from typing import *
+from typing import Match, Pattern
+
+
+class PathologicalTemplateError(RuntimeError):
+    """Matching a single document took longer than its time budget. This almost always means the
+    template backtracks catastrophically on that document, for example greedy slots on long lines."""
+
+    def __init__(self, seconds: float):
+        # Only the seconds are kept in `args`, so that the error can be pickled back from a worker process
+        super().__init__(seconds)
+        self.seconds = seconds
+
+    def __str__(self):
+        return (f"Pathological template: matching took longer than {self.seconds:g}s on one document. "
+                f"Try the delimited slot mode or typed slots")
+
+
+class _Expired(Exception):
+    pass
+
+
+class Engine:
+    """A regular expression backend. Engines only hold their name, so processors using them can be
+    sent to worker processes, and the backend itself is imported the first time it is needed."""
+    name = "re"
+    module = "re"
+    package = None
+
+    # Whether a match in progress can be interrupted by a signal
+    interruptible = True
+
+    def load(self):
+        try:
+            return importlib.import_module(self.module)
+        except ImportError as e:
+            raise ImportError(f"The {self.name} engine needs the {self.package} package to be installed") from e
+
+    def compile(self, pattern: AnyStr) -> Pattern:
+        return self.load().compile(pattern)
+
+    def budget(self, regex: Pattern, seconds: float) -> "Budget":
+        return Budget(regex, seconds, self.interruptible)
+
+    def __eq__(self, other):
+        return type(self) is type(other)
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name!r}>"
+
+
+class RegexEngine(Engine):
+    """The third-party `regex` module, which can abort a match itself once a timeout runs out"""
+    name = "regex"
+    module = "regex"
+    package = "regex"
+
+    def budget(self, regex: Pattern, seconds: float) -> "Budget":
+        return RegexBudget(regex, seconds)
+
+
+class Re2Engine(Engine):
+    """Google's RE2, which matches in linear time so no template can backtrack catastrophically.
+    It doesn't support backreferences or lookarounds, which Reify templates never produce."""
+    name = "re2"
+    module = "re2"
+    package = "google-re2"
+    interruptible = False
+
+
+ENGINES: Dict[str, Engine] = {e.name: e for e in (Engine(), RegexEngine(), Re2Engine())}
+
+
+def get_engine(engine: Union[str, Engine]) -> Engine:
+    if isinstance(engine, Engine):
+        return engine
+    try:
+        return ENGINES[engine]
+    except KeyError:
+        raise ValueError(f"Unknown regex engine {engine!r}, expected one of {', '.join(ENGINES)}") from None
+
+
+class Budget:
+    """Wraps a compiled pattern for matching one document, raising `PathologicalTemplateError` once
+    the time spent inside the engine adds up to more than `seconds`.
+
+    Time spent by the caller between matches doesn't count. The stdlib engine is interrupted with
+    SIGALRM, which is only possible on the main thread; elsewhere, or for engines that can't be
+    interrupted, the budget is checked whenever a call into the engine returns.
+    """
+
+    def __init__(self, regex: Pattern, seconds: float, interruptible: bool = True):
+        self.regex = regex
+        self.seconds = seconds
+        self.elapsed = 0.0
+        self.interruptible = interruptible
+
+    @property
+    def pattern(self) -> AnyStr:
+        return self.regex.pattern
+
+    @property
+    def groups(self) -> int:
+        return self.regex.groups
+
+    @property
+    def groupindex(self) -> Mapping[str, int]:
+        return self.regex.groupindex
+
+    def remaining(self) -> float:
+        remaining = self.seconds - self.elapsed
+        if remaining <= 0:
+            raise PathologicalTemplateError(self.seconds)
+        return remaining
+
+    def _call(self, function: Callable, *args, **kwargs):
+        remaining = self.remaining()
+        start = time.perf_counter()
+        try:
+            if self.interruptible and _can_alarm():
+                result = _with_alarm(remaining, function, *args, **kwargs)
+            else:
+                result = function(*args, **kwargs)
+        except (_Expired, TimeoutError):
+            raise PathologicalTemplateError(self.seconds) from None
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+        self.remaining()
+        return result
+
+    def search(self, string: AnyStr, *args) -> Optional[Match]:
+        return self._call(self.regex.search, string, *args)
+
+    def match(self, string: AnyStr, *args) -> Optional[Match]:
+        return self._call(self.regex.match, string, *args)
+
+    def finditer(self, string: AnyStr, *args) -> Iterator[Match]:
+        matches = self._finditer(string, *args)
+        while True:
+            m = self._call(next, matches, None)
+            if m is None:
+                return
+            yield m
+
+    def _finditer(self, string: AnyStr, *args) -> Iterator[Match]:
+        return self.regex.finditer(string, *args)
+
+    def sub(self, repl, string: AnyStr, count: int = 0) -> AnyStr:
+        return self._call(self.regex.sub, repl, string, count)
+
+    def subn(self, repl, string: AnyStr, count: int = 0) -> Tuple[AnyStr, int]:
+        return self._call(self.regex.subn, repl, string, count)
+
+
+class RegexBudget(Budget):
+    """A budget enforced by the `regex` module's own timeouts"""
+
+    def __init__(self, regex: Pattern, seconds: float):
+        super().__init__(regex, seconds, interruptible=False)
+
+    def search(self, string: AnyStr, *args) -> Optional[Match]:
+        return self._call(self.regex.search, string, *args, timeout=self.remaining())
+
+    def match(self, string: AnyStr, *args) -> Optional[Match]:
+        return self._call(self.regex.match, string, *args, timeout=self.remaining())
+
+    def _finditer(self, string: AnyStr, *args) -> Iterator[Match]:
+        # The timeout applies to each step of the iterator, and the total is checked after every step
+        return self.regex.finditer(string, *args, timeout=self.remaining())
+
+    def sub(self, repl, string: AnyStr, count: int = 0) -> AnyStr:
+        return self._call(self.regex.sub, repl, string, count, timeout=self.remaining())
+
+    def subn(self, repl, string: AnyStr, count: int = 0) -> Tuple[AnyStr, int]:
+        return self._call(self.regex.subn, repl, string, count, timeout=self.remaining())
+
+
+def _can_alarm() -> bool:
+    return (hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+            and signal.getitimer(signal.ITIMER_REAL)[0] == 0)
+
+
+def _expire(signum, frame):
+    raise _Expired()
+
+
+def _with_alarm(seconds: float, function: Callable, *args, **kwargs):
+    previous = signal.signal(signal.SIGALRM, _expire)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    finally:
+        signal.signal(signal.SIGALRM, previous)
@@ -1,3 +1,4 @@
+import queue
 import tkinter as tk
 from tkinter import ttk
 import tkinter.filedialog as fdialog
@@ -6,10 +7,38 @@ from tkinter.scrolledtext import ScrolledText
 from typing import Dict, Type, List, Collection, Tuple, Callable
 
 from .TemplateProcessor import *
+from .matchset import MatchSet
+from .worker import MatchWorker, Templates, span_note
 
 
 LARGE_FONT = ("Verdana", 12)
 
+# Steps of the progress bars
+PROGRESS_RANGE = 1000
+
+
+class CallQueue:
+    """Runs functions posted from other threads on Tk's thread, since Tk can only be used from the
+    thread it runs on"""
+
+    def __init__(self, widget: tk.Misc, interval: int = 50):
+        self.widget = widget
+        self.interval = interval
+        self._calls = queue.SimpleQueue()
+        self.widget.after(self.interval, self._run)
+
+    def post(self, function: Callable[[], None]):
+        self._calls.put(function)
+
+    def _run(self):
+        while True:
+            try:
+                function = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            function()
+        self.widget.after(self.interval, self._run)
+
 
 class ButtonSeries (ttk.Frame):
     def __init__(self, parent, controller, button_data: Collection[Tuple[str, Callable[[], None]]], spacing=5, orientation=tk.E):
@@ -25,6 +54,33 @@ class ButtonSeries (ttk.Frame):
                 button.grid(row=i, column=0, pady=spacing, sticky=orientation)
 
 
+class ProgressBar (ttk.Frame):
+    """How far a job running in a `MatchWorker` has got, with a button to cancel it"""
+
+    def __init__(self, parent, on_cancel: Callable[[], None]):
+        super().__init__(parent)
+        self.label = ttk.Label(self, text="")
+        self.bar = ttk.Progressbar(self, length=200, maximum=PROGRESS_RANGE)
+        self.cancel_button = ttk.Button(self, text="Cancel", command=on_cancel, state="disabled")
+
+        self.label.grid(row=0, column=0, padx=5, sticky="w")
+        self.bar.grid(row=0, column=1, padx=5, sticky="ew")
+        self.cancel_button.grid(row=0, column=2, padx=5, sticky="e")
+
+    def start(self, label: str):
+        self.label.config(text=label)
+        self.bar.config(value=0)
+        self.cancel_button.config(state="normal")
+
+    def update_progress(self, fraction: float):
+        self.bar.config(value=fraction * PROGRESS_RANGE)
+
+    def finish(self, label: str = ""):
+        self.label.config(text=label)
+        self.bar.config(value=0)
+        self.cancel_button.config(state="disabled")
+
+
 class FileViewer (ttk.Frame):
     def __init__(self, parent, controller, width, height, default_label,
                  loaded_label=None, editable=True, on_file_loaing=None):
@@ -96,11 +152,20 @@ class IndexPage (ttk.Frame):
             ("Preview Changes...", self.confirm_changes)
         ]
         self.buttons = ButtonSeries(self, controller, buttons)
+        self.worker = MatchWorker(CallQueue(self).post)
+        self.progress = ProgressBar(self, self.cancel_job)
+        self.document.file_viewer.tag_config("slot", background="green", foreground="black")
 
         self.input_template.grid(column=0, row=0, padx=10, pady=10, sticky="ns")
         self.output_template.grid(column=0, row=1, padx=10, pady=10, sticky="sn")
         self.document.grid(column=1, row=0, rowspan=2, padx=10, pady=10, sticky="n")
-        self.buttons.grid(row=2, column=0, columnspan=2, sticky="e", padx=10, pady=10)
+        self.progress.grid(row=2, column=0, sticky="w", padx=10, pady=10)
+        self.buttons.grid(row=2, column=1, sticky="e", padx=10, pady=10)
+
+    def templates(self, conserve_whitespace: bool) -> Templates:
+        return (self.input_template.file_viewer.get("1.0", tk.END),
+                self.output_template.file_viewer.get("1.0", tk.END),
+                conserve_whitespace)
 
     def confirm_changes(self):
         if self.document.fcontent is None or self.document.fcontent == "" \
@@ -108,35 +173,57 @@ class IndexPage (ttk.Frame):
                 or self.output_template.fcontent is None or self.output_template.fcontent == "":
             return
 
-        ConfirmChangesDialog(self, self.controller, self.input_template.fname, self.output_template.fname,
+        # The dialog takes over the worker
+        if self.worker.running:
+            self.cancel_job()
+        ConfirmChangesDialog(self, self.controller, self.templates(False), self.worker,
                              self.document.fname, self.document.fcontent)
 
     def highlight_matches(self):
-        reify = TemplateProcessor(self.input_template.file_viewer.get("1.0", tk.END),
-                                  self.output_template.file_viewer.get("1.0", tk.END),
-                                  True)
+        document = self.document.file_viewer.get("1.0", "end-1c")
+        self.progress.start("Checking...")
+        self.worker.submit("find", self.templates(True), document,
+                           lambda spans: self.show_matches(MatchSet(document, *spans)),
+                           self.progress.update_progress, self.show_error)
 
-        matches = reify.find(self.document.fname)
+    def show_matches(self, matches: MatchSet):
+        viewer = self.document.file_viewer
+        viewer.tag_remove("slot", "1.0", tk.END)
+        slots = zip(matches.starts[:, 1:].ravel().tolist(), matches.ends[:, 1:].ravel().tolist())
+        for start, end in slots:
+            if start != -1:
+                viewer.tag_add("slot", f"1.0 + {start} chars", f"1.0 + {end} chars")
+        self.progress.finish(f"{len(matches)} matches" + span_note(matches.document))
+
+    def show_error(self, message: str):
+        self.progress.finish(message)
+
+    def cancel_job(self):
+        self.worker.cancel()
+        self.progress.finish("Cancelled")
 
 
 class ConfirmChangesDialog (tk.Toplevel):
-    def __init__(self, parent, controller, input_template, output_template, file, orig_contents):
+    def __init__(self, parent, controller, templates: Templates, worker: MatchWorker, file, orig_contents):
         super().__init__()
         self.wm_title("Confirm Replacements")
+        self.templates = templates
+        self.worker = worker
+        self.file = file
+        self.orig_contents = orig_contents
         self.orig_label = ttk.Label(self, text="Original")
         self.new_label = ttk.Label(self, text="After Changes")
         self.orig_document = ScrolledText(self, width=60, height=30)
         self.new_document = ScrolledText(self, width=60, height=30)
-        self.reify = TemplateProcessor(input_template, output_template, False)
         button_data = [
-            ("Cancel", self.destroy),
-            ("Confirm", lambda: self.reify.find_and_replace(file, True)),
+            ("Cancel", self.cancel),
+            ("Confirm", self.confirm),
             ("Save As...", self.save_changes_as)
         ]
         self.buttons = ButtonSeries(self, controller, button_data)
+        self.progress = ProgressBar(self, self.cancel_job)
 
         self.orig_document.insert(tk.END, orig_contents)
-        self.new_document.insert(tk.END, self.reify.find_and_replace(file, False))
 
         self.orig_document.config(state="disabled")
 
@@ -144,8 +231,35 @@ class ConfirmChangesDialog (tk.Toplevel):
         self.orig_document.grid(row=1, column=0, padx=10, sticky="nse")
         self.new_label.grid(row=0, column=1, padx=10, sticky="nw")
         self.new_document.grid(row=1, column=1, padx=10, sticky="nsw")
+        self.progress.grid(row=2, column=0, padx=10, pady=10, sticky="sw")
         self.buttons.grid(row=2, column=1, padx=10, pady=10, sticky="se")
 
+        self.run("subs", "Substituting...", self.show_changes)
+
+    def run(self, task: str, label: str, on_done: Callable, args: tuple = ()):
+        self.progress.start(label)
+        self.worker.submit(task, self.templates, self.orig_contents, on_done, self.progress.update_progress,
+                           self.progress.finish, args)
+
+    def show_changes(self, result: Tuple[str, int]):
+        text, count = result
+        self.new_document.delete("1.0", tk.END)
+        self.new_document.insert(tk.END, text)
+        self.progress.finish(f"{count} replacements" + span_note(self.orig_contents))
+
+    def confirm(self):
+        self.run("replace", "Replacing...",
+                 lambda count: self.progress.finish(f"Replaced {count} occurrences" + span_note(self.orig_contents)),
+                 (self.file,))
+
+    def cancel_job(self):
+        self.worker.cancel()
+        self.progress.finish("Cancelled")
+
+    def cancel(self):
+        self.worker.cancel()
+        self.destroy()
+
     def save_changes_as(self):
         filename = fdialog.asksaveasfilename()
         if filename:
@@ -0,0 +1,189 @@
+from bisect import bisect_left, bisect_right
+from typing import *
+from typing import Match
+
+from .stream import StreamMatch, DEFAULT_MAX_SPAN
+
+# Replacements are only expanded once they're asked for
+_PENDING = object()
+
+
+class Edit(NamedTuple):
+    """Text between `start` and `end` in the old document replaced with `text`"""
+    start: int
+    end: int
+    text: str
+
+
+def diff_edit(old: str, new: str) -> Optional[Edit]:
+    """The smallest single edit that turns `old` into `new`, or None if they are the same"""
+    if old == new:
+        return None
+
+    limit = min(len(old), len(new))
+    prefix = _common_length(old, new, limit)
+    # The common suffix can't overlap the common prefix in either text
+    suffix = _common_length(old[::-1], new[::-1], limit - prefix)
+    return Edit(prefix, len(old) - suffix, new[prefix:len(new) - suffix])
+
+
+def _common_length(a: str, b: str, limit: int, block: int = 1 << 14) -> int:
+    # Compare whole blocks at a time, which is done in C, then find the difference in the first
+    # block that differs by bisecting it
+    low = 0
+    while low + block <= limit and a[low:low + block] == b[low:low + block]:
+        low += block
+
+    high = min(low + block, limit)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[low:mid] == b[low:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class IncrementalMatcher:
+    """Keeps the matches of a template in a document, and the substituted document, up to date as
+    the document is edited, without matching the whole document again.
+
+    After an edit, matches starting more than `max_span` characters before it are kept, since
+    finding them didn't involve any of the edited text. Matching resumes after the last of them,
+    and stops as soon as it gets past the edit to a point where the old scan found nothing either:
+    a match past the edit only reads text that hasn't changed, so from there on the old matches
+    are still right and are only moved along by the change in length. Like with
+    `find --max-span`, no match may need to look further ahead than `max_span` characters.
+    """
+
+    def __init__(self, processor, text: str, max_span: int = DEFAULT_MAX_SPAN,
+                 matches: Optional[Iterable[Match]] = None):
+        self.processor = processor
+        self.max_span = max_span
+        self.text = text
+        self.matches: List[StreamMatch] = []
+        self._replacements: List[str] = []
+        self._substituted: Optional[str] = None
+        self.rematch(matches)
+
+    def rematch(self, matches: Optional[Iterable[Match]] = None):
+        """Match the whole document again, or take its matches from `matches` if they've been
+        found already"""
+        if matches is None:
+            matches = self.processor.matcher().finditer(self.text)
+        self.matches = [StreamMatch(m, 0) for m in matches]
+        self._replacements = [_PENDING] * len(self.matches)
+        self._substituted = None
+
+    def set_processor(self, processor):
+        """Switch to another template. If only the output template changed, the matches are kept
+        and just expanded again."""
+        old, self.processor = self.processor, processor
+        if processor.pattern == old.pattern:
+            self._replacements = [_PENDING] * len(self.matches)
+            self._substituted = None
+        else:
+            self.rematch()
+
+    def replacement(self, index: int) -> Optional[str]:
+        """What one of `matches` is replaced with, or None if there is no output template"""
+        replacement = self._replacements[index]
+        if replacement is _PENDING:
+            replacement = self._replacements[index] = self._expand(self.matches[index])
+        return replacement
+
+    @property
+    def replacements(self) -> List[Optional[str]]:
+        return [self.replacement(i) for i in range(len(self.matches))]
+
+    def _expand(self, m: StreamMatch) -> Optional[str]:
+        target = self.processor.target
+        if target is None:
+            return None
+        return target(m) if callable(target) else m.expand(target)
+
+    def update(self, text: str) -> List[StreamMatch]:
+        """Bring the matches up to date with a new version of the whole document, rescanning only
+        around the part of it that differs from the old one"""
+        edit = diff_edit(self.text, text)
+        if edit is None:
+            return self.matches
+        return self.edit(*edit)
+
+    def edit(self, start: int, end: int, text: str) -> List[StreamMatch]:
+        """Replace the text between `start` and `end` with `text` and return the updated matches"""
+        if not 0 <= start <= end <= len(self.text):
+            raise ValueError(f"Edit {start}:{end} is outside of the document")
+
+        delta = len(text) - (end - start)
+        document = self.text[:start] + text + self.text[end:]
+        edited_end = start + len(text)
+
+        # Matches that start far enough before the edit, and end before it, stay as they are
+        starts = [m.start() for m in self.matches]
+        kept = min(bisect_left(starts, start - self.max_span),
+                   bisect_right([m.end() for m in self.matches], start))
+        # Searching again from the end of an empty match would find it again
+        while kept and self.matches[kept - 1].start() == self.matches[kept - 1].end():
+            kept -= 1
+        pos = self.matches[kept - 1].end() if kept else 0
+
+        # The first of the old matches that start after the edit. Before each of them (in new
+        # offsets) is a stretch where the old scan looked and found nothing.
+        after = bisect_left(starts, end)
+
+        def resync(p: int) -> Tuple[Optional[int], int]:
+            # The first point at or after `p` and the edit from which the old scan found the same
+            # matches the new one would, and the index of the old match it finds next. Scans after
+            # empty matches are left out, since they also depend on the match having been empty.
+            lowest = max(p, edited_end, 1)
+            k = bisect_left(starts, lowest - delta, after)
+            while k <= len(self.matches):
+                previous = self.matches[k - 1] if k > 0 else None
+                if previous is None or previous.end() > previous.start():
+                    low = max(previous.end() if previous is not None else 0, end) + delta
+                    high = starts[k] + delta if k < len(self.matches) else len(document)
+                    if max(low, lowest) <= high:
+                        return max(low, lowest), k
+                k += 1
+            return None, len(self.matches)
+
+        found = []
+        rest = None
+        regex = self.processor.matcher()
+        while rest is None:
+            point, rest = resync(pos)
+            endpos = len(document) if point is None else min(point + self.max_span, len(document))
+            for m in regex.finditer(document, pos, endpos):
+                if point is not None and m.start() >= point:
+                    break
+                found.append(StreamMatch(m, 0))
+                if m.end() > m.start():
+                    pos = m.end()
+                    if point is not None and pos > point:
+                        # Gone past where it could have stopped, so look for the next such point
+                        rest = None
+                        break
+
+        shifted = [m if delta == 0 else StreamMatch(m.match, m.offset + delta) for m in self.matches[rest:]]
+        self.matches = self.matches[:kept] + found + shifted
+        self._replacements = self._replacements[:kept] + [_PENDING] * len(found) + self._replacements[rest:]
+        self.text = document
+        self._substituted = None
+        return self.matches
+
+    @property
+    def substituted(self) -> str:
+        """The document with every match replaced by the output template"""
+        if self.processor.target is None:
+            raise ValueError("The template has no output template to substitute with")
+        if self._substituted is None:
+            pieces = []
+            pos = 0
+            for i, m in enumerate(self.matches):
+                pieces.append(self.text[pos:m.start()])
+                pieces.append(self.replacement(i))
+                pos = m.end()
+            pieces.append(self.text[pos:])
+            self._substituted = "".join(pieces)
+        return self._substituted
@@ -0,0 +1,191 @@
+import itertools
+from array import array
+from typing import *
+from typing import Match
+
+import numpy as np
+
+from .compiler import slot_label
+
+
+class IndexedMatch:
+    """One match of a `MatchSet`, read from its arrays. Supports the read-only part of the
+    interface of `re.Match`."""
+    __slots__ = ("matches", "index")
+
+    def __init__(self, matches: "MatchSet", index: int):
+        self.matches = matches
+        self.index = index
+
+    def _group(self, group: Union[int, str]) -> int:
+        return group if isinstance(group, int) else self.matches.groupindex[group]
+
+    def start(self, group: Union[int, str] = 0) -> int:
+        return int(self.matches.starts[self.index, self._group(group)])
+
+    def end(self, group: Union[int, str] = 0) -> int:
+        return int(self.matches.ends[self.index, self._group(group)])
+
+    def span(self, group: Union[int, str] = 0) -> Tuple[int, int]:
+        return self.start(group), self.end(group)
+
+    def group(self, *groups: Union[int, str]) -> Union[str, Tuple[str, ...]]:
+        if len(groups) > 1:
+            return tuple(self.group(g) for g in groups)
+        return self.matches.value(self.index, self._group(groups[0] if groups else 0))
+
+    def groups(self, default=None) -> Tuple[str, ...]:
+        values = (self.matches.value(self.index, g) for g in range(1, self.matches.groups + 1))
+        return tuple(default if v is None else v for v in values)
+
+    def groupdict(self, default=None) -> Dict[str, str]:
+        return {name: self.group(name) if self.start(name) != -1 else default
+                for name in self.matches.groupindex}
+
+    def __getitem__(self, group: Union[int, str]) -> str:
+        return self.group(group)
+
+    def __repr__(self):
+        return f"<IndexedMatch object; span={self.span()!r}, match={self.group(0)!r}>"
+
+
+class MatchSet:
+    """The matches of a template in a document, kept as two arrays of offsets instead of as match
+    objects. `starts[i, g]` and `ends[i, g]` are where group `g` of match `i` starts and ends
+    (group 0 being the whole match, and -1 for slots that didn't take part in it), so millions
+    of matches only take a few integers each. Slot values are only cut out of the document when
+    they are asked for.
+
+    Indexing with an integer gives an `IndexedMatch`. Indexing with a slice, an array of indices
+    or a boolean mask gives another `MatchSet` sharing the document, which is how matches are
+    filtered and sorted without a Python loop:
+
+        long = matches[matches.lengths("title") > 80]
+        by_length = matches.sorted("title", by="length")
+    """
+
+    def __init__(self, document: Union[str, bytes], starts: np.ndarray, ends: np.ndarray,
+                 groupindex: Mapping[str, int], encoding: Optional[str] = None):
+        self.document = document
+        self.starts = starts
+        self.ends = ends
+        self.groupindex = dict(groupindex)
+        # Set if the document is bytes, to decode slot values with
+        self.encoding = encoding
+
+    @classmethod
+    def from_matches(cls, matches: Iterable[Match], document: Union[str, bytes], groups: int,
+                     groupindex: Mapping[str, int], encoding: Optional[str] = None) -> "MatchSet":
+        """Collect the offsets of matches as they are found, without keeping the match objects"""
+        offsets = array("q")
+        for m in matches:
+            regs = getattr(m, "regs", None)
+            if regs is None:
+                regs = [m.span(g) for g in range(groups + 1)]
+            offsets.extend(itertools.chain.from_iterable(regs))
+
+        spans = np.frombuffer(offsets, dtype=np.int64).reshape(-1, groups + 1, 2)
+        return cls(document, np.ascontiguousarray(spans[:, :, 0]), np.ascontiguousarray(spans[:, :, 1]),
+                   groupindex, encoding)
+
+    @property
+    def groups(self) -> int:
+        return self.starts.shape[1] - 1
+
+    @property
+    def labels(self) -> Dict[str, int]:
+        """The group of every labelled slot, by the label it was written with"""
+        return {slot_label(name): g for name, g in self.groupindex.items()}
+
+    def column(self, group: Union[int, str]) -> int:
+        if isinstance(group, int):
+            return group
+        if group in self.groupindex:
+            return self.groupindex[group]
+        return self.labels[group]
+
+    def __len__(self) -> int:
+        return self.starts.shape[0]
+
+    def __iter__(self) -> Iterator[IndexedMatch]:
+        return (IndexedMatch(self, i) for i in range(len(self)))
+
+    def __getitem__(self, index) -> Union[IndexedMatch, "MatchSet"]:
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("match index out of range")
+            return IndexedMatch(self, int(index))
+        return MatchSet(self.document, self.starts[index], self.ends[index], self.groupindex, self.encoding)
+
+    def __repr__(self):
+        return f"<MatchSet of {len(self)} matches with {self.groups} groups>"
+
+    def lengths(self, group: Union[int, str] = 0) -> np.ndarray:
+        """The length of a group in every match, 0 where it didn't take part"""
+        g = self.column(group)
+        return self.ends[:, g] - self.starts[:, g]
+
+    def matched(self, group: Union[int, str]) -> np.ndarray:
+        """A mask of the matches a group took part in"""
+        return self.starts[:, self.column(group)] != -1
+
+    def within(self, start: int, end: int, group: Union[int, str] = 0) -> "MatchSet":
+        """The matches where a group overlaps the range from `start` to `end`. Matches are found
+        by bisecting, so they have to be in document order, as they are when first found."""
+        g = self.column(group)
+        # A slot can only overlap the range if its match does
+        first = np.searchsorted(self.ends[:, 0], start, side="right")
+        last = np.searchsorted(self.starts[:, 0], end, side="left")
+        subset = self[first:last]
+        if g != 0:
+            subset = subset[(subset.starts[:, g] < end) & (subset.ends[:, g] > start)]
+        return subset
+
+    def sorted(self, group: Union[int, str] = 0, by: str = "start", reverse: bool = False) -> "MatchSet":
+        """The matches ordered by where a group starts or ends, or by its length"""
+        g = self.column(group)
+        if by == "start":
+            keys = self.starts[:, g]
+        elif by == "end":
+            keys = self.ends[:, g]
+        elif by == "length":
+            keys = self.lengths(g)
+        else:
+            raise ValueError(f"Unknown sort key {by!r}, expected start, end or length")
+
+        order = np.argsort(-keys if reverse else keys, kind="stable")
+        return self[order]
+
+    def value(self, index: int, group: Union[int, str] = 0) -> Optional[str]:
+        """The text of a group of one match"""
+        g = self.column(group)
+        start = int(self.starts[index, g])
+        if start == -1:
+            return None
+        value = self.document[start:int(self.ends[index, g])]
+        return value if self.encoding is None else value.decode(self.encoding, "replace")
+
+    def values(self, group: Union[int, str] = 0) -> Iterator[Optional[str]]:
+        """The text of a group in every match, cut out of the document one at a time"""
+        g = self.column(group)
+        for i in range(len(self)):
+            yield self.value(i, g)
+
+
+def coalesce(starts: np.ndarray, ends: np.ndarray) -> List[Tuple[int, int]]:
+    """Merge ranges that overlap or touch, so that they can be styled with as few calls as possible.
+    Empty ranges are left out."""
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return []
+
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    # How far the ranges up to each one reach. A new range begins wherever one starts past that.
+    reach = np.maximum.accumulate(ends)
+    first = np.concatenate(([0], np.nonzero(starts[1:] > reach[:-1])[0] + 1))
+    last = np.concatenate((first[1:] - 1, [len(starts) - 1]))
+    return list(zip(starts[first].tolist(), reach[last].tolist()))
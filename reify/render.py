@@ -0,0 +1,66 @@
+from typing import *
+
+import click
+
+
+# Styles are applied by plain string concatenation instead of a click.style call per slot
+MATCH_HEADER = click.style("Match %d", fg="red")
+SLOT_START, SLOT_END = click.style("\0", bold=True, bg="green").split("\0")
+
+# How much rendered text is collected before it's written out in one go
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+
+def shorten(value: str, width: Optional[int]) -> str:
+    if width is None or len(value) <= width:
+        return value
+    return f"{value[:max(width - 1, 0)]}…"
+
+
+def render_match(i: int, m, width: Optional[int] = None) -> str:
+    """The text of a match with the data from its slots highlighted, under a "Match i + 1" heading.
+    Slot values longer than `width` characters are cut short.
+
+    Works on re matches and on matches found in windows or in raw bytes, which are sliced through
+    their underlying match so offsets stay consistent."""
+    raw = getattr(m, "match", m)
+    decode = getattr(m, "decode", None)
+    whole = raw.group(0)
+    base = raw.start()
+
+    parts = ["\n", MATCH_HEADER % (i + 1), "\n"]
+    pos = 0
+    for j in range(1, len(raw.groups()) + 1):
+        start, end = raw.span(j)
+        # Skip slots that didn't take part in the match or lie within the previous one
+        if start < 0 or start - base < pos:
+            continue
+
+        start -= base
+        end -= base
+        before, value = whole[pos:start], whole[start:end]
+        if decode is not None:
+            before, value = decode(before), decode(value)
+        parts.extend((before, SLOT_START, shorten(value, width), SLOT_END))
+        pos = end
+
+    rest = whole[pos:]
+    parts.append(rest if decode is None else decode(rest))
+    parts.append("\n")
+    return "".join(parts)
+
+
+def chunked(pieces: Iterable[str], size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """Join small pieces of text into chunks of at least `size` characters"""
+    buffer = []
+    length = 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+
+    if buffer:
+        yield "".join(buffer)
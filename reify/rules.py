@@ -0,0 +1,122 @@
+import os
+import re
+import shlex
+from typing import *
+from typing import Match
+
+from .TemplateProcessor import TemplateProcessor
+from .compiler import Slot, tokenize, compile_input, compile_output, required_literals, leading_literal, slot_label
+from .engine import Engine, get_engine
+from .stats import Stats, record
+
+
+class RuleSet(TemplateProcessor):
+    """Several input/output template pairs applied in a single pass over a document.
+
+    The input templates are combined into one alternation, with each rule's labels prefixed so they
+    don't clash, and every match is expanded with the output template of the rule that produced it.
+    Matches are found left to right like with a single template. When several rules could match at
+    the same position, the rule listed first wins, and text consumed by a match is not searched
+    again by any rule.
+    """
+
+    def __init__(self, rules: Sequence[Tuple[str, str]], conserve_whitespace: bool, slot_mode: str = "greedy",
+                 engine: Union[str, Engine] = "re", timeout: Optional[float] = None, stats: Optional[Stats] = None):
+        if not rules:
+            raise ValueError("A rule set needs at least one rule")
+
+        self.engine = get_engine(engine)
+        self.timeout = timeout
+        self.stats = stats
+
+        self.input_tokens = []
+        self.output_tokens = []
+        self.targets: List[str] = []
+        self.rule_literals: List[List[str]] = []
+        rule_prefixes = []
+        self._rule_groups: Dict[int, int] = dict()
+
+        with record(stats, "slot parsing"):
+            patterns = []
+            group = 0
+            for i, (input_template, output_template) in enumerate(rules):
+                prefix = f"_r{i}_"
+                input_nodes = list(tokenize(input_template))
+                output_nodes = list(tokenize(output_template))
+                pattern = compile_input(input_nodes, conserve_whitespace, prefix, slot_mode)
+                self.rule_literals.append(required_literals(input_nodes, conserve_whitespace))
+                rule_prefixes.append(leading_literal(input_nodes, conserve_whitespace))
+
+                # Each rule is wrapped in a group of its own, followed by the groups of its template
+                group += 1
+                self._rule_groups[group] = i
+                self.targets.append(compile_output(output_nodes, group, prefix))
+                patterns.append(f"(?P<_r{i}>{pattern})")
+                group += re.compile(pattern).groups
+
+                self.input_tokens.extend(n.token for n in input_nodes if isinstance(n, Slot))
+                self.output_tokens.extend(n.token for n in output_nodes if isinstance(n, Slot))
+
+            self.pattern = "|".join(patterns)
+            self.literals = []
+            # Every match starts with whatever literal text all the rules start with
+            self.prefix = os.path.commonprefix(rule_prefixes)
+        self._prepare()
+
+    @classmethod
+    def from_file(cls, rules_file: str, conserve_whitespace: bool, slot_mode: str = "greedy",
+                  engine: Union[str, Engine] = "re", stats: Optional[Stats] = None) -> "RuleSet":
+        """Load a rule set from a file listing one input and output template path per line.
+        Paths are relative to the rules file. Blank lines and lines starting with # are ignored."""
+        rules = []
+        with record(stats, "template read"):
+            for paths in rule_paths(rules_file):
+                templates = []
+                for path in paths:
+                    with open(path, "r") as th:
+                        templates.append(th.read())
+                rules.append(tuple(templates))
+
+        return cls(rules, conserve_whitespace, slot_mode, engine, stats=stats)
+
+    def _literal_sets(self) -> List[List[str]]:
+        return self.rule_literals
+
+    @property
+    def target(self) -> Callable[[Match], str]:
+        return self.expand
+
+    def rule_index(self, m: Match) -> int:
+        """The index of the rule that produced a match"""
+        return self._rule_groups[m.lastindex]
+
+    def expand(self, m: Match) -> str:
+        return m.expand(self.targets[self.rule_index(m)])
+
+    def slots(self, m: Match) -> Dict[str, Optional[str]]:
+        """The values of the labelled slots of the rule that produced a match, by the labels they
+        were written with"""
+        prefix = f"_r{self.rule_index(m)}_"
+        return {slot_label(name, prefix): value for name, value in m.groupdict().items() if name.startswith(prefix)}
+
+    def bytes_expander(self, encoding: str = "utf-8") -> Callable[[Match], bytes]:
+        targets = [t.encode(encoding) for t in self.targets]
+        return lambda m: m.expand(targets[self.rule_index(m)])
+
+
+def rule_paths(rules_file: str) -> List[Tuple[str, str]]:
+    """The paths of the input and output template of every rule in a rules file"""
+    base = os.path.dirname(rules_file)
+    rules = []
+    with open(rules_file, "r") as h:
+        for n, line in enumerate(h, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            paths = shlex.split(line)
+            if len(paths) != 2:
+                raise ValueError(f"{rules_file}:{n}: expected an input and an output template path")
+            rules.append((os.path.join(base, paths[0]), os.path.join(base, paths[1])))
+
+    return rules
@@ -0,0 +1,256 @@
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import *
+from urllib.parse import urlsplit, parse_qs
+
+from .TemplateProcessor import TemplateProcessor
+from .engine import PathologicalTemplateError
+
+
+class Counters:
+    """Request counts, throughput and the latency of recent requests, shared by the threads of a server"""
+
+    def __init__(self, window: int = 4096):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.matches = 0
+        self.in_flight = 0
+        self._latencies: Deque[float] = deque(maxlen=window)
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, seconds: float, bytes_in: int, bytes_out: int, matches: int, error: bool = False):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.errors += error
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.matches += matches
+            self._latencies.append(seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            uptime = time.monotonic() - self.started
+            latencies = sorted(self._latencies)
+            counters = {
+                "uptime": uptime,
+                "requests": self.requests,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "matches": self.matches,
+                "requests_per_second": self.requests / uptime if uptime else 0.0,
+                "bytes_per_second": self.bytes_in / uptime if uptime else 0.0,
+            }
+
+        # Over the most recent requests only, in seconds
+        counters["latency"] = {
+            "count": len(latencies),
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95),
+            "p99": _percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+        }
+        return counters
+
+
+def _percentile(values: Sequence[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+_processors: Dict[str, TemplateProcessor] = dict()
+
+
+def _init_worker(processors: Dict[str, TemplateProcessor]):
+    global _processors
+    _processors = processors
+
+
+def _run(task: Tuple[str, str, bytes, str]) -> Tuple[bytes, int]:
+    """Find (as JSON Lines) or substitute in one document with a preloaded template. Returns the
+    response body and the number of matches."""
+    mode, name, document, encoding = task
+    p = _processors[name]
+    text = document.decode(encoding)
+    if mode == "subs":
+        text, count = p.subn(text)
+        return text.encode(encoding), count
+
+    lines = []
+    for m in p.finditer(text):
+        lines.append(json.dumps({
+            "start": m.start(),
+            "end": m.end(),
+            "slots": p.slots(m),
+            "groups": list(m.groups()),
+        }))
+    return "".join(line + "\n" for line in lines).encode("utf-8"), len(lines)
+
+
+class ReifyServer:
+    """Finds and substitutes in documents sent over HTTP, with templates compiled once up front.
+
+        POST /subs/NAME    the body is a document, the response is the document substituted
+                           with the template NAME, and the X-Reify-Matches header the number of
+                           replacements
+        POST /find/NAME    the response is a JSON object per match, one per line
+        GET /templates     the names of the templates, as JSON
+        GET /stats         the `Counters` of the server, as JSON
+
+    Documents are UTF-8 unless a `charset` is given in the Content-Type header or as an
+    `encoding` query parameter. Every connection is handled in a thread of its own. With more than
+    one job, matching is done by that many worker processes, so that requests are matched in
+    parallel too. Templates with a timeout that only SIGALRM can enforce (those of the stdlib
+    engine) are always matched in worker processes, since the alarm can't interrupt a thread."""
+
+    def __init__(self, processors: Dict[str, TemplateProcessor], jobs: int = 1):
+        self.processors = processors
+        self.jobs = jobs
+        self.counters = Counters()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        if jobs > 1 or any(getattr(p.matcher(), "interruptible", False) for p in processors.values()):
+            self._pool = self._start_pool()
+        else:
+            _init_worker(processors)
+        self._server = None
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker, initargs=(self.processors,))
+
+    def handle(self, mode: str, name: str, document: bytes, encoding: str) -> Tuple[bytes, int]:
+        if name not in self.processors:
+            raise KeyError(name)
+        if mode == "subs" and self.processors[name].target is None:
+            raise ValueError(f"Template {name} has no output template to substitute with")
+
+        task = (mode, name, document, encoding)
+        pool = self._pool
+        if pool is None:
+            return _run(task)
+        try:
+            return pool.submit(_run, task).result()
+        except BrokenProcessPool:
+            # A worker died, which leaves the whole pool unusable, so the next request gets a new one
+            with self._pool_lock:
+                if self._pool is pool:
+                    pool.shutdown(wait=False)
+                    self._pool = self._start_pool()
+            raise
+
+    def serve(self, address: Union[str, Tuple[str, int]]):
+        """Serve forever on a Unix socket at a path, or on a (host, port) address"""
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self._server = _UnixHTTPServer(address, _Handler)
+        else:
+            self._server = ThreadingHTTPServer(address, _Handler)
+        self._server.daemon_threads = True
+        self._server.reify = self
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
+            if isinstance(address, str) and os.path.exists(address):
+                os.remove(address)
+
+    @property
+    def address(self):
+        return None if self._server is None else self._server.server_address
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def close(self):
+        if self._server is not None:
+            self._server.server_close()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/stats":
+            self._reply(200, json.dumps(self.server.reify.counters.as_dict()).encode("utf-8"), "application/json")
+        elif path == "/templates":
+            self._reply(200, json.dumps(sorted(self.server.reify.processors)).encode("utf-8"), "application/json")
+        else:
+            self._reply(404, b"Not found\n")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        document = self.rfile.read(length)
+        if len(parts) != 2 or parts[0] not in ("find", "subs"):
+            self._reply(404, b"Not found\n")
+            return
+
+        mode, name = parts
+        encoding = (parse_qs(url.query).get("encoding") or [self.headers.get_content_charset("utf-8")])[0]
+        counters = self.server.reify.counters
+        counters.begin()
+        started = time.perf_counter()
+        body, count, error = b"", 0, True
+        try:
+            body, count = self.server.reify.handle(mode, name, document, encoding)
+            error = False
+        except KeyError:
+            self._reply(404, f"No template named {name}\n".encode("utf-8"))
+        except PathologicalTemplateError as e:
+            self._reply(422, f"{e}\n".encode("utf-8"))
+        except (ValueError, LookupError) as e:
+            # Documents that aren't in the encoding, unknown encodings and templates without an output
+            self._reply(400, f"{type(e).__name__}: {e}\n".encode("utf-8"))
+        except BrokenProcessPool:
+            self._reply(500, b"A worker process stopped unexpectedly\n")
+        else:
+            content_type = "application/jsonl" if mode == "find" else f"text/plain; charset={encoding}"
+            self._reply(200, body, content_type, {"X-Reify-Matches": str(count)})
+        finally:
+            counters.end(time.perf_counter() - started, len(document), len(body), count, error)
+
+    def _reply(self, status: int, body: bytes, content_type: str = "text/plain; charset=utf-8",
+               headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix socket clients don't have an address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        # Requests are counted instead of logged, so a busy server doesn't spend its time writing logs
+        pass
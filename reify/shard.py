@@ -0,0 +1,198 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+from typing import Match, Pattern
+
+from .bytes_engine import BytesMatch, SpanMatch, map_file, _slices
+from .stats import Stats
+
+
+class Shard(NamedTuple):
+    file: str
+    start: int
+    end: int
+    # Set if matches never cross the boundaries of the shards, so that no shard needs to look past its end
+    bounded: bool
+
+
+def split(document: bytes, shards: int, boundary: bytes) -> List[Tuple[int, int]]:
+    """Cut a document into about `shards` ranges of roughly the same size, each of which starts at
+    an occurrence of `boundary` (apart from the first)"""
+    size = len(document)
+    starts = [0]
+    for i in range(1, shards):
+        start = document.find(boundary, max(size * i // shards, starts[-1] + 1))
+        if start == -1:
+            break
+        if start > starts[-1]:
+            starts.append(start)
+
+    return list(zip(starts, starts[1:] + [size]))
+
+
+# A worker's match: where it started searching, the offsets of the match and its groups, its last
+# group and its replacement when substituting
+Found = Tuple[int, Tuple[Tuple[int, int], ...], Optional[int], Optional[bytes]]
+
+_processor = None
+_encoding = "utf-8"
+
+
+def _init_worker(processor, encoding: str):
+    global _processor, _encoding
+    _processor = processor
+    _encoding = encoding
+
+
+def _scan(regex, document: bytes, prefix: bytes, pos: int, end: int,
+          bounded: bool) -> Iterator[Tuple[int, Match]]:
+    """Find the matches starting between `pos` and `end` exactly as a search of the whole document
+    would, yielding each match along with the position it was searched for from.
+
+    When the shard is bounded the search simply stops at its end. Otherwise every match starts
+    with `prefix`, so instead of searching (which would carry on past `end` until it found
+    something), the pattern is only tried at occurrences of the prefix."""
+    while pos < end:
+        if bounded:
+            m = regex.search(document, pos, end)
+        else:
+            m = None
+            # Matches have to start before `end`, but may run past it
+            limit = end + len(prefix) - 1
+            candidate = document.find(prefix, pos, limit)
+            while candidate != -1 and m is None:
+                m = regex.match(document, candidate)
+                if m is None:
+                    candidate = document.find(prefix, candidate + 1, limit)
+
+        if m is None:
+            return
+        yield pos, m
+        pos = m.end()
+
+
+def _match_shard(task: Tuple[Shard, bool]) -> Tuple[List[Found], int]:
+    shard, replace = task
+    document = map_file(shard.file)
+    regex = _processor.matcher(_processor.bytes_regex(_encoding))
+    expand = _processor.bytes_expander(_encoding) if replace else None
+    prefix = _processor.prefix.encode(_encoding)
+
+    found = []
+    tail = shard.start
+    for pos, m in _scan(regex, document, prefix, shard.start, shard.end, shard.bounded):
+        spans = tuple(m.span(i) for i in range(regex.groups + 1))
+        found.append((pos, spans, m.lastindex, expand(m) if replace else None))
+        tail = m.end()
+
+    return found, tail
+
+
+def iter_shards(processor, file: str, jobs: Optional[int] = None, encoding: str = "utf-8",
+                split_on: Optional[str] = None, replace: bool = False,
+                wrap: bool = True) -> Iterator[Tuple[int, int, Any]]:
+    """Yield `(start, end, match)` for every match in a file in offset order, finding them in
+    shards of the file spread across `jobs` worker processes. With `replace`, the replacement
+    bytes are yielded instead of the match, and without `wrap`, None is (when only the offsets
+    are needed).
+
+    Without `split_on`, the file is split at occurrences of the literal text the template starts
+    with and the results are the same as matching the whole file in one go. Where a match runs
+    into the next shard, the main process searches the stretch of text the next worker skipped
+    while it was out of step. With `split_on`, the file is split at occurrences of that text
+    instead, and no match may contain it."""
+    if split_on is None and not processor.prefix:
+        raise ValueError("The template doesn't start with literal text to split the file at, "
+                         "so a delimiter that no match contains has to be given to split it at instead")
+
+    regex = processor.matcher(processor.bytes_regex(encoding))
+    if regex.match(b"") is not None:
+        raise ValueError("Templates that can match empty text can't be matched in parallel")
+    if not processor.matches_bytes_as_text(map_file(file)):
+        raise ValueError("The template has collapsed whitespace, typed slots or length bounds in it, which "
+                         "match raw bytes differently from text, and the file isn't plain ASCII, so it can't be "
+                         "matched in parallel. Match it without --parallel, which decodes it where needed")
+
+    return _merge(processor, regex, file, jobs or os.cpu_count() or 1, encoding, split_on, replace, wrap)
+
+
+def _merge(processor, regex, file: str, jobs: int, encoding: str, split_on: Optional[str],
+           replace: bool, wrap: bool = True) -> Iterator[Tuple[int, int, Any]]:
+    document = map_file(file)
+    if not processor.could_match_bytes(document, encoding):
+        return
+
+    prefix = processor.prefix.encode(encoding)
+    bounded = split_on is not None
+    expand = processor.bytes_expander(encoding) if replace else None
+    tasks = [(Shard(file, start, end, bounded), replace)
+             for start, end in split(document, jobs * 4, split_on.encode(encoding) if bounded else prefix)]
+
+    def catch_up(pos, end):
+        # Search the part of the document a worker skipped over while it was out of step
+        for _, m in _scan(regex, document, prefix, pos, end, bounded):
+            if replace:
+                yield m.start(), m.end(), expand(m)
+            else:
+                yield m.start(), m.end(), BytesMatch(m, encoding) if wrap else None
+
+    # Where the last match yielded ended, and how far the document has been searched: no match
+    # yielded yet starts before `searched`
+    pos = 0
+    searched = 0
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(processor, encoding)) as pool:
+        for (shard, _), (found, tail) in zip(tasks, pool.map(_match_shard, tasks)):
+            # The end of the shard stands in for one more match, so that whatever the worker
+            # skipped after its last match is caught up with too
+            found.append((tail, ((shard.end, shard.end),), None, None))
+            for searched_from, spans, lastindex, replacement in found:
+                start, end = spans[0]
+                if start < pos:
+                    continue
+                if searched_from > searched:
+                    for m in catch_up(searched, start):
+                        yield m
+                        pos = searched = m[1]
+                    if start < pos:
+                        continue
+                if start < shard.end:
+                    if not replace and wrap:
+                        replacement = BytesMatch(SpanMatch(document, spans, lastindex, regex), encoding)
+                    yield start, end, replacement
+                    pos = searched = end
+
+            # Either the worker searched the rest of its shard in step, or it was caught up with,
+            # so nothing more starts before the shard's end. Matches are found the same whichever
+            # position a search starts from, so the next shard is only caught up with from here.
+            searched = max(pos, shard.end)
+
+
+def find_parallel(processor, file: str, jobs: Optional[int] = None, encoding: str = "utf-8",
+                  split_on: Optional[str] = None) -> Iterator[BytesMatch]:
+    return (m for _, _, m in iter_shards(processor, file, jobs, encoding, split_on))
+
+
+def count_parallel(processor, file: str, jobs: Optional[int] = None, encoding: str = "utf-8",
+                   split_on: Optional[str] = None, limit: Optional[int] = None) -> int:
+    return sum(1 for _ in itertools.islice(iter_shards(processor, file, jobs, encoding, split_on, wrap=False), limit))
+
+
+def replace_parallel(processor, file: str, jobs: Optional[int] = None, encoding: str = "utf-8",
+                     split_on: Optional[str] = None, stats: Optional[Stats] = None) -> Iterator[bytes]:
+    """Yield the substituted document piece by piece, the same as `replace_mmap` would"""
+    return _replaced(map_file(file), iter_shards(processor, file, jobs, encoding, split_on, replace=True), stats)
+
+
+def _replaced(document: bytes, replacements: Iterator[Tuple[int, int, bytes]],
+              stats: Optional[Stats]) -> Iterator[bytes]:
+    pos = 0
+    for start, end, replacement in replacements:
+        yield from _slices(document, pos, start)
+        yield replacement
+        pos = end
+        if stats is not None:
+            stats.matches += 1
+
+    yield from _slices(document, pos, len(document))
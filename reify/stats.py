@@ -0,0 +1,145 @@
+import json
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import *
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+_END = object()
+
+PHASES = ("template read", "slot parsing", "regex compile", "document read", "matching", "output write")
+
+
+class Stats:
+    """Where the time of a run went. Set it as the `stats` of a `TemplateProcessor` (or pass it to the
+    constructor to include compiling the templates) and every operation adds to it."""
+
+    def __init__(self):
+        self.phases: "OrderedDict[str, float]" = OrderedDict((phase, 0.0) for phase in PHASES)
+        self.bytes_scanned = 0
+        self.matches = 0
+        self.files = 0
+        self.cached = False
+        self._started = time.perf_counter()
+        self._nested = 0.0
+
+    @contextmanager
+    def phase(self, name: str):
+        """Add the time spent in the block to a phase. Time spent in phases nested inside the block
+        only counts towards those."""
+        start = time.perf_counter()
+        outer = self._nested
+        self._nested = 0.0
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add_time(name, elapsed - self._nested)
+            self._nested = outer + elapsed
+
+    def add_time(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def timed(self, name: str, iterator: Iterable, count: bool = True) -> Iterator:
+        """Iterate, adding the time spent producing each item to a phase. With `count`, every item is
+        counted as a match."""
+        iterator = iter(iterator)
+        while True:
+            with self.phase(name):
+                item = next(iterator, _END)
+            if item is _END:
+                return
+            if count:
+                self.matches += 1
+            yield item
+
+    def counted(self, expand: Callable) -> Callable:
+        """Wrap a replacement function so every replacement is counted as a match"""
+        def wrapper(m):
+            self.matches += 1
+            return expand(m)
+
+        return wrapper
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self._started
+
+    @staticmethod
+    def peak_rss() -> Optional[int]:
+        """The most memory this process, or any worker process it waited for, had resident, in bytes"""
+        if resource is None:
+            return None
+        peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        # Linux reports kilobytes and macOS bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "phases": dict(self.phases),
+            "total": self.total,
+            "bytes_scanned": self.bytes_scanned,
+            "matches": self.matches,
+            "files": self.files,
+            "cached": self.cached,
+            "peak_rss": self.peak_rss(),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict())
+
+    def summary(self) -> str:
+        total = self.total
+        lines = []
+        for name, seconds in self.phases.items():
+            share = seconds / total * 100 if total else 0.0
+            lines.append(f"{name:>14}: {seconds * 1000:10.2f} ms {share:5.1f}%")
+        lines.append(f"{'total':>14}: {total * 1000:10.2f} ms")
+        if self.cached:
+            lines.append(f"{'':>16}templates loaded from the cache")
+
+        scanned = f"{self.bytes_scanned} bytes"
+        matching = self.phases.get("matching", 0.0)
+        if matching:
+            scanned += f" ({self.bytes_scanned / matching / (1 << 20):.1f} MiB/s while matching)"
+        lines.append(f"{'scanned':>14}: {scanned}")
+        if self.files > 1:
+            lines.append(f"{'files':>14}: {self.files}")
+        lines.append(f"{'matches':>14}: {self.matches}")
+
+        peak = self.peak_rss()
+        if peak is not None:
+            lines.append(f"{'peak RSS':>14}: {peak / (1 << 20):.1f} MiB")
+        return "\n".join(lines)
+
+
+class TimedIO:
+    """Wraps a file so the time spent reading and writing it counts towards phases of `stats`"""
+
+    def __init__(self, file: IO, stats: Stats, phase: str):
+        self.file = file
+        self.stats = stats
+        self.phase = phase
+
+    def read(self, *args):
+        with self.stats.phase(self.phase):
+            return self.file.read(*args)
+
+    def write(self, data):
+        with self.stats.phase(self.phase):
+            return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def record(stats: Optional[Stats], phase: str) -> ContextManager:
+    """`stats.phase(phase)`, or nothing if there are no stats to record"""
+    return nullcontext() if stats is None else stats.phase(phase)
@@ -0,0 +1,160 @@
+from typing import *
+from typing import Match, Pattern
+
+
+# Characters read from the document per window
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Longest stretch of text a single match may cover. Greedy slots look ahead to the end of the line
+# before backtracking, so this has to cover the longest line a match can start on.
+DEFAULT_MAX_SPAN = 1 << 20
+
+
+class StreamMatch:
+    """A match found in a window of a larger document, with offsets relative to the whole document"""
+    __slots__ = ("match", "offset")
+
+    def __init__(self, match: Match, offset: int):
+        self.match = match
+        self.offset = offset
+
+    def start(self, group: Union[int, str] = 0) -> int:
+        start = self.match.start(group)
+        return start if start == -1 else start + self.offset
+
+    def end(self, group: Union[int, str] = 0) -> int:
+        end = self.match.end(group)
+        return end if end == -1 else end + self.offset
+
+    def span(self, group: Union[int, str] = 0) -> Tuple[int, int]:
+        return self.start(group), self.end(group)
+
+    def group(self, *groups: Union[int, str]) -> Union[str, Tuple[str, ...]]:
+        return self.match.group(*groups)
+
+    def groups(self, default=None) -> Tuple[str, ...]:
+        return self.match.groups(default)
+
+    def groupdict(self, default=None) -> Dict[str, str]:
+        return self.match.groupdict(default)
+
+    def expand(self, template: str) -> str:
+        return self.match.expand(template)
+
+    def __getitem__(self, group: Union[int, str]) -> str:
+        return self.match[group]
+
+    @property
+    def lastindex(self) -> Optional[int]:
+        return self.match.lastindex
+
+    @property
+    def lastgroup(self) -> Optional[str]:
+        return self.match.lastgroup
+
+    @property
+    def re(self) -> Pattern:
+        return self.match.re
+
+    def __repr__(self):
+        return f"<StreamMatch object; span={self.span()!r}, match={self.group(0)!r}>"
+
+
+def iter_matches(regex: Pattern, stream: IO, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_span: int = DEFAULT_MAX_SPAN,
+                 prefilter: Optional[Callable[[str], bool]] = None) -> Iterator[StreamMatch]:
+    """Lazily find every match of `regex` in `stream` while holding at most
+    `chunk_size + max_span` characters of it in memory.
+
+    A match is only reported once at least `max_span` characters past its start have been read, so
+    results are the same as matching the whole document as long as no match needs to look further
+    ahead than that. If `prefilter` returns False for a window, the regex isn't run over it at all.
+    """
+    for m, offset in search_windows(regex, stream, chunk_size, max_span, prefilter):
+        yield StreamMatch(m, offset)
+
+
+def search_windows(regex: Pattern, stream: IO, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   max_span: int = DEFAULT_MAX_SPAN,
+                   prefilter: Optional[Callable[[str], bool]] = None) -> Iterator[Tuple[Match, int]]:
+    """`iter_matches`, yielding the matches as the regex found them in a window along with the
+    offset of the window, for when they don't need wrapping (such as to count them)"""
+    buffer = stream.read(0)
+    offset = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+        limit = len(buffer) if eof else len(buffer) - max_span
+
+        pos = 0
+        searchable = prefilter is None or prefilter(buffer)
+        while searchable and pos <= limit:
+            m = regex.search(buffer, pos)
+            if m is None or m.start() > limit:
+                break
+
+            yield m, offset
+            pos = m.end() if m.end() > m.start() else m.end() + 1
+
+        if eof:
+            return
+
+        keep = max(pos, limit, 0)
+        buffer = buffer[keep:]
+        offset += keep
+
+
+Replacement = Union[str, Callable[[Match], str]]
+
+
+def iter_replace(regex: Pattern, template: Replacement, stream: IO, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_span: int = DEFAULT_MAX_SPAN,
+                 prefilter: Optional[Callable[[str], bool]] = None) -> Generator[str, None, int]:
+    """Like `iter_matches`, but yield the substituted document piece by piece: unchanged slices of
+    the original text alternate with expansions of `template`, which may also be a function of the
+    match like for `re.sub`. Returns the number of replacements."""
+    expand = template if callable(template) else lambda m: m.expand(template)
+    buffer = stream.read(0)
+    count = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+        limit = len(buffer) if eof else len(buffer) - max_span
+
+        pos = 0
+        copied = 0
+        searchable = prefilter is None or prefilter(buffer)
+        while searchable and pos <= limit:
+            m = regex.search(buffer, pos)
+            if m is None or m.start() > limit:
+                break
+
+            yield buffer[copied:m.start()]
+            yield expand(m)
+            count += 1
+            copied = m.end()
+            pos = m.end() if m.end() > m.start() else m.end() + 1
+
+        if eof:
+            yield buffer[copied:]
+            return count
+
+        keep = max(pos, limit, 0)
+        yield buffer[copied:keep]
+        buffer = buffer[keep:]
+
+
+def write_replaced(regex: Pattern, template: Replacement, source: IO, destination: IO,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE, max_span: int = DEFAULT_MAX_SPAN,
+                   prefilter: Optional[Callable[[str], bool]] = None) -> int:
+    pieces = iter_replace(regex, template, source, chunk_size, max_span, prefilter)
+    while True:
+        try:
+            piece = next(pieces)
+        except StopIteration as e:
+            return e.value
+
+        if piece:
+            destination.write(piece)
@@ -0,0 +1,293 @@
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import re
+import select
+import struct
+import sys
+import time
+from typing import *
+
+from .TemplateProcessor import TemplateProcessor
+from .batch import expand_paths
+
+
+# inotify event flags, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+_EVENT = struct.Struct("iIII")
+
+# How long to keep collecting events after the first one, so that a burst of writes (an editor
+# saving, or a whole corpus being exported) is handled in one go
+SETTLE_TIME = 0.1
+
+
+class Inotify:
+    """The paths written to or moved into a set of directories, from the Linux kernel. Directories
+    created inside watched directories are watched too."""
+
+    def __init__(self):
+        name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or name is None:
+            raise OSError("inotify is only available on Linux")
+
+        self._libc = ctypes.CDLL(name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories: Dict[int, str] = dict()
+
+    def add(self, directory: str, recursive: bool = False):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Can't watch {directory}")
+        self._directories[wd] = directory
+
+        if recursive:
+            for root, dirs, _ in os.walk(directory):
+                for name in dirs:
+                    self.add(os.path.join(root, name))
+
+    def read(self, timeout: Optional[float] = None) -> Optional[Set[str]]:
+        """Wait up to `timeout` seconds for changes and return the paths that changed. Returns None
+        if events were lost, in which case anything could have changed."""
+        changed: Set[str] = set()
+        deadline = None
+        while True:
+            wait = timeout if deadline is None else max(deadline - time.monotonic(), 0)
+            ready, _, _ = select.select([self.fd], [], [], wait)
+            if not ready:
+                return changed
+
+            data = os.read(self.fd, 1 << 16)
+            for mask, path in self._events(data):
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.add(path, recursive=True)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    changed.add(path)
+            if deadline is None:
+                deadline = time.monotonic() + SETTLE_TIME
+
+    def _events(self, data: bytes) -> Iterator[Tuple[int, str]]:
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            directory = self._directories.get(wd)
+            if directory is not None or mask & IN_Q_OVERFLOW:
+                yield mask, os.path.normpath(os.path.join(directory or "", os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    """The same as `Inotify`, by comparing the size and modification time of every file every so often"""
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self._roots: List[Tuple[str, bool]] = []
+        self._seen: Dict[str, Tuple[int, int]] = dict()
+
+    def add(self, directory: str, recursive: bool = False):
+        self._roots.append((directory, recursive))
+        self._seen.update(self._scan([(directory, recursive)]))
+
+    def read(self, timeout: Optional[float] = None) -> Optional[Set[str]]:
+        time.sleep(self.interval if timeout is None else min(self.interval, timeout))
+        seen = self._scan(self._roots)
+        changed = {path for path, state in seen.items() if self._seen.get(path) != state}
+        self._seen = seen
+        return changed
+
+    @staticmethod
+    def _scan(roots: Iterable[Tuple[str, bool]]) -> Dict[str, Tuple[int, int]]:
+        seen = dict()
+        for directory, recursive in roots:
+            for root, dirs, names in os.walk(directory):
+                if not recursive:
+                    dirs.clear()
+                for name in names:
+                    path = os.path.normpath(os.path.join(root, name))
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    seen[path] = (st.st_mtime_ns, st.st_size)
+        return seen
+
+    def close(self):
+        pass
+
+
+def open_watcher(interval: float = 1.0, polling: bool = False) -> Union[Inotify, Poller]:
+    """An `Inotify`, or a `Poller` if inotify isn't available or `polling` is set"""
+    if not polling:
+        try:
+            return Inotify()
+        except (OSError, AttributeError):
+            pass
+    return Poller(interval)
+
+
+def watched_directory(path: str) -> Tuple[str, bool]:
+    """The directory to watch for a file, directory or glob pattern, and whether to watch it recursively"""
+    if os.path.isdir(path):
+        return os.path.normpath(path), True
+
+    magic = re.search(r"[*?\[]", path)
+    if magic is None:
+        return os.path.dirname(os.path.normpath(path)) or ".", False
+    # Everything under the part of the pattern before the first wildcard
+    base = os.path.dirname(path[:magic.start()]) or "."
+    return os.path.normpath(base), "**" in path or os.sep in path[magic.start():]
+
+
+class WatchEvent(NamedTuple):
+    # "compiled", "unchanged" (a template was saved but compiles to the same patterns), "applied" or "failed"
+    kind: str
+    path: str
+    count: int = 0
+    error: Optional[str] = None
+
+
+class Watcher:
+    """Keeps the output of a substitution up to date with its templates and the files it's applied to.
+
+    `load` compiles the templates, which are read from `templates`. A template is only compiled
+    again once its contents change, and if it compiles to the same patterns nothing is redone.
+    Files are only substituted again once their contents change. With `output_dir`, substituted
+    copies of the files are written there, mirroring their paths under the watched directories,
+    and all of them are redone when the templates change. Otherwise files are substituted in
+    place whenever they're written, and a template change only applies to files written after it.
+    """
+
+    def __init__(self, load: Callable[[], TemplateProcessor], templates: Sequence[str], paths: Sequence[str],
+                 output_dir: Optional[str] = None, interval: float = 1.0, polling: bool = False):
+        self.load = load
+        self.templates = [os.path.normpath(t) for t in templates]
+        self.paths = list(paths)
+        self.output_dir = None if output_dir is None else os.path.abspath(output_dir)
+        self.processor: Optional[TemplateProcessor] = None
+
+        self._watcher = open_watcher(interval, polling)
+        self._template_texts: Dict[str, str] = dict()
+        # What each file last contained when it was substituted (or written by us when in place)
+        self._digests: Dict[str, bytes] = dict()
+
+        roots = [watched_directory(path) for path in self.paths]
+        self.base = os.path.commonpath([os.path.abspath(directory) for directory, _ in roots])
+        for directory, recursive in roots + [watched_directory(t) for t in self.templates]:
+            self._watcher.add(directory, recursive)
+
+    def files(self) -> List[str]:
+        files = (os.path.normpath(f) for f in expand_paths(self.paths))
+        return [f for f in files if os.path.isfile(f) and not self._is_output(f)]
+
+    def _is_output(self, path: str) -> bool:
+        return self.output_dir is not None and os.path.abspath(path).startswith(self.output_dir + os.sep)
+
+    def output_path(self, file: str) -> str:
+        return os.path.join(self.output_dir, os.path.relpath(os.path.abspath(file), self.base))
+
+    def run(self, once: bool = False) -> Iterator[WatchEvent]:
+        """Compile the templates and bring every file up to date, then keep doing so as they
+        change. With `once`, stop after the first round."""
+        yield from self._reload()
+        if self.processor is not None:
+            yield from self._apply(self.files())
+
+        while not once:
+            changed = self._watcher.read()
+            if changed is None:
+                changed = set(self.templates) | set(self.files())
+
+            if changed & set(self.templates):
+                before = self.processor
+                events = list(self._reload())
+                yield from events
+                if any(e.kind == "compiled" for e in events) and (before is None or self.output_dir is not None):
+                    self._digests.clear()
+                    changed |= set(self.files())
+
+            files = changed - set(self.templates)
+            if files and self.processor is not None:
+                if files - set(self._digests):
+                    # New files have to be checked against the paths and patterns being watched
+                    files &= set(self.files())
+                yield from self._apply(sorted(files))
+
+    def _reload(self) -> Iterator[WatchEvent]:
+        texts = dict()
+        for template in self.templates:
+            try:
+                with open(template, "r") as h:
+                    texts[template] = h.read()
+            except OSError as e:
+                yield WatchEvent("failed", template, error=f"{type(e).__name__}: {e}")
+                return
+
+        if texts == self._template_texts:
+            return
+        self._template_texts = texts
+
+        path = ", ".join(self.templates)
+        try:
+            processor = self.load()
+        except Exception as e:
+            # Keep going with the last templates that compiled, until this one is fixed
+            yield WatchEvent("failed", path, error=f"{type(e).__name__}: {e}")
+            return
+
+        old, self.processor = self.processor, processor
+        if old is not None and (old.pattern, old.target) == (processor.pattern, processor.target):
+            yield WatchEvent("unchanged", path)
+        else:
+            yield WatchEvent("compiled", path)
+
+    def _apply(self, files: Iterable[str]) -> Iterator[WatchEvent]:
+        for file in files:
+            # Editors and exporters often write to a temporary file and rename it
+            if not os.path.isfile(file):
+                continue
+            try:
+                with open(file, "rb") as h:
+                    digest = hashlib.sha1(h.read()).digest()
+                if self._digests.get(file) == digest:
+                    continue
+
+                if self.output_dir is None:
+                    count = self.processor.replace_in_place(file)
+                    with open(file, "rb") as h:
+                        digest = hashlib.sha1(h.read()).digest()
+                else:
+                    # Newlines are kept as they are, like when substituting in place
+                    with open(file, "r", newline="") as h:
+                        text = h.read()
+                    text, count = self.processor.subn(text)
+                    destination = self.output_path(file)
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    with open(destination, "w", newline="") as h:
+                        h.write(text)
+            except Exception as e:
+                self._digests.pop(file, None)
+                yield WatchEvent("failed", file, error=f"{type(e).__name__}: {e}")
+                continue
+
+            self._digests[file] = digest
+            yield WatchEvent("applied", file, count)
+
+    def close(self):
+        self._watcher.close()
@@ -0,0 +1,338 @@
+import multiprocessing
+import queue
+import threading
+from typing import *
+
+from .cache import default_cache
+from .incremental import IncrementalMatcher
+from .stream import DEFAULT_MAX_SPAN
+
+# Progress is reported each time matching gets this much further through the document
+PROGRESS_STEP = 0.01
+
+# The document is searched in windows at least this many times `DEFAULT_MAX_SPAN` long, since
+# each window is searched that much further than it reaches again
+PROGRESS_WINDOW = 4
+
+# How many seconds a cancelled job has to notice before its process is killed, for a match that hangs
+CANCEL_GRACE = 2.0
+
+# The input template, the output template (or None) and whether whitespace is conserved
+Templates = Tuple[str, Optional[str], bool]
+
+
+def span_note(document: str) -> str:
+    """What to add to the results of a job on a document long enough that it's searched in windows,
+    and substituted in place a window at a time, where matches are limited like with `find --max-span`"""
+    if len(document) <= DEFAULT_MAX_SPAN:
+        return ""
+    return f" (no match may look more than {DEFAULT_MAX_SPAN >> 20} MiB ahead)"
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Progress:
+    """Reports how far a job has got, and stops it once it has been cancelled"""
+
+    def __init__(self, conn, current, job: int):
+        self.conn = conn
+        self.current = current
+        self.job = job
+
+    def check(self):
+        """Raise `_Cancelled` if the job has been cancelled, or another one submitted since"""
+        if self.current.value != self.job:
+            raise _Cancelled
+
+    def __call__(self, fraction: float):
+        self.check()
+        self.conn.send((self.job, "progress", fraction))
+
+
+def _matches(processor, document: str, progress: _Progress) -> Iterator:
+    """Every match in the document, reporting how far through it the search has got. The document
+    is searched a window at a time, so that progress is reported even where nothing matches, and
+    like with `find --max-span`, no match may need to look further ahead than `DEFAULT_MAX_SPAN`."""
+    if not processor.could_match(document):
+        return
+    regex = processor.matcher()
+    length = len(document)
+    step = max(int(length * PROGRESS_STEP), PROGRESS_WINDOW * DEFAULT_MAX_SPAN)
+    pos = 0
+    limit = 0
+    while True:
+        # Matches starting before `limit` are taken from this window, and any after it from the next
+        limit = min(limit + step, length)
+        endpos = length if limit == length else min(limit + DEFAULT_MAX_SPAN, length)
+        while pos <= limit:
+            m = regex.search(document, pos, endpos)
+            if m is None or (m.start() >= limit and limit < length):
+                break
+            yield m
+            progress.check()
+            pos = m.end() if m.end() > m.start() else m.end() + 1
+
+        if limit == length:
+            return
+        pos = max(pos, limit)
+        progress(limit / length)
+
+
+def _find(processor, document: str, progress: _Progress):
+    from .matchset import MatchSet
+
+    regex = processor.regex
+    found = MatchSet.from_matches(_matches(processor, document, progress), document, regex.groups, regex.groupindex)
+    return found.starts, found.ends, found.groupindex
+
+
+def _substitute(processor, document: str, progress: _Progress) -> Tuple[str, int]:
+    if processor.target is None:
+        raise ValueError("The template has no output template to substitute with")
+    expand = processor.expander()
+    pieces = []
+    pos = 0
+    for m in _matches(processor, document, progress):
+        pieces.append(document[pos:m.start()])
+        pieces.append(expand(m))
+        pos = m.end()
+    pieces.append(document[pos:])
+    return "".join(pieces), (len(pieces) - 1) // 2
+
+
+# The matches of the last template previewed, kept up to date between previews
+_live: Optional[IncrementalMatcher] = None
+
+
+def _preview(processor, document: str, progress: _Progress, limit: int):
+    # Only a new input template needs the document matched again. Changes to the document only need
+    # matching around them, and changes to the output template only need the matches expanded again.
+    # A new input template could change any match, so then the whole document is matched again,
+    # and a job cancelled meanwhile leaves the last matches as they were.
+    global _live
+    if _live is None or processor.pattern != _live.processor.pattern:
+        _live = IncrementalMatcher(processor, document, matches=_matches(processor, document, progress))
+    else:
+        _live.update(document)
+        if processor is not _live.processor:
+            _live.set_processor(processor)
+
+    import numpy as np
+    from .matchset import MatchSet
+
+    # Matches after an edit are moved along by an offset, which is added to all of their groups at once
+    regex = processor.regex
+    found = MatchSet.from_matches((m.match for m in _live.matches), document, regex.groups, regex.groupindex)
+    offsets = np.fromiter((m.offset for m in _live.matches), dtype=np.int64, count=len(_live.matches))[:, None]
+    for spans in (found.starts, found.ends):
+        spans += np.where(spans == -1, 0, offsets)
+    preview = [(m.start(), m.group(0), _live.replacement(i)) for i, m in enumerate(_live.matches[:limit])]
+    return found.starts, found.ends, found.groupindex, preview
+
+
+def _replace_file(processor, document: str, progress: _Progress, file: str) -> int:
+    return processor.replace_in_place(file)
+
+
+_TASKS = {
+    "find": _find,
+    "subs": _substitute,
+    "preview": _preview,
+    "replace": _replace_file,
+}
+
+
+def _serve(conn, current):
+    # The document is only sent again when it changes, and compiled templates stay in this process's
+    # cache. `current` holds the number of the job that should be running, and any other job stops
+    # between matches, keeping the process and everything in it.
+    document = None
+    while True:
+        try:
+            job, task, templates, text, args = conn.recv()
+        except EOFError:
+            return
+        if text is not None:
+            document = text
+
+        progress = _Progress(conn, current, job)
+        try:
+            progress.check()
+            processor = default_cache.get(*templates)
+            result = _TASKS[task](processor, document, progress, *args)
+        except _Cancelled:
+            conn.send((job, "cancelled", None))
+        except Exception as e:
+            conn.send((job, "error", f"{type(e).__name__}: {e}"))
+        else:
+            conn.send((job, "done", result))
+
+
+class MatchWorker:
+    """Compiles templates and matches them for a GUI in a process of its own, so that neither a large
+    document nor a template that backtracks badly holds up the event loop. (A thread wouldn't do,
+    since a regex search holds the GIL until it's over.)
+
+    One job runs at a time. Submitting a job cancels the one before it. A cancelled job stops
+    between matches, so the process keeps the document and what it has matched, and only if it
+    hasn't stopped within `CANCEL_GRACE` seconds (a match that hangs) is the process killed, and
+    started again for the next job. `deliver` runs a function on the GUI's thread, like
+    `wx.CallAfter`. The callbacks of a job are only ever called through it, and never after the
+    job has been cancelled or replaced.
+
+    Tasks, with what `on_done` gets:
+
+        find       the starts, ends and groupindex of a `MatchSet` of the document
+        subs       the substituted document and the number of replacements
+        preview    the same as find, and the start, text and replacement of the first `limit` matches
+                   (given as an argument). Between previews, matches are only found again as far
+                   as the templates and the document changed.
+        replace    the number of replacements made in the file given as an argument, in place
+    """
+
+    def __init__(self, deliver: Callable[[Callable[[], None]], None]):
+        self.deliver = deliver
+        self._lock = threading.Lock()
+        self._process = None
+        self._conn = None
+        self._outbox = None
+        # The number of the job the process should be running, shared with it
+        self._current = None
+        # The document the process has, so it isn't sent again
+        self._document = None
+        self._job = 0
+        self._running = False
+        # The last job sent to the process, and the last one it finished (or stopped)
+        self._sent = 0
+        self._finished = 0
+        # The callbacks of the current job, and what to send to start it again in a new process
+        self._callbacks = None
+        self._message = None
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def submit(self, task: str, templates: Templates, document: str, on_done: Callable[[Any], None],
+               on_progress: Optional[Callable[[float], None]] = None,
+               on_error: Optional[Callable[[str], None]] = None, args: tuple = ()) -> int:
+        """Start a job, cancelling any job still running. Returns the number of the job."""
+        with self._lock:
+            self._job += 1
+            if self._process is None:
+                self._start()
+            self._stop_stale()
+            self._callbacks = (on_done, on_progress, on_error)
+            self._message = (task, templates, document, args)
+            self._running = True
+            self._send()
+            return self._job
+
+    def cancel(self):
+        with self._lock:
+            self._job += 1
+            self._running = False
+            if self._process is not None:
+                self._stop_stale()
+
+    def close(self):
+        with self._lock:
+            self._job += 1
+            self._running = False
+            if self._process is not None:
+                self._kill()
+
+    def _start(self):
+        context = multiprocessing.get_context("spawn")
+        self._conn, child = context.Pipe()
+        self._current = context.Value("q", 0, lock=False)
+        self._process = context.Process(target=_serve, args=(child, self._current), daemon=True)
+        self._process.start()
+        child.close()
+        # Sending a large document takes a while too, so it's done off the GUI's thread
+        self._outbox = queue.Queue()
+        threading.Thread(target=self._send_all, args=(self._conn, self._outbox), daemon=True).start()
+        threading.Thread(target=self._receive, args=(self._conn,), daemon=True).start()
+
+    def _send(self):
+        task, templates, document, args = self._message
+        self._outbox.put((self._job, task, templates, None if document == self._document else document, args))
+        self._document = document
+        self._sent = self._job
+
+    def _stop_stale(self):
+        # Any earlier job stops at its next check, and the process is killed if it doesn't
+        self._current.value = self._job
+        if self._finished < self._sent:
+            timer = threading.Timer(CANCEL_GRACE, self._kill_if_stuck, args=(self._process, self._sent))
+            timer.daemon = True
+            timer.start()
+
+    def _kill_if_stuck(self, process, job: int):
+        with self._lock:
+            if process is not self._process or self._finished >= job:
+                return
+            self._kill()
+            # The job waiting behind the stuck one goes to a new process instead
+            if self._running:
+                self._start()
+                self._current.value = self._job
+                self._send()
+
+    def _kill(self):
+        # The connection is left for the thread receiving on it to close, once it sees the end of it
+        self._process.kill()
+        self._process.join()
+        self._outbox.put(None)
+        self._process = self._conn = self._outbox = self._current = self._document = None
+        self._finished = self._sent
+
+    @staticmethod
+    def _send_all(conn, outbox: queue.Queue):
+        while True:
+            message = outbox.get()
+            if message is None:
+                return
+            try:
+                conn.send(message)
+            except OSError:
+                return
+
+    def _receive(self, conn):
+        try:
+            while True:
+                job, kind, value = conn.recv()
+                with self._lock:
+                    if conn is not self._conn:
+                        break
+                    if kind != "progress":
+                        self._finished = job
+                        if job == self._job:
+                            self._running = False
+                    callbacks = self._callbacks if job == self._job else None
+                if callbacks is not None and kind != "cancelled":
+                    on_done, on_progress, on_error = callbacks
+                    self._deliver(job, {"done": on_done, "progress": on_progress, "error": on_error}[kind], value)
+        except (EOFError, OSError):
+            with self._lock:
+                # Processes killed on purpose end like this too, with nothing to report
+                running = False
+                if conn is self._conn:
+                    self._kill()
+                    running, self._running = self._running, False
+                job, callbacks = self._job, self._callbacks
+            if running:
+                self._deliver(job, callbacks[2], "The worker process stopped unexpectedly")
+        conn.close()
+
+    def _deliver(self, job: int, callback: Optional[Callable[[Any], None]], value):
+        if callback is None:
+            return
+
+        def call():
+            if job == self._job:
+                callback(value)
+
+        self.deliver(call)
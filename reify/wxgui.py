@@ -2,11 +2,25 @@ import wx
 import wx.aui as aui
 from typing import *
 
-from .TemplateProcessor import TemplateProcessor
+from .matchset import MatchSet, coalesce
+from .worker import MatchWorker, Templates, span_note
 
 
 ButtonData = NewType("ButtonData", Tuple[str, Callable[[wx.Event], None]])
 
+# Steps of the progress gauges
+PROGRESS_RANGE = 1000
+
+# Characters either side of the visible part of a document that are highlighted along with it, so
+# that scrolling a little doesn't show unhighlighted text
+VIEWPORT_MARGIN = 4000
+
+# How long typing in a template has to pause for before a live preview is made, in milliseconds
+LIVE_DELAY = 300
+
+# Matches listed in a live preview
+LIVE_PREVIEW_MATCHES = 20
+
 
 class ButtonSeries (wx.Panel):
     def __init__(self, parent: wx.Window,
@@ -15,10 +29,12 @@ class ButtonSeries (wx.Panel):
                  orientation: int = wx.HORIZONTAL):
         super().__init__(parent)
         sizer = wx.BoxSizer(orientation)
+        self.buttons: List[wx.Button] = []
 
         for i, (label, callback) in enumerate(button_data):
             btn = wx.Button(self, id=wx.ID_ANY, label=label)
             btn.Bind(wx.EVT_BUTTON, callback)
+            self.buttons.append(btn)
             if i == 0:
                 sizer.Add(btn)
             elif orientation == wx.HORIZONTAL:
@@ -29,6 +45,40 @@ class ButtonSeries (wx.Panel):
         self.SetSizer(sizer)
 
 
+class ProgressPanel (wx.Panel):
+    """How far a job running in a `MatchWorker` has got, with a button to cancel it"""
+
+    def __init__(self, parent: wx.Window, on_cancel: Callable[[], None]):
+        super().__init__(parent)
+        sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.label = wx.StaticText(self, label="")
+        self.gauge = wx.Gauge(self, range=PROGRESS_RANGE)
+        self.cancel_button = wx.Button(self, id=wx.ID_ANY, label="Cancel")
+        self.cancel_button.Bind(wx.EVT_BUTTON, lambda e: on_cancel())
+        self.cancel_button.Disable()
+
+        sizer.Add(self.label, flag=wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, border=10)
+        sizer.Add(self.gauge, proportion=1, flag=wx.ALIGN_CENTER_VERTICAL)
+        sizer.Add(self.cancel_button, flag=wx.LEFT, border=10)
+        self.SetSizer(sizer)
+
+    def start(self, label: str):
+        self.label.SetLabel(label)
+        # Until the first progress comes in, e.g. while the template compiles
+        self.gauge.Pulse()
+        self.cancel_button.Enable()
+        self.Layout()
+
+    def update(self, fraction: float):
+        self.gauge.SetValue(int(fraction * PROGRESS_RANGE))
+
+    def finish(self, label: str = ""):
+        self.label.SetLabel(label)
+        self.gauge.SetValue(0)
+        self.cancel_button.Disable()
+        self.Layout()
+
+
 class FileViewerContextMenu (wx.Menu):
     def __init__(self, parent: "FileViewer"):
         super().__init__()
@@ -178,17 +228,16 @@ class ReifyMenuBar (wx.MenuBar):
 
 
 class ConfirmChangesDialog (wx.Dialog):
-    def __init__(self, input_template: str, output_template: str, document: FileViewer, *args, **kw):
+    def __init__(self, templates: Templates, document: FileViewer, worker: MatchWorker, *args, **kw):
         super().__init__(title="Confirm Replacements", *args, **kw)
         self.SetSize(800, 500)
 
         self.root = wx.Panel(self)
         sizer = wx.BoxSizer(wx.VERTICAL)
         self.document = document
-        self.input_template = input_template
-        self.output_template = output_template
+        self.templates = templates
+        self.worker = worker
         self.file_contents = document.file_viewer.GetValue()
-        self.reify = TemplateProcessor(input_template, output_template, False)
 
         self.orig_label = wx.StaticText(self, label="Original")
         self.new_label = wx.StaticText(self, label="After Changes")
@@ -199,13 +248,13 @@ class ConfirmChangesDialog (wx.Dialog):
         self.orig_document.SetDefaultStyle(default_style)
         self.orig_document.SetValue(self.file_contents)
         self.new_document.SetDefaultStyle(default_style)
-        self.new_document.SetValue(self.reify.find_and_replace(document.filename, False))
         button_data: List[ButtonData] = [
-            ("Cancel", lambda e: self.Destroy()),
-            ("Confirm", lambda e: self.reify.find_and_replace(document.filename, True)),
+            ("Cancel", self.cancel),
+            ("Confirm", self.confirm),
             ("Save As...", self.save_changes_as)
         ]
         self.buttons = ButtonSeries(self, button_data)
+        self.progress = ProgressPanel(self, self.cancel_job)
 
         hbox1 = wx.BoxSizer(wx.HORIZONTAL)
         vbox1 = wx.BoxSizer(wx.VERTICAL)
@@ -220,9 +269,45 @@ class ConfirmChangesDialog (wx.Dialog):
 
         sizer.Add(hbox1, flag=wx.EXPAND, proportion=1)
 
-        sizer.Add(self.buttons, flag=wx.ALIGN_RIGHT | wx.ALL, border=10)
+        hbox2 = wx.BoxSizer(wx.HORIZONTAL)
+        hbox2.Add(self.progress, flag=wx.ALIGN_CENTER_VERTICAL, proportion=1)
+        hbox2.Add(self.buttons, flag=wx.LEFT, border=10)
+        sizer.Add(hbox2, flag=wx.EXPAND | wx.ALL, border=10)
 
         self.SetSizer(sizer)
+        self.run("subs", "Substituting...", self.show_changes)
+
+    def run(self, task: str, label: str, on_done: Callable[[Any], None], args: tuple = ()):
+        # Nothing can be confirmed or saved while a job is running
+        for button in self.buttons.buttons[1:]:
+            button.Disable()
+        self.progress.start(label)
+        self.worker.submit(task, self.templates, self.file_contents, on_done, self.progress.update,
+                           self.show_error, args)
+
+    def show_changes(self, result: Tuple[str, int]):
+        text, count = result
+        self.new_document.SetValue(text)
+        self.progress.finish(f"{count} replacements" + span_note(self.file_contents))
+        for button in self.buttons.buttons[1:]:
+            button.Enable()
+
+    def show_error(self, message: str):
+        self.progress.finish()
+        wx.MessageBox(message, "Error", style=wx.OK | wx.ICON_ERROR)
+
+    def confirm(self, e: wx.Event) -> None:
+        self.run("replace", "Replacing...",
+                 lambda count: self.progress.finish(f"Replaced {count} occurrences" + span_note(self.file_contents)),
+                 (self.document.filename,))
+
+    def cancel_job(self):
+        self.worker.cancel()
+        self.progress.finish("Cancelled")
+
+    def cancel(self, e: wx.Event) -> None:
+        self.worker.cancel()
+        self.Destroy()
 
     def save_changes_as(self, e: wx.Event) -> None:
         filename: str = wx.FileSelector("Select a File to Save To", flags=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
@@ -255,6 +340,28 @@ class IndexPanel (wx.Panel):
             ("Preview Changes...", self.confirm_changes)
         ]
         self.buttons = ButtonSeries(self, button_data)
+        self.worker = MatchWorker(wx.CallAfter)
+        self.progress = ProgressPanel(self, self.cancel_job)
+        self.Bind(wx.EVT_WINDOW_DESTROY, lambda e: self.close_worker(), self)
+
+        # With live preview on, the templates are checked again whenever typing in them pauses
+        self.live_checkbox = wx.CheckBox(self, label="Live preview")
+        self.live_checkbox.Bind(wx.EVT_CHECKBOX, self.toggle_live)
+        self.live_preview = wx.TextCtrl(self, style=wx.TE_MULTILINE | wx.TE_READONLY | wx.HSCROLL, size=(-1, 120))
+        self.live_preview.Hide()
+        self._live_timer: Optional[wx.CallLater] = None
+        for viewer in (self.input_template_viewer, self.output_template_viewer):
+            viewer.file_viewer.Bind(wx.EVT_TEXT, self.template_changed)
+
+        # Only the part of the document on screen is highlighted, and highlighted again as it scrolls
+        self.matches: Optional[MatchSet] = None
+        self._highlighted: Optional[Tuple[int, int]] = None
+        self._highlight_pending = False
+        self.match_style = wx.TextAttr(wx.BLACK, wx.Colour(200, 240, 200))
+        self.slot_style = wx.TextAttr(wx.BLACK, wx.GREEN)
+        self.slot_style.SetFontWeight(wx.FONTWEIGHT_BOLD)
+        for event in (wx.EVT_SCROLLWIN, wx.EVT_MOUSEWHEEL, wx.EVT_KEY_UP, wx.EVT_LEFT_UP, wx.EVT_SIZE):
+            self.document_viewer.file_viewer.Bind(event, self.viewport_changed)
 
         file_viewer_grid = wx.BoxSizer(wx.HORIZONTAL)
         template_viewer_sizer = wx.BoxSizer(wx.VERTICAL)
@@ -264,7 +371,12 @@ class IndexPanel (wx.Panel):
         file_viewer_grid.Add(self.document_viewer, flag=wx.EXPAND, proportion=1)
 
         sizer.Add(file_viewer_grid, flag=wx.EXPAND, proportion=1)
-        sizer.Add(self.buttons, flag=wx.ALIGN_RIGHT | wx.ALL, border=10)
+        button_row = wx.BoxSizer(wx.HORIZONTAL)
+        button_row.Add(self.progress, flag=wx.ALIGN_CENTER_VERTICAL, proportion=1)
+        button_row.Add(self.live_checkbox, flag=wx.ALIGN_CENTER_VERTICAL | wx.LEFT, border=10)
+        button_row.Add(self.buttons, flag=wx.LEFT, border=10)
+        sizer.Add(self.live_preview, flag=wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, border=10)
+        sizer.Add(button_row, flag=wx.EXPAND | wx.ALL, border=10)
 
         self.SetSizer(sizer)
 
@@ -330,29 +442,139 @@ class IndexPanel (wx.Panel):
             wx.MessageBox(error_string, "Error", style=wx.OK | wx.ICON_ERROR)
             return
 
-        with ConfirmChangesDialog(parent=self,
-                                  input_template=self.input_template_viewer.file_viewer.GetValue(),
-                                  output_template=self.output_template_viewer.file_viewer.GetValue(),
-                                  document=self.document_viewer) as ccd:
+        # The dialog takes over the worker
+        self.stop_live_timer()
+        if self.worker.running:
+            self.cancel_job()
+        with ConfirmChangesDialog(parent=self, templates=self.templates(), document=self.document_viewer,
+                                  worker=self.worker) as ccd:
             ccd.ShowModal()
 
+    def templates(self) -> Templates:
+        return (self.input_template_viewer.file_viewer.GetValue(),
+                self.output_template_viewer.file_viewer.GetValue(),
+                False)
+
     def highlight_matches(self):
+        document = self.document_viewer.file_viewer.GetValue()
+        self.progress.start("Checking...")
+        self.worker.submit("find", self.templates(), document,
+                           lambda spans: self.show_matches(MatchSet(document, *spans)),
+                           self.progress.update, self.show_error)
+
+    def show_matches(self, matches: MatchSet):
+        self.progress.finish(f"{len(matches)} matches" + span_note(matches.document))
+        self.matches = matches
+        self.highlight_viewport(force=True)
+
+    def viewport_changed(self, e: wx.Event):
+        e.Skip()
+        if self.matches is not None and not self._highlight_pending:
+            self._highlight_pending = True
+            # Once the text control has handled the event and scrolled
+            wx.CallAfter(self.highlight_viewport)
+
+    def viewport(self) -> Tuple[int, int]:
+        """The range of the document on screen, widened by `VIEWPORT_MARGIN`"""
+        text = self.document_viewer.file_viewer
+        width, height = text.GetClientSize()
+        result, first = text.HitTestPos(wx.Point(0, 0))
+        if result == wx.TE_HT_UNKNOWN:
+            # Not every platform can tell, so go by where the cursor is instead
+            first = last = text.GetInsertionPoint()
+        else:
+            _, last = text.HitTestPos(wx.Point(max(width - 1, 0), max(height - 1, 0)))
+        return max(first - VIEWPORT_MARGIN, 0), min(last + VIEWPORT_MARGIN, text.GetLastPosition())
+
+    def highlight_viewport(self, force: bool = False):
+        """Highlight the matches and slots on screen, from the matches found by Check. Styling is
+        slow, so overlapping and adjacent ranges are merged and styled in one go, and the rest of
+        the document is left alone."""
+        self._highlight_pending = False
         text = self.document_viewer.file_viewer
-        text.SetStyle(1, len(text.GetValue()), text.GetDefaultStyle())
-        reify = TemplateProcessor(
-            self.input_template_viewer.file_viewer.GetValue(),
-            self.output_template_viewer.file_viewer.GetValue(),
-            False
-        )
-        matches: Tuple[Match] = tuple(reify.find(self.document_viewer.filename))
-        if len(matches) == 0:
+        start, end = self.viewport()
+        if (start, end) == self._highlighted and not force:
+            return
+
+        if self._highlighted is not None:
+            text.SetStyle(self._highlighted[0], min(self._highlighted[1], text.GetLastPosition()),
+                          text.GetDefaultStyle())
+        self._highlighted = (start, end)
+        visible = self.matches.within(start, end)
+        if len(visible) == 0:
             return
 
-        highlight = wx.TextAttr(wx.BLACK, wx.GREEN)
-        highlight.SetFontWeight(wx.FONTWEIGHT_BOLD)
-        for i, m in enumerate(matches):
-            for j in range(len(m.groups())):
-                text.SetStyle(m.start(j + 1), m.end(j + 1), highlight)
+        slot_starts = visible.starts[:, 1:].ravel()
+        slot_ends = visible.ends[:, 1:].ravel()
+        taken_part = slot_starts != -1
+        for style, ranges in ((self.match_style, coalesce(visible.starts[:, 0], visible.ends[:, 0])),
+                              (self.slot_style, coalesce(slot_starts[taken_part], slot_ends[taken_part]))):
+            for range_start, range_end in ranges:
+                text.SetStyle(max(range_start, start), min(range_end, end), style)
+
+    def show_error(self, message: str):
+        self.progress.finish()
+        wx.MessageBox(message, "Error", style=wx.OK | wx.ICON_ERROR)
+
+    def cancel_job(self):
+        self.worker.cancel()
+        self.progress.finish("Cancelled")
+
+    def close_worker(self):
+        self.stop_live_timer()
+        self.worker.close()
+
+    def toggle_live(self, e: wx.CommandEvent):
+        self.live_preview.Show(e.IsChecked())
+        self.Layout()
+        if e.IsChecked():
+            self.live_update()
+        else:
+            self.stop_live_timer()
+
+    def template_changed(self, e: wx.CommandEvent):
+        e.Skip()
+        if not self.live_checkbox.IsChecked():
+            return
+        # Whatever is running was started for the templates as they were before this keystroke, so
+        # it's stopped rather than left to hold up the preview of the new ones. It stops between
+        # matches, and the worker keeps the document and the matches of the last preview.
+        if self.worker.running:
+            self.worker.cancel()
+        if self._live_timer is not None and self._live_timer.IsRunning():
+            self._live_timer.Start(LIVE_DELAY)
+        else:
+            self._live_timer = wx.CallLater(LIVE_DELAY, self.live_update)
+
+    def stop_live_timer(self):
+        if self._live_timer is not None:
+            self._live_timer.Stop()
+            self._live_timer = None
+
+    def live_update(self):
+        """Check the templates as they are now, and list the first few matches with their
+        replacements. The worker keeps the matches of the last preview, so only as much of the
+        document is matched again as the edit needs."""
+        self._live_timer = None
+        input_template, output_template, conserve_whitespace = self.templates()
+        if not input_template:
+            return
+        document = self.document_viewer.file_viewer.GetValue()
+        self.progress.start("Previewing...")
+        # Without an output template (yet), the preview still shows what matches
+        self.worker.submit("preview", (input_template, output_template or None, conserve_whitespace), document,
+                           lambda result: self.show_live_preview(document, *result), self.progress.update,
+                           # Half-written templates are the norm while typing, so errors don't pop up
+                           lambda message: self.progress.finish(message.splitlines()[0]),
+                           args=(LIVE_PREVIEW_MATCHES,))
+
+    def show_live_preview(self, document: str, starts, ends, groupindex, preview):
+        self.show_matches(MatchSet(document, starts, ends, groupindex))
+        lines = [f"{start}: {original!r}" + ("" if replacement is None else f" -> {replacement!r}")
+                 for start, original, replacement in preview]
+        if len(self.matches) > len(preview):
+            lines.append(f"... and {len(self.matches) - len(preview)} more")
+        self.live_preview.ChangeValue("\n".join(lines))
 
 
 class IndexPage (wx.Frame):
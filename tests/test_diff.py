@@ -0,0 +1,66 @@
+import random
+import shutil
+import subprocess
+from typing import *
+
+import pytest
+
+from reify.TemplateProcessor import TemplateProcessor
+from reify.diff import unified_diff
+
+PIECES = ["<b>", "</b>", "x", "yz", " ", "\n", "\n\n"]
+
+pytestmark = pytest.mark.skipif(shutil.which("patch") is None, reason="needs patch")
+
+
+def random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 80)))
+
+
+def random_replacements(rng: random.Random, text: str) -> List:
+    # Sorted and not overlapping, but possibly touching, empty, or replacing text with itself
+    offsets = sorted(rng.randint(0, len(text)) for _ in range(2 * rng.randint(0, 6)))
+    replacements = []
+    for start, end in zip(offsets[::2], offsets[1::2]):
+        replacement = text[start:end] if rng.random() < 0.1 else random_text(rng)[:rng.randint(0, 10)]
+        replacements.append((start, end, replacement))
+    return replacements
+
+
+def patched(tmp_path, text: str, diff: str) -> str:
+    path = tmp_path / "document.txt"
+    path.write_bytes(text.encode())
+    subprocess.run(["patch", "--quiet", "--force", str(path)], input=diff.encode(), check=True)
+    return path.read_bytes().decode()
+
+
+def test_random_replacements_apply_with_patch(tmp_path):
+    rng = random.Random(0)
+    for _ in range(300):
+        text = random_text(rng)
+        replacements = random_replacements(rng, text)
+        expected = text
+        for start, end, replacement in reversed(replacements):
+            expected = expected[:start] + replacement + expected[end:]
+
+        diff = "".join(unified_diff("document.txt", text, replacements, context=rng.randint(0, 3)))
+        if expected == text:
+            assert diff == ""
+        else:
+            assert patched(tmp_path, text, diff) == expected
+
+
+@pytest.mark.parametrize("templates", [("<b>{{x}}</b>", "[{{x}}]"), ("<b>{{x}}</b>", "{{x}}\n"), ("x", "")])
+def test_diff_applies_like_subn(tmp_path, templates):
+    processor = TemplateProcessor(*templates, conserve_whitespace=False, slot_mode="lazy")
+    rng = random.Random(str(templates))
+    for _ in range(100):
+        text = random_text(rng)
+        path = tmp_path / "source.txt"
+        path.write_bytes(text.encode())
+        diff = "".join(processor.diff(str(path)))
+        substituted, count = processor.subn(text)
+        if substituted == text:
+            assert diff == ""
+        else:
+            assert patched(tmp_path, text, diff) == substituted
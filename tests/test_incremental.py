@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from reify.TemplateProcessor import TemplateProcessor
+from reify.incremental import IncrementalMatcher, diff_edit
+
+PIECES = ["<b>", "</b>", "<i>", "</i>", "x", "yz", "12", " ", "\n", "\n"]
+
+MAX_SPAN = 100
+
+TEMPLATES = [
+    ("<b>{{x}}</b>", "[{{x}}]"),
+    ("<b>{{x}}</b> <i>{{y}}</i>", "{{y}}{{x}}"),
+    ("{{x:int}}", "#{{x}}"),
+]
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(PIECES) for _ in range(length))
+
+
+def within_max_span(text: str) -> bool:
+    # Greedy slots look ahead to the end of the line, and collapsed whitespace on into the next one
+    lines = text.split("\n")
+    return all(len(a) + len(b) < MAX_SPAN // 2 for a, b in zip(lines, lines[1:] + [""]))
+
+
+def random_edit(rng: random.Random, text: str) -> str:
+    start = rng.randint(0, len(text))
+    end = rng.randint(start, min(len(text), start + 20))
+    return text[:start] + random_text(rng, rng.randint(0, 5)) + text[end:]
+
+
+@pytest.mark.parametrize("slot_mode", ["greedy", "lazy", "delimited"])
+@pytest.mark.parametrize("templates", TEMPLATES)
+def test_update_matches_full_rematch(templates, slot_mode):
+    rng = random.Random(f"{templates}{slot_mode}")
+    processor = TemplateProcessor(*templates, conserve_whitespace=False, slot_mode=slot_mode)
+    checked = 0
+    for _ in range(60):
+        text = random_text(rng, rng.randint(0, 300))
+        matcher = IncrementalMatcher(processor, text, max_span=MAX_SPAN)
+        for _ in range(10):
+            text = random_edit(rng, text)
+            matcher.update(text)
+            if not within_max_span(text):
+                break
+            checked += 1
+            assert [m.span() for m in matcher.matches] == [m.span() for m in processor.finditer(text)]
+            assert matcher.substituted == processor.sub(text)
+    assert checked > 100
+
+
+def test_output_template_change_keeps_matches():
+    text = "<b>1</b> <b>2</b>"
+    matcher = IncrementalMatcher(TemplateProcessor("<b>{{x}}</b>", "[{{x}}]", False), text)
+    matches = matcher.matches
+    matcher.set_processor(TemplateProcessor("<b>{{x}}</b>", "({{x}})", False))
+    assert matcher.matches is matches
+    # Greedy slots run on to the last </b> on the line
+    assert matcher.substituted == "(1</b> <b>2)"
+
+
+def test_diff_edit():
+    rng = random.Random(0)
+    for _ in range(500):
+        old = random_text(rng, rng.randint(0, 30))
+        new = random_edit(rng, old)
+        edit = diff_edit(old, new)
+        if edit is None:
+            assert old == new
+        else:
+            assert old[:edit.start] + edit.text + old[edit.end:] == new
@@ -0,0 +1,44 @@
+import random
+import re
+
+import numpy as np
+import pytest
+
+from reify.matchset import coalesce
+from reify.rules import RuleSet
+
+PIECES = ["<b>", "</b>", "<i>", "</i>", "x", "yz", " ", "\n"]
+
+
+def random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 150)))
+
+
+@pytest.mark.parametrize("group", [0, "_r0_x", "_r1_y"])
+def test_within_finds_overlapping_matches(group):
+    # The slots of each rule only take part in the matches of that rule
+    processor = RuleSet([("<b>{{x}}</b>", ""), ("<i>{{y}} </i>", "")], False, slot_mode="lazy")
+    rng = random.Random(str(group))
+    for _ in range(200):
+        text = random_text(rng)
+        matches = processor.match_set(text)
+        g = matches.column(group)
+        for _ in range(10):
+            start = rng.randint(0, len(text))
+            end = rng.randint(start, len(text))
+            expected = [i for i in range(len(matches))
+                        if matches.starts[i, g] < end and matches.ends[i, g] > start]
+            within = matches.within(start, end, group)
+            assert within.starts[:, 0].tolist() == matches.starts[expected, 0].tolist()
+
+
+def test_coalesce_merges_overlapping_and_touching_ranges():
+    rng = random.Random(0)
+    for _ in range(500):
+        starts = np.array([rng.randint(0, 50) for _ in range(rng.randint(0, 20))], dtype=np.int64)
+        ends = starts + np.array([rng.randint(0, 8) for _ in range(len(starts))], dtype=np.int64)
+        covered = [False] * 60
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            covered[start:end] = [True] * (end - start)
+        expected = [(m.start(), m.end()) for m in re.finditer("1+", "".join("01"[c] for c in covered))]
+        assert coalesce(starts, ends) == expected
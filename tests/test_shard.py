@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from reify.TemplateProcessor import TemplateProcessor
+
+# Documents made of these pieces have matches that run into the next shard, shards without any
+# match, and matches starting right at a shard boundary
+PIECES = ["<b>", "</b>", "<i>", "</i>", "x", "yz", " ", "\n", "é"]
+
+TEMPLATES = [
+    ("<b>{{x}}</b>", "[{{x}}]"),
+    ("<b>{{x}}</b> <i>{{y}}</i>", "{{y}}{{x}}"),
+    ("<b>{{x:text}}</b>", "<{{x}}>"),
+]
+
+
+def random_document(rng: random.Random, ascii_only: bool) -> str:
+    pieces = [p for p in PIECES if p.isascii()] if ascii_only else PIECES
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 400)))
+
+
+def byte_spans(text: str, matches) -> list:
+    return [(len(text[:m.start()].encode()), len(text[:m.end()].encode())) for m in matches]
+
+
+@pytest.mark.parametrize("slot_mode", ["greedy", "lazy", "delimited"])
+@pytest.mark.parametrize("templates", TEMPLATES)
+def test_parallel_matches_serial(tmp_path, templates, slot_mode):
+    rng = random.Random(f"{templates}{slot_mode}")
+    processor = TemplateProcessor(*templates, conserve_whitespace=False, slot_mode=slot_mode)
+    path = tmp_path / "document.html"
+    # Templates that match raw bytes differently from text are only matched in parallel on ASCII
+    ascii_only = not processor.matches_bytes_as_text("é".encode())
+    for _ in range(5):
+        text = random_document(rng, ascii_only)
+        path.write_bytes(text.encode())
+
+        expected = byte_spans(text, processor.finditer(text))
+        assert [m.span() for m in processor.find_parallel(str(path), jobs=3)] == expected
+        assert processor.count_parallel(str(path), jobs=3) == len(expected)
+        assert b"".join(processor.replace_parallel(str(path), jobs=3)) == processor.sub(text).encode()
+
+
+def test_parallel_with_split_on(tmp_path):
+    processor = TemplateProcessor("{{x}}</b>", "[{{x}}]", conserve_whitespace=True)
+    path = tmp_path / "document.html"
+    rng = random.Random(0)
+    for _ in range(5):
+        text = "\n".join(random_document(rng, ascii_only=True).replace("\n", "") for _ in range(20))
+        path.write_bytes(text.encode())
+
+        expected = [m.span() for m in processor.finditer(text)]
+        assert [m.span() for m in processor.find_parallel(str(path), jobs=3, split_on="\n")] == expected
+
+
+def test_parallel_refuses_templates_bytes_match_differently(tmp_path):
+    processor = TemplateProcessor("<b>{{x:word}}</b>", "[{{x}}]", conserve_whitespace=False)
+    path = tmp_path / "document.html"
+    path.write_bytes("<b>café</b>".encode())
+    with pytest.raises(ValueError):
+        processor.find_parallel(str(path), jobs=2)